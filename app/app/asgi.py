@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+# reads get coroutine views instead of a hop to the shared sync thread
+os.environ.setdefault('RECIPE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'core',
@@ -79,16 +80,84 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DB_POOL=1 takes connections from a pool kept by each process, see
+# core.backends.postgresql_pool, otherwise each thread keeps its connection
+# open for DB_CONN_MAX_AGE seconds. CONN_HEALTH_CHECKS pings a reused
+# connection the first time a request uses it, see core.connections
+DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+
 DATABASES = {
     'default': {
-        'ENGINE':'django.db.backends.postgresql',
+        'ENGINE': 'core.backends.postgresql_pool' if DB_POOL else 'core.backends.postgresql',
         'HOST': 'localhost',
         'NAME': 'recipe_database',
         'USER': 'postgres',
         'PASSWORD': 'bikrant',
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            'MAX_IDLE': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+        },
+    }
+}
+
+# read replicas, DATABASE_REPLICAS=host1,host2 adds replica1, replica2 with the
+# credentials of default. core.routers.ReplicaRouter sends the reads of the
+# api views there, except for users who wrote in the last
+# DATABASE_REPLICA_STICKY_SECONDS, the marker lives in a cache every process
+# must share
+DATABASE_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DATABASE_REPLICAS', '').split(',') if host.strip()]
+DATABASES.update({
+    f'replica{number}': {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    for number, host in enumerate(DATABASE_REPLICA_HOSTS, 1)
+})
+DATABASE_REPLICAS = [f'replica{number}' for number in range(1, len(DATABASE_REPLICA_HOSTS) + 1)]
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+DATABASE_REPLICA_CACHE_ALIAS = 'default'
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the tag/ingredient list cache keeps its version counters here, use a cache
+# shared by every worker process (memcached, redis) when running more than one
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+RECIPE_RESPONSE_CACHE_ALIAS = 'default'
+
+
+# Password hashing, new hashes use PASSWORD_HASHER and older ones are
+# rehashed on the next login, see user.hashers
+PASSWORD_HASHER_CLASSES = {
+    'scrypt': 'user.hashers.ScryptPasswordHasher',
+    'argon2': 'user.hashers.TunableArgon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'scrypt')
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+PASSWORD_HASHING = {
+    'SCRYPT_N': int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14)),
+    'SCRYPT_R': int(os.environ.get('PASSWORD_SCRYPT_R', 8)),
+    'SCRYPT_P': int(os.environ.get('PASSWORD_SCRYPT_P', 1)),
+    'ARGON2_TIME_COST': int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2)),
+    'ARGON2_MEMORY_COST': int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 64 * 1024)),
+    'ARGON2_PARALLELISM': int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 2)),
+    'MAX_WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', 0)) or None,
+    'MAX_QUEUED': int(os.environ.get('PASSWORD_HASHING_MAX_QUEUED', 32)),
+    'QUEUE_TIMEOUT': float(os.environ.get('PASSWORD_HASHING_QUEUE_TIMEOUT', 2)),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -132,9 +201,36 @@ MEDIA_ROOT = '/vol/web/media/'
 
 STATIC_ROOT = '/vol/web/static/'
 
+# how MEDIA_URL files are delivered once the owner is checked, see recipe.media
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('MEDIA_SERVING_BACKEND', 'python'),
+    'ACCEL_REDIRECT_PREFIX': os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/'),
+}
+
+# resized variants of uploaded recipe images, see recipe.tasks
+RECIPE_IMAGE_WORKERS = {
+    'BACKEND': os.environ.get('RECIPE_IMAGE_BACKEND', 'process'),
+    'MAX_WORKERS': int(os.environ.get('RECIPE_IMAGE_MAX_WORKERS', 2)),
+}
+# serve the recipe, tag and ingredient reads from coroutine views, app.asgi
+# turns this on, see recipe.async_views
+RECIPE_ASYNC_VIEWS = os.environ.get('RECIPE_ASYNC_VIEWS', '0') == '1'
+# tag/ingredient matrices behind similar recipes, see recipe.similarity
+RECIPE_SIMILARITY_ROOT = os.environ.get('RECIPE_SIMILARITY_ROOT', '/vol/web/similarity/')
+# largest recipe image accepted, checked while the upload streams in, see recipe.uploads
+RECIPE_IMAGE_MAX_UPLOAD_SIZE = int(os.environ.get('RECIPE_IMAGE_MAX_UPLOAD_SIZE', 20 * 2 ** 20))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-AUTH_USER_MODEL = 'core.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'core.User'
+
+# token -> user cache used by user.authentication.CachedTokenAuthentication
+TOKEN_AUTH_CACHE = {
+    'LOCAL_MAX_SIZE': 10000,
+    'LOCAL_TTL': 30,
+    'SHARED_CACHE_ALIAS': None,
+    'SHARED_TTL': 300,
+}
\ No newline at end of file
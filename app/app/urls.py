@@ -16,10 +16,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
-from django.conf.urls.static import static
+from core.health import healthz, readyz
+from core.views import ConnectionMetricsView
+from recipe.views import MediaView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('healthz',healthz,name='healthz'),
+    path('readyz',readyz,name='readyz'),
     path('api/user/',include('user.urls')),
     path('api/recipe/',include('recipe.urls')),
-] + static(settings.MEDIA_URL,document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('api/instrumentation/connections/',ConnectionMetricsView.as_view(),name='connection-metrics'),
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:name>',MediaView.as_view(),name='media'),
+]
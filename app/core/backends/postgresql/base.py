@@ -0,0 +1,10 @@
+from django.db.backends.postgresql import base
+
+from core.connections import HealthCheckMixin
+
+
+Database = base.Database
+
+
+class DatabaseWrapper(HealthCheckMixin, base.DatabaseWrapper):
+    """ the stock postgresql backend with CONN_HEALTH_CHECKS, see core.connections.HealthCheckMixin """
@@ -0,0 +1,75 @@
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base
+
+from core.connections import ConnectionPool, get_pool
+
+
+Database = base.Database
+
+
+def connect(conn_params):
+    connection = Database.connect(**conn_params)
+    # same as the stock backend, jsonb is decoded by JSONField
+    psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+    return connection
+
+
+def ping(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+def reset(connection):
+    """ roll back whatever the last holder left open, False when the connection is broken """
+    if connection.closed:
+        return False
+    try:
+        if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    postgresql taking its connections from a per process pool, closing a
+    connection gives it back. settings go in DATABASES[alias]['POOL'] with the
+    keys MAX_SIZE, TIMEOUT, MAX_IDLE and MAX_LIFETIME, keep CONN_MAX_AGE at 0
+    so every request returns its connection
+    """
+
+    def pool(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        return get_pool(self.alias, repr(sorted(conn_params.items())), lambda: ConnectionPool(
+            lambda: connect(conn_params),
+            max_size=options.get('MAX_SIZE', 10),
+            timeout=options.get('TIMEOUT', 5.0),
+            max_idle=options.get('MAX_IDLE', 300.0),
+            max_lifetime=options.get('MAX_LIFETIME', 3600.0),
+            check=ping if self.settings_dict.get('CONN_HEALTH_CHECKS') else None,
+            reset=reset,
+        ))
+
+    def get_new_connection(self, conn_params):
+        connection = self.pool(conn_params).acquire()
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            self.pool(self.get_connection_params()).release(self.connection)
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# in memory structures built from one user's rows (autocomplete and pantry
+# indexes, similarity matrices), kept per process and rebuilt after the ttl
+USER_INDEX_CACHE_SIZE = 1000
+USER_INDEX_CACHE_TTL = 600
+
+
+class LRUCache:
+    """ thread safe least recently used cache whose entries expire after ttl seconds """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def user_index_cache(max_size=USER_INDEX_CACHE_SIZE):
+    """ a cache of per user structures, one entry per user and kind """
+    return LRUCache(max_size, USER_INDEX_CACHE_TTL)
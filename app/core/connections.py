@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from django.db import connections
+
+
+class PoolTimeout(Exception):
+    """ no connection was released within the pool timeout """
+
+
+class ConnectionPool:
+    """
+    database connections kept open by a process and handed to one thread
+    at a time. idle connections are reused newest first, so the ones left
+    over after a burst age out, and are checked before being handed out
+    when check is given
+    """
+
+    def __init__(self, connect, max_size=10, timeout=5.0, max_idle=300.0, max_lifetime=3600.0, check=None,
+                 reset=None):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check = check
+        self.reset = reset
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        # (connection, created, released) of the connections nobody holds
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._counters = Counter()
+        self._wait_max = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        while True:
+            connection, stale = self._take(start)
+            for old in stale:
+                self._close(old)
+            if connection is None:
+                connection = self._open()
+            elif self.check is not None and not self.check(connection):
+                self._discard(connection)
+                continue
+            waited = time.monotonic() - start
+            with self._condition:
+                self._counters['checkouts'] += 1
+                self._counters['wait_seconds'] += waited
+                self._wait_max = max(self._wait_max, waited)
+            return connection
+
+    def _take(self, start):
+        """ an idle connection, or None once a slot for a new one is reserved, and the stale idle ones """
+        stale = []
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    connection, created, released = self._idle.pop()
+                    if now - created > self.max_lifetime or now - released > self.max_idle:
+                        stale.append(connection)
+                        self._forget(connection)
+                        continue
+                    return connection, stale
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, stale
+                remaining = self.timeout - (now - start)
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f'no database connection free after {self.timeout}s')
+                self._counters['waits'] += 1
+                self._condition.wait(remaining)
+
+    def _open(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._created[id(connection)] = time.monotonic()
+            self._counters['opened'] += 1
+        return connection
+
+    def release(self, connection, discard=False):
+        """ give a connection back, closing it instead when it is broken or discard is set """
+        with self._condition:
+            known = id(connection) in self._created
+        if not known:
+            # opened by a pool that was replaced since
+            self._close(connection)
+            return
+        if not discard and self.reset is not None:
+            discard = not self.reset(connection)
+        if discard or getattr(connection, 'closed', False):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, self._created[id(connection)], time.monotonic()))
+            self._condition.notify()
+
+    def _forget(self, connection):
+        """ free the slot of a connection, the lock must be held """
+        self._created.pop(id(connection), None)
+        self._size -= 1
+        self._counters['discarded'] += 1
+        self._condition.notify()
+
+    def _discard(self, connection):
+        with self._condition:
+            self._forget(connection)
+        self._close(connection)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._condition:
+            idle = [connection for connection, _, _ in self._idle]
+            self._idle.clear()
+            for connection in idle:
+                self._forget(connection)
+        for connection in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._condition:
+            idle = len(self._idle)
+            return {
+                'size': self._size,
+                'in_use': self._size - idle,
+                'idle': idle,
+                'max_size': self.max_size,
+                'checkouts': self._counters['checkouts'],
+                'waits': self._counters['waits'],
+                'timeouts': self._counters['timeouts'],
+                'opened': self._counters['opened'],
+                'discarded': self._counters['discarded'],
+                'wait_seconds_total': round(self._counters['wait_seconds'], 6),
+                'wait_seconds_max': round(self._wait_max, 6),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, params, factory):
+    """
+    the pool of a database alias in this process, made by factory the first
+    time and again when the connection parameters change, e.g. for the test
+    database
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        # a forked worker must not share the sockets of its parent
+        if pool is None or pool.pid != os.getpid() or pool.params != params:
+            if pool is not None and pool.pid == os.getpid():
+                pool.close_all()
+            pool = _pools[alias] = factory()
+            pool.params = params
+        return pool
+
+
+_health = Counter()
+_health_lock = threading.Lock()
+
+
+class HealthCheckMixin:
+    """
+    database wrapper checking a persistent connection the first time a
+    request uses it, so the server did not drop it while it sat idle, the
+    connection is reopened otherwise. requests that never touch a database
+    pay nothing. backport of CONN_HEALTH_CHECKS from Django 4.1, enabled per
+    database with the same setting
+    """
+    health_check_done = False
+
+    def connect(self):
+        # a connection opened within the request needs no check, connect itself
+        # already goes through set_autocommit
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_health_check_failed(self):
+        if (
+            self.connection is None
+            or self.health_check_done
+            or self.in_atomic_block
+            or not self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            return
+        usable = self.is_usable()
+        with _health_lock:
+            _health[(self.alias, 'checks')] += 1
+            _health[(self.alias, 'failures')] += not usable
+        if not usable:
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def set_autocommit(self, autocommit, force_begin_transaction_with_broken_autocommit=False):
+        self.close_if_health_check_failed()
+        return super().set_autocommit(autocommit, force_begin_transaction_with_broken_autocommit)
+
+
+def check_connections(**kwargs):
+    """ at the start of a request, have every persistent connection checked again on its first use """
+    for connection in connections.all():
+        if isinstance(connection, HealthCheckMixin):
+            connection.health_check_done = False
+
+
+def connection_metrics():
+    """ persistent connection settings, health checks and pool counters of every database """
+    metrics = {}
+    for connection in connections.all():
+        alias = connection.alias
+        pool = _pools.get(alias)
+        with _health_lock:
+            checks, failures = _health[(alias, 'checks')], _health[(alias, 'failures')]
+        metrics[alias] = {
+            'vendor': connection.vendor,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+            'health_checks': {
+                'enabled': bool(connection.settings_dict.get('CONN_HEALTH_CHECKS')),
+                'checks': checks,
+                'failures': failures,
+            },
+            'pool': pool.stats() if pool is not None and pool.pid == os.getpid() else None,
+        }
+    return metrics
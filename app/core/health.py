@@ -0,0 +1,122 @@
+import logging
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import JsonResponse
+
+
+logger = logging.getLogger(__name__)
+
+# seconds /readyz waits for the databases before reporting them down
+READY_TIMEOUT = 2.0
+
+
+# backends whose driver takes a connect timeout, in whole seconds, under this keyword
+CONNECT_TIMEOUT_PARAMS = {'postgresql': 'connect_timeout', 'mysql': 'connect_timeout'}
+
+
+def check_database(alias, timeout=None):
+    """
+    open a real connection to alias and run a trivial query, return None or
+    the error. with timeout, backends taking a connect timeout are probed on
+    a connection of their own that gives up after it, outside of any pool
+    """
+    connection = connections[alias]
+    param = CONNECT_TIMEOUT_PARAMS.get(connection.vendor)
+    if timeout is not None and param is not None:
+        return _probe(connection, param, timeout)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except DatabaseError as error:
+        return str(error) or type(error).__name__
+    finally:
+        # the checks run on throwaway threads, their connections must not linger
+        connection.close()
+    return None
+
+
+def _probe(connection, param, timeout):
+    params = {**connection.get_connection_params(), param: max(1, math.ceil(timeout))}
+    try:
+        raw = connection.Database.connect(**params)
+        try:
+            cursor = raw.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        finally:
+            raw.close()
+    except connection.Database.Error as error:
+        return str(error).strip() or type(error).__name__
+    return None
+
+
+def backoff_delay(attempt, base, cap):
+    """ exponential backoff with equal jitter: half the delay fixed, half random """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def wait_for_database(alias, deadline, base=0.5, cap=5.0, on_retry=None):
+    """ check alias until it answers or time.monotonic() passes deadline, return the last error or None """
+    attempt = 0
+    while True:
+        error = check_database(alias, timeout=max(0.0, deadline - time.monotonic()))
+        remaining = deadline - time.monotonic()
+        if error is None or remaining <= 0:
+            return error
+        delay = min(backoff_delay(attempt, base, cap), remaining)
+        if on_retry is not None:
+            on_retry(alias, error, delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+def run_parallel(function, aliases, timeout=None):
+    """ {alias: function(alias)} computed on one thread per alias, 'timed out' for the slow ones """
+    executor = ThreadPoolExecutor(max_workers=max(1, len(aliases)), thread_name_prefix='db-check')
+    futures = {alias: executor.submit(function, alias) for alias in aliases}
+    results = {}
+    try:
+        start = time.monotonic()
+        for alias, future in futures.items():
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+            try:
+                results[alias] = future.result(timeout=remaining)
+            except TimeoutError:
+                results[alias] = 'timed out'
+    finally:
+        # a connect hanging past the timeout finishes in the background
+        executor.shutdown(wait=False)
+    return results
+
+
+def health_databases():
+    return getattr(settings, 'HEALTH_CHECK_DATABASES', None) or list(connections)
+
+
+def healthz(request):
+    """ liveness: the process answers requests, the databases are not looked at """
+    return JsonResponse({'status': 'ok'})
+
+
+def readyz(request):
+    """ readiness: every database answers a query within READY_TIMEOUT """
+    errors = run_parallel(
+        lambda alias: check_database(alias, READY_TIMEOUT), health_databases(), timeout=READY_TIMEOUT
+    )
+    # the probe is public, driver errors name hosts and users and only go to the log
+    for alias, error in errors.items():
+        if error is not None:
+            logger.warning('readiness check of database %s failed: %s', alias, error)
+    databases = {alias: 'ok' if error is None else 'unavailable' for alias, error in errors.items()}
+    ready = all(error is None for error in errors.values())
+    response = JsonResponse({'status': 'ok' if ready else 'unavailable', 'databases': databases},
+                            status=200 if ready else 503)
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,141 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+
+from core.models import Tag, Ingredient, Recipe
+
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+CSV_LIST_SEPARATOR = ';'
+RECIPE_FIELDS = ('title', 'time_minutes', 'price', 'link')
+UNDECODABLE_MESSAGE = 'The file is not UTF-8 encoded, nothing from here on was imported.'
+
+
+def read_ndjson(lines):
+    """ yield (line number, row) for every non blank line, row is None when it is not a JSON object """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def read_csv(lines):
+    """ yield (line number, row) for every CSV record, tags and ingredients are split on ';' """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        for field in ('tags', 'ingredients'):
+            value = row.get(field) or ''
+            row[field] = [name for name in value.split(CSV_LIST_SEPARATOR) if name.strip()]
+        yield reader.line_num, row
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+class RecipeImporter:
+    """
+    insert recipes from a stream of rows in batches, tag and ingredient
+    names are resolved to ids with a name -> id map that is filled in bulk
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.names = {Tag: {}, Ingredient: {}}
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def run(self, rows):
+        """
+        import (line number, row) pairs and return the number of recipes created.
+        a file that stops decoding ends the import after the rows read so far,
+        the earlier batches are committed, so it is reported like a bad row
+        """
+        rows = iter(rows)
+        last_line = 0
+        while True:
+            batch = []
+            try:
+                batch.extend(islice(rows, self.batch_size))
+            except UnicodeDecodeError:
+                self.import_batch(batch)
+                if batch:
+                    last_line = batch[-1][0]
+                self.add_error(last_line + 1, {'file': [UNDECODABLE_MESSAGE]})
+                return self.created
+            if not batch:
+                return self.created
+            self.import_batch(batch)
+            last_line = batch[-1][0]
+
+    def import_batch(self, batch):
+        recipes, tag_names, ingredient_names = [], [], []
+        for number, row in batch:
+            recipe = self.build_recipe(number, row)
+            if recipe is None:
+                continue
+            recipes.append(recipe)
+            tag_names.append(self.clean_names(row.get('tags')))
+            ingredient_names.append(self.clean_names(row.get('ingredients')))
+        if not recipes:
+            return
+
+        tag_ids = self.resolve(Tag, tag_names)
+        ingredient_ids = self.resolve(Ingredient, ingredient_names)
+        Recipe.objects.bulk_create_with_relations(recipes, tag_ids, ingredient_ids, batch_size=self.batch_size)
+        self.created += len(recipes)
+
+    def build_recipe(self, number, row):
+        """ return an unsaved recipe for row, or None after recording why it is invalid """
+        if row is None:
+            self.add_error(number, {'row': ['Expected a JSON object.']})
+            return None
+        recipe = Recipe(user=self.user, **{field: row.get(field) for field in RECIPE_FIELDS})
+        if recipe.link == '':
+            recipe.link = None
+        try:
+            recipe.clean_fields(exclude=['user', 'image'])
+        except ValidationError as exc:
+            self.add_error(number, exc.message_dict)
+            return None
+        return recipe
+
+    def clean_names(self, names):
+        if not isinstance(names, list):
+            return []
+        return [name.strip()[:200] for name in names if isinstance(name, str) and name.strip()]
+
+    def resolve(self, model, names_per_recipe):
+        """ map every name to an id, creating the missing rows in bulk, and return one id list per recipe """
+        known = self.names[model]
+        missing = {name for names in names_per_recipe for name in names if name not in known}
+        if missing:
+            self.load(model, missing)
+            new = [model(user=self.user, name=name) for name in missing if name not in known]
+            if new:
+                for obj in model.objects.bulk_create_with_pks(new, batch_size=self.batch_size):
+                    known[obj.name] = obj.pk
+        return [[known[name] for name in names] for names in names_per_recipe]
+
+    def load(self, model, names):
+        """ add the ids of existing rows called names to the map, the oldest row wins on duplicates """
+        known = self.names[model]
+        rows = model.objects.filter(user=self.user, name__in=names).order_by('id').values_list('name', 'id')
+        for name, pk in rows.iterator():
+            known.setdefault(name, pk)
+
+    def add_error(self, number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': number, 'errors': errors})
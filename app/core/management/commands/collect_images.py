@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from core.storage import HASHED_DIRECTORY
+
+
+DEFAULT_GRACE_SECONDS = 24 * 60 * 60
+VARIANTS_DIRECTORY = 'variants'
+
+
+def image_stem(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def variant_stem(name):
+    """ variants are named <image stem>-<size>.<ext> """
+    return image_stem(name).rsplit('-', 1)[0]
+
+
+class Command(BaseCommand):
+    """Django command to delete recipe images and variants no recipe refers to"""
+    help = 'Delete recipe images and their variants that no recipe refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int, default=DEFAULT_GRACE_SECONDS,
+            help='keep files modified more recently than this, uploads in flight are not referenced yet'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='only list the files that would be deleted')
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        root = storage.path(HASHED_DIRECTORY)
+        cutoff = time.time() - options['grace_seconds']
+        references = Recipe.objects.image_references()
+        kept_stems = {image_stem(name) for name in references}
+
+        deleted = freed = 0
+        for directory, _, filenames in os.walk(root):
+            is_variant = os.path.basename(directory) == VARIANTS_DIRECTORY
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+                if is_variant:
+                    referenced = variant_stem(name) in kept_stems
+                else:
+                    referenced = name in references
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if referenced or stat.st_mtime > cutoff:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+                deleted += 1
+                freed += stat.st_size
+
+        verb = 'would delete' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} files, {freed} bytes'))
@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import IMPORT_BATCH_SIZE, READERS, RecipeImporter
+
+
+class Command(BaseCommand):
+    """Django command to import recipes for a user from an NDJSON or CSV file"""
+    help = 'Import recipes for a user from an NDJSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file to import, .csv files are read as CSV')
+        parser.add_argument('--user', required=True, help='email of the user owning the recipes')
+        parser.add_argument('--format', choices=sorted(READERS), help='file format, guessed from the extension')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"user {options['user']} does not exist")
+
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        importer = RecipeImporter(user, batch_size=options['batch_size'])
+        try:
+            with open(path, newline='', encoding='utf-8') as lines:
+                importer.run(READERS[file_format](lines))
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for error in importer.errors:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if importer.error_count:
+            self.stderr.write(f'{importer.error_count} rows skipped')
+        self.stdout.write(self.style.SUCCESS(f'{importer.created} recipes imported'))
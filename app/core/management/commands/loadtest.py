@@ -0,0 +1,178 @@
+import asyncio
+import importlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from django.urls import clear_url_caches
+from rest_framework.authtoken.models import Token
+
+from core.models import Recipe, Tag
+
+
+DEFAULT_PATHS = ('/api/recipe/recipes/', '/api/recipe/tag/')
+MODES = ('wsgi', 'asgi', 'asgi-async')
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def reload_urls(async_views):
+    """ rebuild the url patterns with or without the coroutine read views """
+    with override_settings(RECIPE_ASYNC_VIEWS=async_views):
+        for module in ('recipe.urls', settings.ROOT_URLCONF):
+            if module in sys.modules:
+                importlib.reload(sys.modules[module])
+    clear_url_caches()
+
+
+class Command(BaseCommand):
+    """Django command comparing latency and throughput of the read endpoints under wsgi and asgi"""
+    help = (
+        'Load test the recipe read endpoints in process through the WSGI handler, the ASGI handler '
+        'with the sync views, and the ASGI handler with the coroutine views, reporting p50 and p99'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50, help='clients waiting for a response at once')
+        parser.add_argument(
+            '--wsgi-threads', type=int, default=8, help='request threads of the wsgi server, like gunicorn --threads'
+        )
+        parser.add_argument(
+            '--slow-client-ms', type=int, default=0,
+            help='time each client takes to read its response, holds a wsgi thread but not an asgi connection'
+        )
+        parser.add_argument('--recipes', type=int, default=50, help='recipes created for the test user')
+        parser.add_argument('--path', action='append', dest='paths', help='endpoint to request, repeatable')
+        parser.add_argument('--mode', action='append', dest='modes', choices=MODES)
+
+    def handle(self, *args, **options):
+        user, token = self.seed(options['recipes'])
+        try:
+            self.stdout.write(f'{"mode":<12} {"path":<28} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>7}')
+            for mode in options['modes'] or MODES:
+                for path in options['paths'] or DEFAULT_PATHS:
+                    self.report(mode, path, self.run(mode, path, token, options), options['requests'])
+        finally:
+            reload_urls(settings.RECIPE_ASYNC_VIEWS)
+            user.delete()
+
+    def seed(self, count):
+        """ a committed user with recipes, the handlers read it from their own threads """
+        user = get_user_model().objects.create_user('loadtest@example.com', None)
+        tags = Tag.objects.bulk_create_with_pks([Tag(user=user, name=f'tag {i}') for i in range(10)])
+        recipes = [
+            Recipe(user=user, title=f'recipe {i}', time_minutes=10 + i % 50, price=1 + i % 20) for i in range(count)
+        ]
+        Recipe.objects.bulk_create_with_relations(
+            recipes, [[tags[i % 10].pk] for i in range(count)], [[] for _ in range(count)]
+        )
+        return user, Token.objects.create(user=user).key
+
+    def run(self, mode, path, token, options):
+        reload_urls(mode == 'asgi-async')
+        if mode == 'wsgi':
+            return self.run_wsgi(path, token, options)
+        return asyncio.run(self.run_asgi(path, token, options))
+
+    def run_wsgi(self, path, token, options):
+        application = get_wsgi_application()
+        delay = options['slow_client_ms'] / 1000
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def serve(started):
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_AUTHORIZATION': f'Token {token}',
+                'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            body = application(environ, lambda line, headers: status.append(line))
+            try:
+                for _ in body:
+                    pass
+                # the server thread stays busy until the client has read everything
+                time.sleep(delay)
+            finally:
+                body.close()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if not status[0].startswith('200'):
+                    errors.append(status[0])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['wsgi_threads']) as server:
+            slots = threading.BoundedSemaphore(options['concurrency'])
+
+            def submit():
+                slots.acquire()
+                future = server.submit(serve, time.perf_counter())
+                future.add_done_callback(lambda _: slots.release())
+                return future
+
+            for future in [submit() for _ in range(options['requests'])]:
+                future.result()
+        return latencies, errors, time.perf_counter() - start
+
+    async def run_asgi(self, path, token, options):
+        application = get_asgi_application()
+        delay = options['slow_client_ms'] / 1000
+        slots = asyncio.Semaphore(options['concurrency'])
+        latencies, errors = [], []
+
+        async def client():
+            async with slots:
+                started = time.perf_counter()
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                    'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+                    'headers': [(b'host', b'testserver'), (b'authorization', f'Token {token}'.encode())],
+                }
+                messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+                status = []
+
+                async def receive():
+                    if messages:
+                        return messages.pop()
+                    await asyncio.Event().wait()
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+                    elif not message.get('more_body'):
+                        # a slow reader only keeps this coroutine waiting
+                        await asyncio.sleep(delay)
+
+                await application(scope, receive, send)
+                latencies.append(time.perf_counter() - started)
+                if status[0] != 200:
+                    errors.append(status[0])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['requests'])))
+        return latencies, errors, time.perf_counter() - start
+
+    def report(self, mode, path, result, count):
+        latencies, errors, elapsed = result
+        latencies = sorted(latencies)
+        self.stdout.write(
+            f'{mode:<12} {path:<28} {count / elapsed:9.1f} {percentile(latencies, 50) * 1e3:9.2f} '
+            f'{percentile(latencies, 99) * 1e3:9.2f} {len(errors):7d}'
+        )
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import stats
+
+
+class Command(BaseCommand):
+    """Django command to recompute the recipe statistics rollup from the recipe tables"""
+    help = 'Recompute the recipe statistics of every user, or of one user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email of the only user to rebuild')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['user']:
+            users = users.filter(email=options['user'])
+            if not users.exists():
+                raise CommandError(f"no user with email {options['user']}")
+
+        rebuilt = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            stats.rebuild(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'rebuilt statistics of {rebuilt} users'))
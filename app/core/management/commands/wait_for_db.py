@@ -1,21 +1,48 @@
 import time
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connections
-from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+
+from core.health import run_parallel, wait_for_database
+
+
+# seconds past the deadline left to the last attempt, the driver rounds its
+# connect timeout up to whole seconds
+GRACE = 1.0
 
 
 class Command(BaseCommand):
-    """Django command to pause execution untill database connectionn is made"""
+    """Django command to pause execution until the databases accept queries"""
+    help = 'Wait until every given database opens a connection and answers SELECT 1'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='alias to wait for, repeatable, default is default'
+        )
+        parser.add_argument('--all', action='store_true', help='wait for every alias in DATABASES')
+        parser.add_argument('--timeout', type=float, default=60, help='seconds before giving up')
+        parser.add_argument('--interval', type=float, default=0.5, help='first delay between attempts')
+        parser.add_argument('--max-interval', type=float, default=5, help='longest delay between attempts')
 
     def handle(self,*args,**options):
-        self.stdout.write('waiting for database...')
-        db_conn = None
-        while not db_conn:
-            try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('Database unavailable, waiting for 1 sec ')
-                time.sleep(1)
-
-        self.stdout.write(self.style.SUCCESS('Database available'))
\ No newline at end of file
+        aliases = list(connections) if options['all'] else options['databases'] or ['default']
+        unknown = set(aliases) - set(connections)
+        if unknown:
+            raise CommandError(f"unknown database aliases: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(f"waiting for {', '.join(aliases)}...")
+        deadline = time.monotonic() + options['timeout']
+        # a connect hanging past the deadline is reported instead of waited for
+        errors = run_parallel(lambda alias: wait_for_database(
+            alias, deadline, options['interval'], options['max_interval'], self.retrying
+        ), aliases, timeout=max(0.0, deadline - time.monotonic()) + GRACE)
+
+        failed = {alias: error for alias, error in errors.items() if error is not None}
+        if failed:
+            for alias, error in failed.items():
+                self.stderr.write(f'{alias}: {error}')
+            raise CommandError(f"database unavailable after {options['timeout']}s: {', '.join(sorted(failed))}")
+        self.stdout.write(self.style.SUCCESS('Database available'))
+
+    def retrying(self, alias, error, delay):
+        self.stdout.write(f'{alias} unavailable, retrying in {delay:.1f}s: {error}')
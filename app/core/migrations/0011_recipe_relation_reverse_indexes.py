@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    the auto created through tables only get a unique (recipe_id, x_id) index,
+    add the reverse order so tag/ingredient -> recipe lookups are index only
+    """
+
+    dependencies = [
+        ('core', '0010_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_tag_tag_recipe_idx ON core_recipe_tag (tag_id, recipe_id);',
+            'DROP INDEX core_recipe_tag_tag_recipe_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX core_recipe_ingredient_ingredient_recipe_idx '
+            'ON core_recipe_ingredient (ingredient_id, recipe_id);',
+            'DROP INDEX core_recipe_ingredient_ingredient_recipe_idx;',
+        ),
+    ]
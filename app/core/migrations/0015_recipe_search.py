@@ -0,0 +1,77 @@
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+# the schema and backfill as of this migration, later changes to core.search
+# must not change what it creates
+
+POSTGRES_BACKFILL_SQL = """
+UPDATE core_recipe SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(core_recipe.title, '')), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(core_tag.name, ' ') FROM core_tag
+        JOIN core_recipe_tag ON core_recipe_tag.tag_id = core_tag.id
+        WHERE core_recipe_tag.recipe_id = core_recipe.id
+    ), '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(core_ingredient.name, ' ') FROM core_ingredient
+        JOIN core_recipe_ingredient ON core_recipe_ingredient.ingredient_id = core_ingredient.id
+        WHERE core_recipe_ingredient.recipe_id = core_recipe.id
+    ), '')), 'B')
+"""
+
+SQLITE_BACKFILL_SQL = """
+INSERT INTO core_recipe_fts (rowid, title, tags, ingredients)
+SELECT core_recipe.id, core_recipe.title,
+    coalesce((
+        SELECT group_concat(core_tag.name, ' ') FROM core_tag
+        JOIN core_recipe_tag ON core_recipe_tag.tag_id = core_tag.id
+        WHERE core_recipe_tag.recipe_id = core_recipe.id
+    ), ''),
+    coalesce((
+        SELECT group_concat(core_ingredient.name, ' ') FROM core_ingredient
+        JOIN core_recipe_ingredient ON core_recipe_ingredient.ingredient_id = core_ingredient.id
+        WHERE core_recipe_ingredient.recipe_id = core_recipe.id
+    ), '')
+FROM core_recipe
+"""
+
+
+def create_search_index(apps, schema_editor):
+    """ a GIN index over search_vector on postgres, an FTS5 table on sqlite, then fill it """
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX core_recipe_search_idx ON core_recipe USING gin (search_vector);')
+        schema_editor.execute(
+            POSTGRES_BACKFILL_SQL, {'config': getattr(settings, 'RECIPE_SEARCH_CONFIG', 'english')}
+        )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE core_recipe_fts USING fts5(title, tags, ingredients, tokenize = 'porter unicode61');"
+        )
+        schema_editor.execute(SQLITE_BACKFILL_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX core_recipe_search_idx;')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE core_recipe_fts;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
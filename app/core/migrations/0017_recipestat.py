@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_attr_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('total', 'Total'), ('price', 'Price'), ('time', 'Time'), ('tag', 'Tag'), ('ingredient', 'Ingredient')], max_length=10)),
+                ('key', models.BigIntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipestat',
+            index=models.Index(fields=['user', 'kind', 'value'], name='core_recipestat_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipestat',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'key'), name='core_recipestat_user_kind_key_uniq'),
+        ),
+    ]
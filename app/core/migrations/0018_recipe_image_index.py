@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_recipestat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['image'], name='core_recipe_image_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
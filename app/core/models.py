@@ -1,8 +1,12 @@
 import uuid
 import os
-from django.db import models
+from django.db import models,connections,transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser,BaseUserManager,PermissionsMixin
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
+from core.signals import bulk_saved,bulk_saving
+from core.storage import ContentAddressedStorage
 # Create your models here.
 
 
@@ -46,11 +50,77 @@ class User(AbstractBaseUser,PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+class BulkQuerySet(models.QuerySet):
+    """
+    queryset with bulk writes that always set primary keys, every bulk write
+    sends core.signals.bulk_saved since the per object signals are skipped
+    """
+
+    def bulk_create_with_pks(self,objs,batch_size=None):
+        """ bulk_create that sets the new ids on every backend """
+        objs = self._insert_with_pks(objs,batch_size)
+        bulk_saved.send(sender=self.model,instances=objs,created=True,update_fields=(),relations=())
+        return objs
+
+    def bulk_update(self,objs,fields,batch_size=None):
+        bulk_saving.send(sender=self.model,instances=objs,created=False,update_fields=tuple(fields),relations=())
+        rows = super().bulk_update(objs,fields,batch_size=batch_size)
+        bulk_saved.send(sender=self.model,instances=objs,created=False,update_fields=tuple(fields),relations=())
+        return rows
+
+    def _insert_with_pks(self,objs,batch_size):
+        if connections[self.db].features.can_return_rows_from_bulk_insert:
+            return self.bulk_create(objs,batch_size=batch_size)
+        # one INSERT per row on backends that cannot return the ids of a
+        # multi row insert, without going through save() and its signals
+        opts = self.model._meta
+        fields = [field for field in opts.concrete_fields if not field.primary_key]
+        with transaction.atomic(using=self.db,savepoint=False):
+            for obj in objs:
+                returned = self._insert([obj],fields=fields,returning_fields=opts.db_returning_fields,using=self.db)
+                for value,field in zip(returned[0],opts.db_returning_fields):
+                    setattr(obj,field.attname,value)
+                obj._state.adding = False
+                obj._state.db = self.db
+        return objs
+
+
+class RecipeAttrQuerySet(BulkQuerySet):
+    """ queryset helpers for models linked to recipes through a m2m field """
+
+    def _recipe_links(self):
+        """ return the through table queryset and its column pointing at this model """
+        field = self.model._meta.get_field('recipe').field
+        return field.remote_field.through.objects.all(),field.m2m_reverse_name()
+
+    def assigned(self):
+        """ keep the rows used by at least one recipe, as a semi-join """
+        links,column = self._recipe_links()
+        return self.filter(models.Exists(links.filter(**{column: models.OuterRef('pk')})))
+
+    def with_recipe_count(self):
+        """ annotate each row with the number of recipes using it """
+        links,column = self._recipe_links()
+        counts = links.filter(**{column: models.OuterRef('pk')}).order_by().values(column).annotate(
+            count=models.Count('*')
+        ).values('count')
+        return self.annotate(recipe_count=Coalesce(
+            models.Subquery(counts,output_field=models.IntegerField()),0
+        ))
+
+
 class Tag(models.Model):
     """ Model tag to be user for recipe """
     name = models.CharField(max_length=200)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE)
 
+    objects = RecipeAttrQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user','name','id'],name='core_tag_user_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -60,12 +130,103 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE)
 
+    objects = RecipeAttrQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user','name','id'],name='core_ingredient_user_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(BulkQuerySet):
+    """ queryset helpers that load recipe relations in bulk """
+
+    def bulk_create_with_relations(self,recipes,tag_ids,ingredient_ids,batch_size=None):
+        """
+        insert recipes and their through table rows, tag_ids and ingredient_ids
+        hold one list of ids per recipe
+        """
+        with transaction.atomic(using=self.db):
+            recipes = self._insert_with_pks(recipes,batch_size)
+            self._bulk_link('tag',recipes,tag_ids,batch_size)
+            self._bulk_link('ingredient',recipes,ingredient_ids,batch_size)
+        bulk_saved.send(
+            sender=self.model,instances=recipes,created=True,update_fields=(),relations=('tag','ingredient')
+        )
+        return recipes
+
+    def bulk_set_relations(self,field,recipes,ids,batch_size=None):
+        """ replace the m2m rows of field for every recipe with the matching list of ids """
+        through = self.model._meta.get_field(field).remote_field.through
+        with transaction.atomic(using=self.db):
+            bulk_saving.send(sender=self.model,instances=recipes,created=False,update_fields=(),relations=(field,))
+            through.objects.using(self.db).filter(recipe__in=[recipe.pk for recipe in recipes]).delete()
+            self._bulk_link(field,recipes,ids,batch_size)
+        bulk_saved.send(sender=self.model,instances=recipes,created=False,update_fields=(),relations=(field,))
+
+    def _bulk_link(self,field,recipes,ids,batch_size):
+        through = self.model._meta.get_field(field).remote_field.through
+        column = f'{field}_id'
+        # a recipe listed twice must not insert the same pair twice
+        pairs = dict.fromkeys((recipe.pk,pk) for recipe,pks in zip(recipes,ids) for pk in pks)
+        through.objects.using(self.db).bulk_create([
+            through(recipe_id=recipe_id,**{column: pk}) for recipe_id,pk in pairs
+        ],batch_size=batch_size)
+
+    def with_related_ids(self):
+        """ prefetch only the ids of tags and ingredients, enough for RecipeSerializer """
+        return self.prefetch_related(
+            models.Prefetch('tag', queryset=Tag.objects.only('id')),
+            models.Prefetch('ingredient', queryset=Ingredient.objects.only('id')),
+        )
+
+    def filter_related(self,field,ids,match_all=False):
+        """
+        filter recipes linked to any (or all) of ids through the m2m field,
+        using a semi-join on the through table so no row is duplicated
+        """
+        column = f'{field}_id'
+        ids = set(ids)
+        links = self.model._meta.get_field(field).remote_field.through.objects.filter(
+            recipe_id=models.OuterRef('pk'),**{f'{column}__in': ids}
+        )
+        if not match_all:
+            return self.filter(models.Exists(links))
+        matched = links.order_by().values('recipe_id').annotate(
+            matched=models.Count(column)
+        ).values('matched')
+        return self.alias(
+            **{f'{field}_matched': models.Subquery(matched,output_field=models.IntegerField())}
+        ).filter(**{f'{field}_matched': len(ids)})
+
+    def with_related(self):
+        """ prefetch tags and ingredients with the columns used by RecipeDetailSerializer """
+        return self.prefetch_related(
+            models.Prefetch('tag', queryset=Tag.objects.only('id', 'name')),
+            models.Prefetch('ingredient', queryset=Ingredient.objects.only('id', 'name')),
+        )
+
+    def image_references(self):
+        """ return image name -> number of recipes using it, the reference counts of the image storage """
+        rows = self.exclude(image='').exclude(image__isnull=True).order_by().values('image').annotate(
+            references=models.Count('id')
+        ).values_list('image','references')
+        return dict(rows.iterator())
+
+
 class Recipe(models.Model):
     """ models for recipe """
+
+    class ImageStatus(models.TextChoices):
+        NONE = 'none'
+        PENDING = 'pending'
+        PROCESSING = 'processing'
+        READY = 'ready'
+        FAILED = 'failed'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=5,decimal_places=2)
@@ -73,8 +234,57 @@ class Recipe(models.Model):
     tag = models.ManyToManyField('Tag')
     ingredient = models.ManyToManyField('Ingredient')
     link = models.CharField(max_length=200,blank=True,null=True)
-    image = models.ImageField(null=True,upload_to=recipe_image_file_path)
+    # stored once per distinct content, see core.storage
+    image = models.ImageField(null=True,upload_to=recipe_image_file_path,storage=ContentAddressedStorage())
+    image_status = models.CharField(max_length=10,choices=ImageStatus.choices,default=ImageStatus.NONE)
+    # variant name -> format -> file name in MEDIA_ROOT, filled by recipe.tasks
+    image_variants = models.JSONField(default=dict,blank=True)
+    # also bumped when tags or ingredients change, used for conditional GET
+    updated_at = models.DateTimeField(auto_now=True)
+    # title, tag and ingredient names, maintained by core.search, GIN indexed on postgres
+    search_vector = SearchVectorField(null=True,editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user','id'],name='core_recipe_user_id_idx'),
+            # equality and prefix (LIKE 'x%') lookups from uploads and media, the
+            # pattern opclass lets postgres use it for both whatever the collation
+            models.Index(fields=['image'],name='core_recipe_image_idx',opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         """ return string representation """
         return  self.title
+
+
+class RecipeStat(models.Model):
+    """ one counter of the recipe statistics of a user, kept up to date by core.stats """
+
+    class Kind(models.TextChoices):
+        # key 0 counts recipes, 1 sums prices in cents, 2 sums time_minutes
+        TOTAL = 'total'
+        # key is a price bucket, value the recipes in it
+        PRICE = 'price'
+        # key is a number of minutes, value the recipes taking that long
+        TIME = 'time'
+        # key is a tag or ingredient id, value the recipes using it
+        TAG = 'tag'
+        INGREDIENT = 'ingredient'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10,choices=Kind.choices)
+    key = models.BigIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user','kind','key'],name='core_recipestat_user_kind_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user','kind','value'],name='core_recipestat_top_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.key}: {self.value}'
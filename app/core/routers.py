@@ -0,0 +1,81 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _marker_key(user_id):
+    return f'db-routing:wrote:{user_id}'
+
+
+def _marker_cache():
+    return caches[getattr(settings, 'DATABASE_REPLICA_CACHE_ALIAS', 'default')]
+
+
+def mark_write(user_id):
+    """ keep the reads of a user on the primary until the replicas caught up with the write """
+    _marker_cache().set(_marker_key(user_id), True, getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5))
+
+
+def recently_wrote(user_id):
+    return bool(_marker_cache().get(_marker_key(user_id)))
+
+
+class ReplicaRouter:
+    """
+    reads go to a random replica while a view marked them safe for it, everything
+    else, writes and reads inside a transaction go to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or not _read_from_replica.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    serve the safe methods of a view from replicas unless the user wrote
+    within the sticky window, and start that window after every other method
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        # reset however the view ends, an uncaught exception skips finalize_response
+        # and would leave the thread reading from replicas
+        token = _read_from_replica.set(False)
+        self._writer_id = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+            if self._writer_id is not None:
+                mark_write(self._writer_id)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not replicas():
+            return
+        user_id = request.user.pk
+        if request.method not in SAFE_METHODS:
+            _read_from_replica.set(False)
+            self._writer_id = user_id
+        elif user_id is None or not recently_wrote(user_id):
+            _read_from_replica.set(True)
@@ -0,0 +1,166 @@
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+
+FTS_TABLE = 'core_recipe_fts'
+# recipes indexed per statement, keeps SQLite under its parameter limit
+INDEX_BATCH_SIZE = 500
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# title matches weigh more than tag and ingredient matches
+SQLITE_WEIGHTS = (10.0, 4.0, 4.0)
+
+POSTGRES_INDEX_SQL = """
+UPDATE core_recipe SET search_vector =
+    setweight(to_tsvector(%(config)s::regconfig, coalesce(core_recipe.title, '')), 'A') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(core_tag.name, ' ') FROM core_tag
+        JOIN core_recipe_tag ON core_recipe_tag.tag_id = core_tag.id
+        WHERE core_recipe_tag.recipe_id = core_recipe.id
+    ), '')), 'B') ||
+    setweight(to_tsvector(%(config)s::regconfig, coalesce((
+        SELECT string_agg(core_ingredient.name, ' ') FROM core_ingredient
+        JOIN core_recipe_ingredient ON core_recipe_ingredient.ingredient_id = core_ingredient.id
+        WHERE core_recipe_ingredient.recipe_id = core_recipe.id
+    ), '')), 'B')
+"""
+
+SQLITE_INDEX_SQL = f"""
+INSERT INTO {FTS_TABLE} (rowid, title, tags, ingredients)
+SELECT core_recipe.id, core_recipe.title,
+    coalesce((
+        SELECT group_concat(core_tag.name, ' ') FROM core_tag
+        JOIN core_recipe_tag ON core_recipe_tag.tag_id = core_tag.id
+        WHERE core_recipe_tag.recipe_id = core_recipe.id
+    ), ''),
+    coalesce((
+        SELECT group_concat(core_ingredient.name, ' ') FROM core_ingredient
+        JOIN core_recipe_ingredient ON core_recipe_ingredient.ingredient_id = core_ingredient.id
+        WHERE core_recipe_ingredient.recipe_id = core_recipe.id
+    ), '')
+FROM core_recipe
+"""
+
+
+def search_config():
+    """ text search configuration used to stem words on postgres """
+    return getattr(settings, 'RECIPE_SEARCH_CONFIG', 'english')
+
+
+def _connection():
+    from core.models import Recipe
+    return connections[router.db_for_write(Recipe)]
+
+
+def _batches(ids):
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), INDEX_BATCH_SIZE):
+        yield ids[start:start + INDEX_BATCH_SIZE]
+
+
+def index_recipes(ids, connection=None):
+    """ recompute the search document of the recipes with the given ids """
+    connection = connection or _connection()
+    with connection.cursor() as cursor:
+        for batch in _batches(ids):
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    POSTGRES_INDEX_SQL + ' WHERE core_recipe.id = ANY(%(ids)s)',
+                    {'config': search_config(), 'ids': batch}
+                )
+            elif connection.vendor == 'sqlite':
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+                cursor.execute(SQLITE_INDEX_SQL + f' WHERE core_recipe.id IN ({placeholders})', batch)
+
+
+def index_on_commit(ids, connection=None):
+    """
+    index the recipes once the transaction commits, every write of the
+    transaction adds its ids to one set indexed by a single index_recipes
+    """
+    connection = connection or _connection()
+    if not connection.in_atomic_block:
+        index_recipes(ids, connection)
+        return
+    pending = getattr(connection, 'search_pending', None)
+    # a rolled back transaction or savepoint drops the callback, and with it the set
+    if pending is None or pending.flush not in [func for _, func in connection.run_on_commit]:
+        pending = connection.search_pending = _PendingIndex(connection)
+        transaction.on_commit(pending.flush, using=connection.alias)
+    pending.ids.update(ids)
+
+
+class _PendingIndex:
+    def __init__(self, connection):
+        self.connection = connection
+        self.ids = set()
+
+    def flush(self):
+        if getattr(self.connection, 'search_pending', None) is self:
+            self.connection.search_pending = None
+        index_recipes(self.ids, self.connection)
+
+
+def unindex_recipes(ids, connection=None):
+    """ forget deleted recipes, the postgres document goes away with its row """
+    connection = connection or _connection()
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for batch in _batches(ids):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+
+
+def rebuild_index(connection=None):
+    """ recompute the search document of every recipe """
+    connection = connection or _connection()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(POSTGRES_INDEX_SQL, {'config': search_config()})
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(SQLITE_INDEX_SQL)
+
+
+def fts5_query(text):
+    """ turn free text into an FTS5 query matching every word, quoted so user input is never syntax """
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def search_recipes(user, text, limit):
+    """ return the ids of the best matching recipes of user, best first """
+    from core.models import Recipe
+    connection = _connection()
+    limit = min(limit, SEARCH_MAX_LIMIT)
+    recipes = Recipe.objects.filter(user=user)
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        query = SearchQuery(text, config=search_config(), search_type='websearch')
+        ranked = recipes.filter(search_vector=query).annotate(
+            rank=SearchRank('search_vector', query)
+        ).order_by('-rank', '-id')
+        return list(ranked.values_list('id', flat=True)[:limit])
+
+    if connection.vendor == 'sqlite':
+        match = fts5_query(text)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT core_recipe.id FROM {FTS_TABLE} '
+                f'JOIN core_recipe ON core_recipe.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND core_recipe.user_id = %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), core_recipe.id DESC LIMIT %s',
+                [match, user.pk, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # no text index on other databases
+    return list(recipes.filter(title__icontains=text).order_by('-id').values_list('id', flat=True)[:limit])
@@ -0,0 +1,15 @@
+from django.dispatch import Signal
+
+
+# sent by core.models.BulkQuerySet after rows were written without the
+# per object post_save and m2m_changed signals, receivers get the model as
+# sender and the keyword arguments
+#   instances: the saved objects
+#   created: True for inserts, False for updates
+#   update_fields: the updated columns, empty for inserts
+#   relations: names of the m2m fields whose through rows were replaced
+bulk_saved = Signal()
+
+# sent by core.models.BulkQuerySet before rows are updated in bulk, the way
+# pre_save precedes post_save, with the arguments bulk_saved will get
+bulk_saving = Signal()
@@ -0,0 +1,170 @@
+import math
+from collections import Counter
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from core.models import Tag, Ingredient, Recipe, RecipeStat
+
+
+Kind = RecipeStat.Kind
+RECIPES, PRICE_SUM, TIME_SUM = 0, 1, 2
+PRICE_BUCKET = Decimal('0.50')
+# recipes taking longer fall in this bucket
+TIME_CAP = 24 * 60
+PERCENTILES = (50, 90, 99)
+TOP_LIMIT = 10
+TOP_MAX_LIMIT = 100
+RELATED_KINDS = (('tag', Kind.TAG, Tag), ('ingredient', Kind.INGREDIENT, Ingredient))
+
+
+def price_bucket(price):
+    return math.floor(Decimal(str(price)) / PRICE_BUCKET)
+
+
+def time_bucket(time_minutes):
+    return min(int(time_minutes), TIME_CAP)
+
+
+def recipe_deltas(price, time_minutes, sign=1, count=1):
+    """ the counters moved by adding (sign 1) or removing (sign -1) count recipes with these values """
+    n = sign * count
+    return Counter({
+        (Kind.TOTAL, RECIPES): n,
+        (Kind.TOTAL, PRICE_SUM): n * int(Decimal(str(price)) * 100),
+        (Kind.TOTAL, TIME_SUM): n * int(time_minutes),
+        (Kind.PRICE, price_bucket(price)): n,
+        (Kind.TIME, time_bucket(time_minutes)): n,
+    })
+
+
+def apply(user_id, deltas):
+    """ add deltas, a Counter of (kind, key) -> change, to the user's counters with one update each """
+    for (kind, key), delta in deltas.items():
+        if not delta:
+            continue
+        counters = RecipeStat.objects.filter(user_id=user_id, kind=kind, key=key)
+        if counters.update(value=F('value') + delta) or delta < 0:
+            # a missing counter taken down belongs to a user being deleted
+            continue
+        try:
+            with transaction.atomic():
+                RecipeStat.objects.create(user_id=user_id, kind=kind, key=key, value=delta)
+        except IntegrityError:
+            # created by a concurrent writer in the meantime
+            counters.update(value=F('value') + delta)
+
+
+def link_deltas(field, related_ids, sign=1):
+    kind = Kind.TAG if field == 'tag' else Kind.INGREDIENT
+    return Counter({(kind, related_id): sign for related_id in related_ids})
+
+
+def created_deltas(recipes):
+    """ the counters moved by recipes inserted in bulk with their relations """
+    deltas = Counter()
+    for recipe in recipes:
+        deltas.update(recipe_deltas(recipe.price, recipe.time_minutes))
+    ids = [recipe.pk for recipe in recipes]
+    for field, kind, _ in RELATED_KINDS:
+        column = f'{field}_id'
+        links = Recipe._meta.get_field(field).remote_field.through.objects.filter(recipe_id__in=ids)
+        for related_id, count in links.order_by().values(column).annotate(n=Count('id')).values_list(column, 'n'):
+            deltas[(kind, related_id)] += count
+    return deltas
+
+
+def recipe_links(recipe_ids, fields):
+    """ {recipe id: {field: [related ids]}} read from the through tables of fields """
+    links = {}
+    for field in fields:
+        through = Recipe._meta.get_field(field).remote_field.through
+        rows = through.objects.filter(recipe_id__in=list(recipe_ids)).values_list('recipe_id', f'{field}_id')
+        for recipe_id, related_id in rows.iterator():
+            links.setdefault(recipe_id, {}).setdefault(field, []).append(related_id)
+    return links
+
+
+def rebuild(user_id):
+    """ recompute every counter of a user from the recipe and through tables """
+    deltas = Counter()
+    values = Recipe.objects.filter(user_id=user_id).order_by().values('price', 'time_minutes').annotate(
+        n=Count('id')
+    ).values_list('price', 'time_minutes', 'n')
+    for price, time_minutes, count in values.iterator():
+        deltas.update(recipe_deltas(price, time_minutes, count=count))
+    for field, kind, _ in RELATED_KINDS:
+        column = f'{field}_id'
+        links = Recipe._meta.get_field(field).remote_field.through.objects.filter(recipe__user_id=user_id)
+        for related_id, count in links.order_by().values(column).annotate(n=Count('id')).values_list(column, 'n'):
+            deltas[(kind, related_id)] += count
+
+    with transaction.atomic():
+        RecipeStat.objects.filter(user_id=user_id).delete()
+        RecipeStat.objects.bulk_create([
+            RecipeStat(user_id=user_id, kind=kind, key=key, value=value)
+            for (kind, key), value in deltas.items() if value
+        ])
+
+
+def percentiles(histogram, width):
+    """
+    estimate percentiles from sorted (bucket, count) pairs, interpolating
+    linearly inside the bucket holding the rank
+    """
+    total = sum(count for _, count in histogram)
+    result = {}
+    for percentile in PERCENTILES:
+        rank = total * percentile / 100
+        seen = 0
+        for bucket, count in histogram:
+            if seen + count >= rank:
+                result[f'p{percentile}'] = float(bucket * width) + float(width) * (rank - seen) / count
+                break
+            seen += count
+    return result
+
+
+def _top(user_id, kind, model, limit):
+    counters = RecipeStat.objects.filter(user_id=user_id, kind=kind, value__gt=0).order_by('-value', 'key')
+    top = list(counters.values_list('key', 'value')[:limit])
+    names = model.objects.filter(user_id=user_id).in_bulk([key for key, _ in top])
+    return [
+        {'id': key, 'name': names[key].name, 'recipe_count': value}
+        for key, value in top if key in names
+    ]
+
+
+def user_stats(user_id, top=TOP_LIMIT):
+    """ the statistics of a user's recipes, read from the counters only """
+    counters = RecipeStat.objects.filter(
+        user_id=user_id, kind__in=[Kind.TOTAL, Kind.PRICE, Kind.TIME]
+    ).exclude(value=0).order_by('kind', 'key').values_list('kind', 'key', 'value')
+    totals, histograms = {}, {Kind.PRICE: [], Kind.TIME: []}
+    for kind, key, value in counters:
+        if kind == Kind.TOTAL:
+            totals[key] = value
+        else:
+            histograms[kind].append((key, value))
+
+    count = totals.get(RECIPES, 0)
+    price = {'average': round(totals.get(PRICE_SUM, 0) / 100 / count, 2) if count else None}
+    price.update({name: round(value, 2) for name, value in percentiles(histograms[Kind.PRICE], PRICE_BUCKET).items()})
+    price['histogram'] = [
+        {'from': str(bucket * PRICE_BUCKET), 'to': str((bucket + 1) * PRICE_BUCKET), 'count': value}
+        for bucket, value in histograms[Kind.PRICE]
+    ]
+    time_minutes = {'average': round(totals.get(TIME_SUM, 0) / count, 2) if count else None}
+    time_minutes.update({name: round(value, 2) for name, value in percentiles(histograms[Kind.TIME], 1).items()})
+    time_minutes['histogram'] = [
+        {'minutes': bucket, 'count': value} for bucket, value in histograms[Kind.TIME]
+    ]
+
+    return {
+        'recipe_count': count,
+        'price': price,
+        'time_minutes': time_minutes,
+        'top_tags': _top(user_id, Kind.TAG, Tag, top),
+        'top_ingredients': _top(user_id, Kind.INGREDIENT, Ingredient, top),
+    }
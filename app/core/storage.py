@@ -0,0 +1,69 @@
+import hashlib
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+HASHED_DIRECTORY = os.path.join('uploads', 'recipe')
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{64}$')
+# a content addressed file never changes, so it can be cached for a year,
+# private because media is only served to the owners of the recipes
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+def hashed_name(sha256, ext):
+    """ return the storage name of content with the given sha256 hex digest """
+    name = f'{sha256}.{ext.lower()}' if ext else sha256
+    return os.path.join(HASHED_DIRECTORY, sha256[:2], name)
+
+
+def is_content_addressed(name):
+    """ true when name is a hashed_name, and so its bytes never change """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return bool(HASHED_NAME_RE.match(stem.split('-')[0]))
+
+
+def file_sha256(content):
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    file system storage that names files after the sha256 of their bytes,
+    identical content is stored once however many recipes use it. files are
+    not deleted when a recipe lets go of them, the collect_images command
+    removes the ones no recipe refers to any more
+    """
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lstrip('.')
+        name = hashed_name(file_sha256(content), ext)
+        if self.exists(name):
+            self.touch(name)
+            return name
+        return super()._save(name, content)
+
+    def adopt(self, temporary_name, sha256, ext):
+        """
+        move a file already written under temporary_name to its hashed name,
+        dropping it instead when the same content is stored already
+        """
+        name = hashed_name(sha256, ext)
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(self.path(temporary_name))
+            self.touch(name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.path(temporary_name), path)
+        return name
+
+    def touch(self, name):
+        """ mark a reused file as recent, so garbage collection leaves it alone for the grace period """
+        os.utime(self.path(name))
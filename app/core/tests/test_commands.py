@@ -1,23 +1,202 @@
+import asyncio
+import io
+import os
+import tempfile
 from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.management.base import CommandError
 from django.core.management import call_command
+from django.db.backends.base.base import BaseDatabaseWrapper
 from  django.db.utils import OperationalError
-from  django.test import TestCase
+from  django.test import TestCase, TransactionTestCase
+from django.urls import resolve
+from core.models import Tag,Recipe,RecipeStat
+
+def flaky_connections(failures):
+    """ make the first failures connection attempts fail, later ones really connect """
+    original = BaseDatabaseWrapper.ensure_connection
+    attempts = []
+
+    def ensure_connection(connection):
+        attempts.append(connection.alias)
+        if len(attempts) <= failures:
+            raise OperationalError('connection refused')
+        return original(connection)
+    return patch.object(BaseDatabaseWrapper,'ensure_connection',ensure_connection),attempts
+
 
 class CommandTests(TestCase):
 
-    def test_wait_for_db_ready(self):
+    @patch('time.sleep',return_value=True)
+    def test_wait_for_db_ready(self,ts):
         """ Test waiting for db when db is available"""
-
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count,1)
+        connecting,attempts = flaky_connections(0)
+        with connecting:
+            call_command('wait_for_db',stdout=io.StringIO())
+        self.assertIn('default',attempts)
+        self.assertEqual(ts.call_count,0)
 
 
     @patch('time.sleep',return_value=True)
     def test_wait_for_db(self,ts):
         """Test waiting for  db"""
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.side_effect = [OperationalError]*5 + [True]
-            call_command('wait_for_db')
-            self.assertEqual(gi.call_count,6)
+        connecting,attempts = flaky_connections(5)
+        with connecting:
+            call_command('wait_for_db',stdout=io.StringIO())
+        self.assertEqual(ts.call_count,5)
+        # the delays grow but stay under the cap
+        delays = [call.args[0] for call in ts.call_args_list]
+        self.assertLess(delays[0],delays[-1])
+        self.assertTrue(all(delay <= 5 for delay in delays))
+
+    def test_wait_for_db_gives_up_at_deadline(self):
+        """Test the command fails once the timeout passed"""
+        connecting,attempts = flaky_connections(100)
+        with connecting, self.assertRaises(CommandError):
+            call_command('wait_for_db',timeout=0,stdout=io.StringIO(),stderr=io.StringIO())
+        self.assertEqual(attempts,['default'])
+
+    def test_wait_for_db_unknown_alias(self):
+        with self.assertRaises(CommandError):
+            call_command('wait_for_db',databases=['nowhere'],stdout=io.StringIO())
+
+
+class ImportRecipesCommandTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('import@test.com','pass1234')
+
+    def write_file(self,suffix,content):
+        """ write content to a temporary file removed after the test """
+        fd,path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd,'w',newline='') as f:
+            f.write(content)
+        self.addCleanup(os.remove,path)
+        return path
+
+    def test_import_ndjson(self):
+        """Test importing recipes from ndjson reuses tags by name"""
+        Tag.objects.create(user=self.user,name='dinner')
+        path = self.write_file('.ndjson',
+            '{"title": "curry", "time_minutes": 30, "price": "5.50", "tags": ["dinner"], "ingredients": ["rice"]}\n'
+            '\n'
+            '{"title": "dal", "time_minutes": 20, "price": 3, "tags": ["dinner", "vegan"]}\n'
+        )
+        call_command('import_recipes',path,user=self.user.email,batch_size=1)
+
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(),2)
+        self.assertEqual(Tag.objects.filter(user=self.user,name='dinner').count(),1)
+        dal = Recipe.objects.get(title='dal')
+        self.assertEqual(sorted(tag.name for tag in dal.tag.all()),['dinner','vegan'])
+
+    def test_import_csv_skips_invalid_rows(self):
+        """Test importing csv creates the valid rows and skips the invalid ones"""
+        path = self.write_file('.csv',
+            'title,time_minutes,price,link,tags,ingredients\n'
+            'curry,30,5.50,,dinner;spicy,rice;lentils\n'
+            'broken,soon,5.50,,,\n'
+        )
+        call_command('import_recipes',path,user=self.user.email)
+
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.title,'curry')
+        self.assertIsNone(recipe.link)
+        self.assertEqual(recipe.ingredient.count(),2)
+
+    def test_import_unknown_user(self):
+        """Test importing for a missing user fails"""
+        path = self.write_file('.ndjson','')
+        with self.assertRaises(CommandError):
+            call_command('import_recipes',path,user='missing@test.com')
+
+
+
+class CollectImagesCommandTests(TestCase):
+    """ test garbage collecting unreferenced recipe images """
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user('images@test.com','pass1234')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def write_file(self,name,age=0):
+        path = os.path.join(self.media.name,name)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'wb') as f:
+            f.write(b'x' * 10)
+        mtime = os.path.getmtime(path) - age
+        os.utime(path,(mtime,mtime))
+        return path
+
+    def test_collect_images_deletes_orphans(self):
+        """ test old unreferenced images and their variants are deleted, the rest kept"""
+        used = 'uploads/recipe/aa/' + 'a' * 64 + '.jpg'
+        orphan = 'uploads/recipe/bb/' + 'b' * 64 + '.jpg'
+        recent = 'uploads/recipe/cc/' + 'c' * 64 + '.jpg'
+        paths = {
+            'used': self.write_file(used,age=10000),
+            'used_variant': self.write_file('uploads/recipe/aa/variants/' + 'a' * 64 + '-medium.webp',age=10000),
+            'orphan': self.write_file(orphan,age=10000),
+            'orphan_variant': self.write_file('uploads/recipe/bb/variants/' + 'b' * 64 + '-medium.webp',age=10000),
+            'recent': self.write_file(recent),
+        }
+        Recipe.objects.create(user=self.user,title='used',time_minutes=5,price=5,image=used)
+
+        call_command('collect_images',grace_seconds=3600,stdout=open(os.devnull,'w'))
+
+        exists = {key: os.path.exists(path) for key,path in paths.items()}
+        self.assertEqual(exists,{
+            'used': True, 'used_variant': True, 'orphan': False, 'orphan_variant': False, 'recent': True,
+        })
+
+    def test_collect_images_dry_run(self):
+        """ test a dry run only lists the orphans"""
+        path = self.write_file('uploads/recipe/bb/' + 'b' * 64 + '.jpg',age=10000)
+        call_command('collect_images',grace_seconds=0,dry_run=True,stdout=open(os.devnull,'w'))
+        self.assertTrue(os.path.exists(path))
+
+
+class RebuildRecipeStatsCommandTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('stats@test.com','pass1234')
+
+    def test_rebuild_recipe_stats(self):
+        """ test the rollup is recomputed from the recipe tables"""
+        tag = Tag.objects.create(user=self.user,name='vegan')
+        recipe = Recipe.objects.create(user=self.user,title='salad',time_minutes=5,price=3)
+        recipe.tag.add(tag)
+        RecipeStat.objects.filter(user=self.user).delete()
+
+        call_command('rebuild_recipe_stats',user='stats@test.com',stdout=open(os.devnull,'w'))
+
+        counters = set(RecipeStat.objects.filter(user=self.user).values_list('kind','key','value'))
+        self.assertIn((RecipeStat.Kind.TOTAL,0,1),counters)
+        self.assertIn((RecipeStat.Kind.TAG,tag.id,1),counters)
+
+    def test_rebuild_recipe_stats_unknown_user(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_recipe_stats',user='nobody@test.com',stdout=open(os.devnull,'w'))
+
+
+# the handlers answer from their own threads, the seeded data has to be committed
+class LoadTestCommandTests(TransactionTestCase):
+
+    def test_loadtest_reports_every_mode(self):
+        """ test each handler answers every request and the test user is removed"""
+        out = io.StringIO()
+        call_command(
+            'loadtest',requests=6,concurrency=3,wsgi_threads=2,recipes=3,paths=['/api/recipe/tag/'],stdout=out
+        )
+
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[0] for row in rows],['wsgi','asgi','asgi-async'])
+        self.assertEqual([row[-1] for row in rows],['0','0','0'])
+        self.assertFalse(get_user_model().objects.filter(email='loadtest@example.com').exists())
+        # the url patterns are back to the sync views
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/recipe/tag/').func))
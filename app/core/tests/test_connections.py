@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from django import db
+from django.contrib.auth import get_user_model
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import connections
+from core.connections import ConnectionPool, PoolTimeout
+
+
+METRICS_URL = reverse('connection-metrics')
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(TestCase):
+    """ test the per process connection pool """
+
+    def test_reuses_released_connection(self):
+        pool = ConnectionPool(FakeConnection,max_size=2)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIs(pool.acquire(),connection)
+        stats = pool.stats()
+        self.assertEqual((stats['checkouts'],stats['opened'],stats['in_use'],stats['idle']),(2,1,1,0))
+
+    def test_times_out_when_full(self):
+        """ test a checkout gives up once the pool stays full for the timeout"""
+        pool = ConnectionPool(FakeConnection,max_size=1,timeout=0.01)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'],1)
+
+    def test_waits_for_release(self):
+        """ test a checkout on a full pool gets the next released connection and the wait is measured"""
+        pool = ConnectionPool(FakeConnection,max_size=1,timeout=5)
+        connection = pool.acquire()
+        releaser = threading.Timer(0.05,pool.release,[connection])
+        releaser.start()
+        self.assertIs(pool.acquire(),connection)
+        releaser.join()
+        stats = pool.stats()
+        self.assertEqual(stats['waits'],1)
+        self.assertGreater(stats['wait_seconds_max'],0.01)
+
+    def test_failed_check_opens_new_connection(self):
+        pool = ConnectionPool(FakeConnection,max_size=1,check=lambda connection: False)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIsNot(pool.acquire(),connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['discarded'],1)
+
+    def test_idle_connections_expire(self):
+        pool = ConnectionPool(FakeConnection,max_idle=0.01)
+        connection = pool.acquire()
+        pool.release(connection)
+        time.sleep(0.02)
+        self.assertIsNot(pool.acquire(),connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'],1)
+
+    def test_broken_connection_is_not_pooled(self):
+        pool = ConnectionPool(FakeConnection,reset=lambda connection: False)
+        pool.release(pool.acquire())
+        self.assertEqual(pool.stats()['size'],0)
+
+
+class HealthCheckedWrapper(connections.HealthCheckMixin,sqlite3_base.DatabaseWrapper):
+    pass
+
+
+class ConnectionHealthCheckTests(TestCase):
+    """ test persistent connections are pinged on their first use in a request """
+
+    def setUp(self):
+        # sqlite keeps in memory databases open on close, a file is really closed
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {
+            **db.connections['default'].settings_dict,
+            'NAME':os.path.join(directory.name,'health.sqlite3'),
+            'CONN_HEALTH_CHECKS':True,
+        }
+        self.connection = HealthCheckedWrapper(settings_dict,'health')
+        self.addCleanup(self.connection.close)
+        # opened by an earlier request
+        self.connection.ensure_connection()
+
+    def start_request(self):
+        with patch.object(connections.connections,'all',return_value=[self.connection]):
+            connections.check_connections()
+
+    def query(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    def test_checked_once_on_first_use(self):
+        self.start_request()
+        with patch.object(self.connection,'is_usable',return_value=True) as usable:
+            self.query()
+            self.query()
+        usable.assert_called_once()
+
+    def test_unused_connection_not_checked(self):
+        """ test a request that never touches the database does not ping it"""
+        with patch.object(self.connection,'is_usable') as usable:
+            self.start_request()
+        usable.assert_not_called()
+
+    def test_dead_connection_reopened(self):
+        self.start_request()
+        dead = self.connection.connection
+        failures = connections._health[('health','failures')]
+        with patch.object(self.connection,'is_usable',return_value=False):
+            self.query()
+        self.assertIsNot(self.connection.connection,dead)
+        self.assertEqual(connections._health[('health','failures')],failures + 1)
+
+    def test_new_connection_not_checked(self):
+        self.connection.close()
+        self.start_request()
+        with patch.object(self.connection,'is_usable') as usable:
+            self.query()
+        usable.assert_not_called()
+
+
+class ConnectionMetricsApiTests(TestCase):
+    """ test the instrumentation endpoint """
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_staff_gets_metrics(self):
+        admin = get_user_model().objects.create_superuser('metrics@test.com','pass1234')
+        self.client.force_authenticate(admin)
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertIn('health_checks',res.data['databases']['default'])
+
+    def test_other_users_refused(self):
+        user = get_user_model().objects.create_user('plain@test.com','pass1234')
+        self.client.force_authenticate(user)
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code,status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,71 @@
+import io
+from unittest.mock import MagicMock, patch
+from django.core.management import call_command
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.utils import OperationalError
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from core.health import backoff_delay, check_database
+
+
+class HealthEndpointTests(TestCase):
+    """ test the load balancer probes """
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_healthz(self):
+        res = self.client.get(reverse('healthz'))
+        self.assertEqual(res.status_code,200)
+        self.assertEqual(res.json(),{'status':'ok'})
+
+    def test_readyz_checks_databases(self):
+        res = self.client.get(reverse('readyz'))
+        self.assertEqual(res.status_code,200)
+        self.assertEqual(res.json()['databases']['default'],'ok')
+
+    def test_readyz_unavailable(self):
+        """ test a database refusing connections makes the instance not ready"""
+        error = OperationalError('could not connect to server "db.internal" as user "app"')
+        with patch.object(BaseDatabaseWrapper,'ensure_connection',side_effect=error):
+            with self.assertLogs('core.health','WARNING') as logs:
+                res = self.client.get(reverse('readyz'))
+        self.assertEqual(res.status_code,503)
+        # the details are logged, never sent to the unauthenticated caller
+        self.assertEqual(res.json()['databases']['default'],'unavailable')
+        self.assertNotIn('db.internal',res.content.decode())
+        self.assertIn('db.internal',logs.output[0])
+
+    def test_backoff_delay(self):
+        """ test the delay doubles per attempt, keeps half of it fixed and stops at the cap"""
+        for attempt,low,high in ((0,0.25,0.5),(2,1,2),(10,2.5,5)):
+            delay = backoff_delay(attempt,0.5,5)
+            self.assertTrue(low <= delay <= high,(attempt,delay))
+
+
+class DatabaseProbeTests(TestCase):
+    """ test the connect timeout given to backends that take one """
+
+    def test_probe_passes_connect_timeout(self):
+        connection = MagicMock(vendor='postgresql')
+        connection.get_connection_params.return_value = {'host':'db'}
+        connection.Database.Error = OperationalError
+        with patch('core.health.connections',{'slow':connection}):
+            self.assertIsNone(check_database('slow',timeout=2.5))
+        connection.Database.connect.assert_called_once_with(host='db',connect_timeout=3)
+        connection.cursor.assert_not_called()
+
+    def test_probe_reports_connect_error(self):
+        connection = MagicMock(vendor='postgresql')
+        connection.get_connection_params.return_value = {}
+        connection.Database.Error = OperationalError
+        connection.Database.connect.side_effect = OperationalError('timeout expired\n')
+        with patch('core.health.connections',{'slow':connection}):
+            self.assertEqual(check_database('slow',timeout=1),'timeout expired')
+
+    @patch('core.management.commands.wait_for_db.run_parallel',return_value={'default':None})
+    def test_wait_for_db_bounds_parallel_wait(self,run_parallel):
+        call_command('wait_for_db',timeout=3,stdout=io.StringIO())
+        timeout = run_parallel.call_args.kwargs['timeout']
+        self.assertTrue(3 < timeout <= 4,timeout)
@@ -0,0 +1,104 @@
+import re
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.models import Tag, Ingredient, Recipe
+from recipe.views import TagViewSet, IngredientViewSet, RecipeViewSet
+
+
+SEED_SIZE = 200
+CORE_TABLES = ('core_tag', 'core_ingredient', 'core_recipe', 'core_recipe_tag', 'core_recipe_ingredient')
+
+
+def viewset_queryset(viewset_class, user, params=None, action='list'):
+    """ return the page queryset a viewset would run for a GET with params """
+    view = viewset_class()
+    view.request = Request(APIRequestFactory().get('/', params or {}))
+    view.request.user = user
+    view.action = action
+    view.format_kwarg = None
+    queryset = view.get_queryset()
+    paginator = view.pagination_class()
+    ordering = [f'-{field}' for field in paginator.ordering]
+    return queryset.order_by(*ordering)[:paginator.page_size + 1]
+
+
+def full_scans(plan):
+    """ return the core tables the plan reads without an index """
+    if connection.vendor == 'postgresql':
+        pattern = r'Seq Scan on (\w+)'
+    else:
+        pattern = r'\bSCAN (\w+)'
+    return [table for table in re.findall(pattern, plan) if table in CORE_TABLES]
+
+
+class QueryPlanTests(TestCase):
+    """ test that the viewset querysets are served from indexes """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('plans@test.com', 'pass1234')
+        other = get_user_model().objects.create_user('other@test.com', 'pass1234')
+        for owner in (cls.user, other):
+            Tag.objects.bulk_create(
+                [Tag(user=owner, name=f'tag {i}') for i in range(SEED_SIZE)]
+            )
+            Ingredient.objects.bulk_create(
+                [Ingredient(user=owner, name=f'ingredient {i}') for i in range(SEED_SIZE)]
+            )
+            for i in range(SEED_SIZE // 4):
+                recipe = Recipe.objects.create(user=owner, title=f'recipe {i}', time_minutes=5, price=5)
+                recipe.tag.add(*Tag.objects.filter(user=owner, name__in=[f'tag {i}', f'tag {i + 1}']))
+                recipe.ingredient.add(
+                    *Ingredient.objects.filter(user=owner, name__in=[f'ingredient {i}', f'ingredient {i + 1}'])
+                )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def tearDown(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('RESET enable_seqscan')
+
+    def assertUsesIndexes(self, queryset):
+        """ fail if explaining queryset shows a full scan of a core table """
+        plan = queryset.explain()
+        self.assertEqual(full_scans(plan), [], plan)
+
+    def test_tag_list_plan(self):
+        """ test listing tags is an index scan """
+        self.assertUsesIndexes(viewset_queryset(TagViewSet, self.user))
+        self.assertUsesIndexes(viewset_queryset(TagViewSet, self.user, {'assigned_only': 1}))
+        self.assertUsesIndexes(viewset_queryset(TagViewSet, self.user, {'assigned_only': 1, 'with_count': 1}))
+
+    def test_ingredient_list_plan(self):
+        """ test listing ingredients is an index scan """
+        self.assertUsesIndexes(viewset_queryset(IngredientViewSet, self.user))
+        self.assertUsesIndexes(viewset_queryset(IngredientViewSet, self.user, {'assigned_only': 1}))
+
+    def test_recipe_list_plan(self):
+        """ test listing and filtering recipes is an index scan """
+        tag_ids = ','.join(str(pk) for pk in Tag.objects.filter(user=self.user).values_list('id', flat=True)[:3])
+        ingredient_ids = ','.join(
+            str(pk) for pk in Ingredient.objects.filter(user=self.user).values_list('id', flat=True)[:3]
+        )
+        self.assertUsesIndexes(viewset_queryset(RecipeViewSet, self.user))
+        self.assertUsesIndexes(viewset_queryset(RecipeViewSet, self.user, {'tag': tag_ids}))
+        self.assertUsesIndexes(viewset_queryset(RecipeViewSet, self.user, {'ingredient': ingredient_ids}))
+        self.assertUsesIndexes(
+            viewset_queryset(RecipeViewSet, self.user, {'ingredient': ingredient_ids, 'match': 'all'})
+        )
+
+    def test_recipe_relation_prefetch_plan(self):
+        """ test the tag and ingredient prefetch queries are index scans """
+        recipe_ids = list(Recipe.objects.filter(user=self.user).values_list('id', flat=True)[:10])
+        self.assertUsesIndexes(Tag.objects.filter(recipe__id__in=recipe_ids).only('id', 'name'))
+        self.assertUsesIndexes(Ingredient.objects.filter(recipe__id__in=recipe_ids).only('id', 'name'))
@@ -0,0 +1,102 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import routers
+from core.models import Recipe
+from core.routers import ReplicaRouter
+
+
+RECIPE_URL = reverse('recipe:recipe-list')
+REPLICA = 'replica'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaRouterTests(SimpleTestCase):
+    """ test which database the router picks """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_stay_on_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(Recipe),'default')
+
+    def test_marked_reads_go_to_replica(self):
+        token = routers._read_from_replica.set(True)
+        self.addCleanup(routers._read_from_replica.reset,token)
+        self.assertEqual(self.router.db_for_read(Recipe),REPLICA)
+        self.assertEqual(self.router.db_for_write(Recipe),'default')
+
+    def test_no_replicas_configured(self):
+        token = routers._read_from_replica.set(True)
+        self.addCleanup(routers._read_from_replica.reset,token)
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Recipe),'default')
+
+
+# a second sqlite database stands in for the replica, rows written there
+# only show which database answered
+@override_settings(DATABASE_REPLICAS=[REPLICA],DATABASE_REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingApiTests(TransactionTestCase):
+    """ test the api reads from the replica except right after the user's own writes """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # added after the test case guarded its databases, the replica is not a test database
+        connections.settings[REPLICA] = {'ENGINE': 'django.db.backends.sqlite3','NAME': ':memory:'}
+        call_command('migrate',database=REPLICA,verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('replica@test.com','pass1234')
+        self.user.save(using=REPLICA)
+        Recipe.objects.create(user=self.user,title='on primary',time_minutes=5,price=5)
+        Recipe.objects.using(REPLICA).create(user=self.user,title='on replica',time_minutes=5,price=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        routers._marker_cache().delete(routers._marker_key(self.user.pk))
+
+    def tearDown(self):
+        call_command('flush',database=REPLICA,interactive=False,verbosity=0)
+
+    def titles(self):
+        res = self.client.get(RECIPE_URL)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return [recipe['title'] for recipe in res.data['results']]
+
+    def test_reads_served_by_replica(self):
+        self.assertEqual(self.titles(),['on replica'])
+
+    def test_reads_stick_to_primary_after_write(self):
+        """ test the user sees their own write until the sticky window ends"""
+        res = self.client.post(RECIPE_URL,{'title':'new','time_minutes':5,'price':'1.00'})
+        self.assertEqual(res.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(sorted(self.titles()),['new','on primary'])
+
+        routers._marker_cache().delete(routers._marker_key(self.user.pk))
+        self.assertEqual(self.titles(),['on replica'])
+
+    def test_other_users_still_read_replica(self):
+        other = get_user_model().objects.create_user('other@test.com','pass1234')
+        routers.mark_write(other.pk)
+        self.assertEqual(self.titles(),['on replica'])
+
+    def test_failing_view_does_not_leave_replica_reads_on(self):
+        """ test an uncaught exception in a read still switches the thread back to the primary"""
+        with patch('recipe.views.RecipeViewSet.paginate_queryset',side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.get(RECIPE_URL)
+        self.assertFalse(routers._read_from_replica.get())
+        self.assertEqual(ReplicaRouter().db_for_read(Recipe),'default')
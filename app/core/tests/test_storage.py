@@ -0,0 +1,54 @@
+import hashlib
+import os
+import tempfile
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from core.storage import ContentAddressedStorage, hashed_name, is_content_addressed
+
+
+class ContentAddressedStorageTests(TestCase):
+    """ test files are stored once under the hash of their content """
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.storage = ContentAddressedStorage(location=self.media.name)
+
+    def tearDown(self):
+        self.media.cleanup()
+
+    def test_save_names_file_by_hash(self):
+        """ test the saved name is built from the sha256 of the content"""
+        content = b'recipe photo'
+        name = self.storage.save('uploads/recipe/photo.JPG',ContentFile(content))
+
+        self.assertEqual(name,hashed_name(hashlib.sha256(content).hexdigest(),'jpg'))
+        self.assertTrue(is_content_addressed(name))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(),content)
+
+    def test_identical_content_stored_once(self):
+        """ test saving the same bytes twice reuses one file"""
+        first = self.storage.save('a.jpg',ContentFile(b'same bytes'))
+        second = self.storage.save('b.jpg',ContentFile(b'same bytes'))
+        other = self.storage.save('c.jpg',ContentFile(b'other bytes'))
+
+        self.assertEqual(first,second)
+        self.assertNotEqual(first,other)
+        files = [name for _,_,names in os.walk(self.media.name) for name in names]
+        self.assertEqual(len(files),2)
+
+    def test_adopt_moves_or_drops_temporary_file(self):
+        """ test a streamed file is moved to its hashed name, or dropped when it is a duplicate"""
+        sha256 = hashlib.sha256(b'streamed').hexdigest()
+        for temporary in ('tmp1.png','tmp2.png'):
+            with open(os.path.join(self.media.name,temporary),'wb') as f:
+                f.write(b'streamed')
+            name = self.storage.adopt(temporary,sha256,'png')
+            self.assertFalse(self.storage.exists(temporary))
+        self.assertEqual(name,hashed_name(sha256,'png'))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_uuid_names_are_not_content_addressed(self):
+        """ test names from recipe_image_file_path are not treated as immutable"""
+        self.assertFalse(is_content_addressed('uploads/recipe/5f0c6a8e-0f6e-4c55-9a4e-1f3b1b0c1c2d.jpg'))
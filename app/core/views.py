@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from core.connections import connection_metrics
+from user.authentication import CachedTokenAuthentication
+
+
+class ConnectionMetricsView(APIView):
+    """ database connection settings, health checks and pool counters of this process, staff only """
+    authentication_classes = (CachedTokenAuthentication, SessionAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({'databases': connection_metrics()})
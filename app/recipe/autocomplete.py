@@ -0,0 +1,95 @@
+import heapq
+import re
+from bisect import bisect_left
+
+from django.db import connections, router
+
+from core.cache import user_index_cache
+from recipe.cache import get_version
+
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+# same default as pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+# indexes kept per process, one per user and model
+_indexes = user_index_cache()
+
+
+def trigrams(text):
+    """ the trigrams pg_trgm would extract: each lower cased word padded with two spaces before and one after """
+    grams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class NameIndex:
+    """
+    the names of one user's tags or ingredients sorted by their lower case
+    form, a prefix is a contiguous slice found with two binary searches
+    """
+
+    def __init__(self, rows):
+        entries = sorted((name.lower(), pk, name, count) for pk, name, count in rows)
+        self.keys = [entry[0] for entry in entries]
+        self.entries = [{'id': pk, 'name': name, 'recipe_count': count} for _, pk, name, count in entries]
+        self._trigrams = None
+
+    def prefix(self, prefix, limit):
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+        return heapq.nsmallest(
+            limit, self.entries[start:end], key=lambda entry: (-entry['recipe_count'], entry['name'].lower())
+        )
+
+    def fuzzy(self, text, limit):
+        """ names whose trigram similarity to text reaches the threshold, most used first """
+        if self._trigrams is None:
+            self._trigrams = [trigrams(entry['name']) for entry in self.entries]
+        wanted = trigrams(text)
+        matches = []
+        for entry, grams in zip(self.entries, self._trigrams):
+            score = similarity(wanted, grams)
+            if score >= SIMILARITY_THRESHOLD:
+                matches.append((-entry['recipe_count'], -score, entry['name'].lower(), entry))
+        return [match[-1] for match in heapq.nsmallest(limit, matches, key=lambda match: match[:3])]
+
+
+def name_index(model, user_id):
+    """ return the NameIndex of a user, rebuilt when the user's tag and ingredient version moved """
+    version, _ = get_version(user_id)
+    key = (model._meta.label_lower, user_id)
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    rows = model.objects.filter(user_id=user_id).with_recipe_count().values_list('id', 'name', 'recipe_count')
+    index = NameIndex(rows.iterator())
+    _indexes.set(key, (version, index))
+    return index
+
+
+def fuzzy_from_database(model, user_id, text, limit):
+    """ trigram matches served by the gin_trgm_ops index on postgres """
+    from django.contrib.postgres.search import TrigramSimilarity
+    queryset = model.objects.filter(user_id=user_id, name__trigram_similar=text).annotate(
+        similarity=TrigramSimilarity('name', text)
+    ).with_recipe_count().order_by('-recipe_count', '-similarity', 'name')
+    return list(queryset.values('id', 'name', 'recipe_count')[:limit])
+
+
+def autocomplete(model, user_id, prefix=None, fuzzy=None, limit=AUTOCOMPLETE_LIMIT):
+    """ return up to limit tags or ingredients of a user starting with prefix, or close to fuzzy """
+    if fuzzy is not None:
+        if connections[router.db_for_read(model)].vendor == 'postgresql':
+            return fuzzy_from_database(model, user_id, fuzzy, limit)
+        return name_index(model, user_id).fuzzy(fuzzy, limit)
+    return name_index(model, user_id).prefix(prefix, limit)
@@ -0,0 +1,155 @@
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from core.models import Tag, Ingredient, Recipe
+from .serializers import RecipeSerializer, RecipeBulkSerializer
+
+
+BULK_MAX_ITEMS = 1000
+RELATED_MODELS = (('tag', Tag), ('ingredient', Ingredient))
+
+
+def bulk_items(data):
+    """ check the request body is a list of at most BULK_MAX_ITEMS items """
+    if not isinstance(data, list):
+        raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+    if len(data) > BULK_MAX_ITEMS:
+        raise ValidationError({'non_field_errors': [f'Ensure there are no more than {BULK_MAX_ITEMS} items.']})
+    return data
+
+
+def bulk_response(results, errors, success_status=status.HTTP_200_OK):
+    """ return results and per item errors, 207 when only part of the batch went through """
+    if not errors:
+        response_status = success_status
+    elif results:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response({'results': results, 'errors': errors}, status=response_status)
+
+
+def item_error(index, errors):
+    return {'index': index, 'errors': errors}
+
+
+def _lookup_related(user, validated):
+    """ load every tag and ingredient referenced by the batch with one in_bulk each """
+    lookups = {}
+    for field, model in RELATED_MODELS:
+        ids = {pk for data in validated for pk in data.get(field, [])}
+        lookups[field] = model.objects.filter(user=user).in_bulk(ids) if ids else {}
+    return lookups
+
+
+def _related_errors(data, lookups):
+    errors = {}
+    for field, found in lookups.items():
+        missing = [pk for pk in data.get(field, []) if pk not in found]
+        if missing:
+            errors[field] = [f'Invalid pk "{pk}" - object does not exist.' for pk in missing]
+    return errors
+
+
+def _serialize_recipes(recipes):
+    queryset = Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]).with_related_ids()
+    return RecipeSerializer(queryset.order_by('id'), many=True).data
+
+
+def create_recipes(user, items):
+    """ validate and insert a batch of recipes, return (results, errors) """
+    serializers = [RecipeBulkSerializer(data=item) for item in items]
+    valid = [serializer.is_valid() for serializer in serializers]
+    lookups = _lookup_related(
+        user, [serializer.validated_data for serializer, ok in zip(serializers, valid) if ok]
+    )
+
+    errors, recipes, tag_ids, ingredient_ids = [], [], [], []
+    for index, (serializer, ok) in enumerate(zip(serializers, valid)):
+        if not ok:
+            errors.append(item_error(index, serializer.errors))
+            continue
+        data = dict(serializer.validated_data)
+        related_errors = _related_errors(data, lookups)
+        if related_errors:
+            errors.append(item_error(index, related_errors))
+            continue
+        tag_ids.append(data.pop('tag', []))
+        ingredient_ids.append(data.pop('ingredient', []))
+        recipes.append(Recipe(user=user, **data))
+
+    if not recipes:
+        return [], errors
+    recipes = Recipe.objects.bulk_create_with_relations(recipes, tag_ids, ingredient_ids)
+    return _serialize_recipes(recipes), errors
+
+
+def update_recipes(user, items):
+    """ validate and partially update a batch of recipes given with their id, return (results, errors) """
+    ids = [item.get('id') for item in items if isinstance(item, dict)]
+    instances = Recipe.objects.filter(user=user).in_bulk([pk for pk in ids if isinstance(pk, int)])
+
+    errors, checked, seen = [], [], set()
+    for index, item in enumerate(items):
+        pk = item.get('id') if isinstance(item, dict) else None
+        instance = instances.get(pk) if isinstance(pk, int) else None
+        if instance is None:
+            errors.append(item_error(index, {'id': ['Not found.']}))
+            continue
+        if pk in seen:
+            errors.append(item_error(index, {'id': ['Duplicate id in the batch.']}))
+            continue
+        seen.add(pk)
+        serializer = RecipeBulkSerializer(instance, data=item, partial=True)
+        if not serializer.is_valid():
+            errors.append(item_error(index, serializer.errors))
+            continue
+        checked.append((index, instance, dict(serializer.validated_data)))
+
+    lookups = _lookup_related(user, [data for _, _, data in checked])
+    updated, fields, relations = [], set(), {field: ([], []) for field, _ in RELATED_MODELS}
+    for index, instance, data in checked:
+        related_errors = _related_errors(data, lookups)
+        if related_errors:
+            errors.append(item_error(index, related_errors))
+            continue
+        for field, (recipes, pks) in relations.items():
+            if field in data:
+                recipes.append(instance)
+                pks.append(data.pop(field))
+        for field, value in data.items():
+            setattr(instance, field, value)
+        fields.update(data)
+        updated.append(instance)
+
+    if fields:
+        Recipe.objects.bulk_update(updated, fields)
+    for field, (recipes, pks) in relations.items():
+        if recipes:
+            Recipe.objects.bulk_set_relations(field, recipes, pks)
+    return _serialize_recipes(updated), errors
+
+
+def create_attrs(serializer_class, user, items):
+    """ validate and insert a batch of tags or ingredients, return (results, errors) """
+    model = serializer_class.Meta.model
+    errors, objs = [], []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if not serializer.is_valid():
+            errors.append(item_error(index, serializer.errors))
+            continue
+        objs.append(model(user=user, **serializer.validated_data))
+
+    objs = model.objects.bulk_create_with_pks(objs)
+    return serializer_class(objs, many=True).data, errors
+
+
+def delete_objects(queryset, ids):
+    """ delete the rows of queryset with the given ids, return (deleted ids, errors) """
+    found = set(queryset.filter(pk__in=[pk for pk in ids if isinstance(pk, int)]).values_list('pk', flat=True))
+    queryset.filter(pk__in=found).delete()
+    deleted = [isinstance(pk, int) and pk in found for pk in ids]
+    errors = [item_error(index, {'id': ['Not found.']}) for index, ok in enumerate(deleted) if not ok]
+    return [pk for pk, ok in zip(ids, deleted) if ok], errors
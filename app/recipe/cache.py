@@ -0,0 +1,92 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def response_cache():
+    return caches[getattr(settings, 'RECIPE_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _version_key(user_id):
+    return f'recipe-attrs:version:{user_id}'
+
+
+def _modified_key(user_id):
+    return f'recipe-attrs:modified:{user_id}'
+
+
+def get_version(user_id):
+    """ return (version, last modified timestamp) of the tags and ingredients of a user """
+    cache = response_cache()
+    values = cache.get_many([_version_key(user_id), _modified_key(user_id)])
+    version = values.get(_version_key(user_id))
+    modified = values.get(_modified_key(user_id))
+    if version is None:
+        # start from the clock, an evicted counter must not come back to an old value
+        cache.add(_version_key(user_id), time.time_ns(), None)
+        version = cache.get(_version_key(user_id))
+    if modified is None:
+        modified = int(time.time())
+        cache.add(_modified_key(user_id), modified, None)
+    return version, modified
+
+
+def bump_version(user_id):
+    """
+    invalidate every cached tag and ingredient list of a user, once now and
+    again when the transaction of the write commits, lists read from the
+    rows before the commit are cached under the version in between
+    """
+    _incr_version(user_id)
+    transaction.on_commit(lambda: _incr_version(user_id))
+
+
+def _incr_version(user_id):
+    cache = response_cache()
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        if not cache.add(_version_key(user_id), time.time_ns(), None):
+            cache.incr(_version_key(user_id))
+    cache.set(_modified_key(user_id), int(time.time()), None)
+
+
+class VersionedListCacheMixin:
+    """
+    cache list responses per user and url under the user's version, and
+    answer If-None-Match/If-Modified-Since with 304 before touching the database
+    """
+    list_cache_timeout = 300
+
+    def list(self, request, *args, **kwargs):
+        version, modified = get_version(request.user.pk)
+        digest = hashlib.sha1(repr((
+            self.queryset.model._meta.label_lower,
+            request.user.pk,
+            version,
+            request.build_absolute_uri(),
+        )).encode()).hexdigest()
+        etag = quote_etag(digest)
+
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            cache = response_cache()
+            key = f'recipe-attrs:list:{digest}'
+            data = cache.get(key)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                cache.set(key, response.data, self.list_cache_timeout)
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -0,0 +1,37 @@
+from itertools import islice
+
+from django.db.models import Prefetch, prefetch_related_objects
+
+from core.models import Tag, Ingredient
+
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FIELDS = ('id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients')
+
+
+def export_rows(queryset, chunk_size=None):
+    """
+    yield one dict per recipe, reading from a server side cursor and
+    prefetching tag and ingredient names one chunk at a time
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    recipes = queryset.order_by('id').iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(recipes, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(
+            chunk,
+            Prefetch('tag', queryset=Tag.objects.only('name')),
+            Prefetch('ingredient', queryset=Ingredient.objects.only('name')),
+        )
+        for recipe in chunk:
+            yield {
+                'id': recipe.id,
+                'title': recipe.title,
+                'time_minutes': recipe.time_minutes,
+                'price': recipe.price,
+                'link': recipe.link,
+                'tags': [tag.name for tag in recipe.tag.all()],
+                'ingredients': [ingredient.name for ingredient in recipe.ingredient.all()],
+            }
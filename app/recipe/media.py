@@ -0,0 +1,163 @@
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.negotiation import BaseContentNegotiation
+
+from core.models import Recipe
+from core.storage import IMMUTABLE_CACHE_CONTROL, is_content_addressed
+
+
+DEFAULTS = {
+    # 'python' serves the bytes from the worker, 'x-accel-redirect' (nginx)
+    # and 'x-sendfile' (apache, lighttpd) hand the file to the front proxy
+    'BACKEND': 'python',
+    # internal nginx location aliased to MEDIA_ROOT
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+}
+MUTABLE_CACHE_CONTROL = 'private, no-cache'
+RANGE_CHUNK_SIZE = 64 * 2 ** 10
+
+
+def media_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """ files are not rendered, so the Accept header of an <img> request must not cause a 406 """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def user_can_read(user, name):
+    """ true when name is the image, or a variant of the image, of one of the recipes of user """
+    recipes = Recipe.objects.filter(user=user)
+    directory, filename = os.path.split(name)
+    if os.path.basename(directory) == 'variants':
+        stem = os.path.splitext(filename)[0].rsplit('-', 1)[0]
+        image_prefix = f'{os.path.dirname(directory)}/{stem}.'
+        return recipes.filter(image__startswith=image_prefix).exists()
+    return recipes.filter(image=name).exists()
+
+
+def file_etag(name, stat):
+    if is_content_addressed(name):
+        return quote_etag(os.path.splitext(os.path.basename(name))[0])
+    return quote_etag(f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+
+
+def cache_control(name):
+    return IMMUTABLE_CACHE_CONTROL if is_content_addressed(name) else MUTABLE_CACHE_CONTROL
+
+
+def parse_range(header, size):
+    """
+    return the inclusive (start, end) of a single byte range header, None to
+    send the whole file, or raise RangeNotSatisfiable
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = header[len('bytes='):].split(',')
+    if len(ranges) != 1:
+        # multipart/byteranges is not worth it for images, the whole file is valid too
+        return None
+    start, dash, end = ranges[0].strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if start == '':
+            length = int(end)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, name, path, stat):
+    """ answer a GET for the file at path, honouring conditional and range headers """
+    etag = file_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = deliver(request, name, path, stat, etag, last_modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(name)
+    return response
+
+
+def deliver(request, name, path, stat, etag, last_modified):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    backend = media_settings()['BACKEND']
+    if backend == 'x-accel-redirect':
+        # nginx does ranges itself and keeps the caching headers set here
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(media_settings()['ACCEL_REDIRECT_PREFIX'] + name)
+        return response
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def media_path(name):
+    """ return (absolute path, stat) of a media file, or None when it is missing or outside MEDIA_ROOT """
+    storage = Recipe._meta.get_field('image').storage
+    try:
+        path = storage.path(name)
+        return path, os.stat(path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        return None
@@ -0,0 +1,159 @@
+from array import array
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from core.cache import user_index_cache
+from core.models import Recipe
+from recipe.cache import get_version
+
+
+PANTRY_LIMIT = 20
+PANTRY_MAX_LIMIT = 100
+# indexes kept per process, one per user
+_indexes = user_index_cache()
+
+
+def _bits_to_int(slots, nbits):
+    """ the int with the given bit positions set, built in one go instead of one shift per bit """
+    bits = np.zeros(nbits, dtype=np.uint8)
+    bits[slots] = 1
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+def _int_to_bits(value, nbits):
+    packed = np.frombuffer(value.to_bytes((nbits + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder='little', count=nbits)
+
+
+class PantryIndex:
+    """
+    inverted index of one user's recipes: every recipe gets a bit position,
+    every ingredient a bitset (a python int) of the recipes using it. a pantry
+    is scored by adding up the bitsets of its ingredients as numpy bit arrays
+    """
+
+    def __init__(self, links, version):
+        self.version = version
+        self.ingredients = {}
+        self.slots = {}
+        self.recipe_ids = array('q')
+        self.sizes = array('I')
+        self.postings = {}
+
+        by_ingredient = defaultdict(list)
+        for recipe_id, ingredient_id in links:
+            slot = self.slot(recipe_id)
+            self.ingredients[recipe_id].add(ingredient_id)
+            self.sizes[slot] += 1
+            by_ingredient[ingredient_id].append(slot)
+        for ingredient_id, slots in by_ingredient.items():
+            self.postings[ingredient_id] = _bits_to_int(slots, len(self.recipe_ids))
+
+    @classmethod
+    def build(cls, user_id, version):
+        links = Recipe.ingredient.through.objects.filter(recipe__user_id=user_id).order_by(
+            'recipe_id'
+        ).values_list('recipe_id', 'ingredient_id')
+        return cls(links.iterator(), version)
+
+    def slot(self, recipe_id):
+        """ the bit position of a recipe, appended the first time it is seen """
+        if recipe_id not in self.slots:
+            self.slots[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+            self.sizes.append(0)
+            self.ingredients[recipe_id] = set()
+        return self.slots[recipe_id]
+
+    def add_links(self, recipe_id, ingredient_ids):
+        slot = self.slot(recipe_id)
+        for ingredient_id in set(ingredient_ids) - self.ingredients[recipe_id]:
+            self.postings[ingredient_id] = self.postings.get(ingredient_id, 0) | (1 << slot)
+            self.ingredients[recipe_id].add(ingredient_id)
+            self.sizes[slot] += 1
+
+    def remove_links(self, recipe_id, ingredient_ids):
+        if recipe_id not in self.slots:
+            return
+        slot = self.slots[recipe_id]
+        for ingredient_id in set(ingredient_ids) & self.ingredients[recipe_id]:
+            self.postings[ingredient_id] &= ~(1 << slot)
+            self.ingredients[recipe_id].discard(ingredient_id)
+            self.sizes[slot] -= 1
+
+    def remove_recipe(self, recipe_id):
+        """ clear the bits of a deleted recipe, its position stays unused until the next rebuild """
+        if recipe_id in self.slots:
+            self.remove_links(recipe_id, list(self.ingredients[recipe_id]))
+
+    def remove_ingredient(self, ingredient_id):
+        self.postings.pop(ingredient_id, None)
+        for recipe_id, ingredients in self.ingredients.items():
+            if ingredient_id in ingredients:
+                ingredients.discard(ingredient_id)
+                self.sizes[self.slots[recipe_id]] -= 1
+
+    def match(self, pantry, limit):
+        """
+        return (recipe id, coverage, missing ingredient ids) of the recipes
+        using at least one pantry ingredient, best covered first
+        """
+        pantry = set(pantry)
+        nbits = len(self.recipe_ids)
+        covered = np.zeros(nbits, dtype=np.uint32)
+        for ingredient_id in pantry:
+            if self.postings.get(ingredient_id):
+                covered += _int_to_bits(self.postings[ingredient_id], nbits)
+        candidates = np.flatnonzero(covered)
+        if not len(candidates):
+            return []
+
+        sizes = np.frombuffer(self.sizes, dtype=np.uint32)[candidates]
+        recipe_ids = np.frombuffer(self.recipe_ids, dtype=np.int64)[candidates]
+        coverage = covered[candidates] / sizes
+        # lexsort sorts by the last key first: coverage, then fewest missing, then newest
+        order = np.lexsort((-recipe_ids, sizes - covered[candidates], -coverage))[:limit]
+        return [
+            (int(recipe_ids[i]), float(coverage[i]), sorted(self.ingredients[int(recipe_ids[i])] - pantry))
+            for i in order
+        ]
+
+
+def pantry_index(user_id):
+    """ return the PantryIndex of a user, rebuilt when its version is not the user's current one """
+    version, _ = get_version(user_id)
+    index = _indexes.get(user_id)
+    if index is None or index.version != version:
+        index = PantryIndex.build(user_id, version)
+        _indexes.set(user_id, index)
+    return index
+
+
+def apply_change(user_id, change):
+    """
+    bring the cached index of a user up to date with a write made by this
+    process once the write commits, nothing is applied when it rolls back.
+    change(index) is only applied when the write was the only one since the
+    index was built, its two version bumps, otherwise the index is dropped
+    """
+    transaction.on_commit(lambda: _apply_committed(user_id, change))
+
+
+def _apply_committed(user_id, change):
+    index = _indexes.get(user_id)
+    if index is None:
+        return
+    version, _ = get_version(user_id)
+    if version == index.version:
+        return
+    if version != index.version + 2:
+        _indexes.delete(user_id)
+        return
+    change(index)
+    index.version = version
+
+
+def match_pantry(user_id, ingredient_ids, limit=PANTRY_LIMIT):
+    return pantry_index(user_id).match(ingredient_ids, limit)
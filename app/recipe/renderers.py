@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """ render one JSON document per line """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.stream(rows)).encode(self.charset)
+
+    def stream(self, rows):
+        """ yield each row as a line of JSON """
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """ render rows as CSV, list values are joined with list_separator """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    list_separator = ';'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            # error responses are a mapping of field to messages
+            data = [{'field': key, 'detail': value} for key, value in data.items()]
+        return ''.join(self.stream(data)).encode(self.charset)
+
+    def stream(self, rows, fields=None):
+        """
+        yield the header and then one CSV line per row, fields default to the
+        first row keys. with fields given the header comes even without rows
+        """
+        buffer = io.StringIO()
+        writer = None
+        if fields is not None:
+            writer = csv.DictWriter(buffer, fieldnames=fields)
+            writer.writeheader()
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow({key: self.format_value(value) for key, value in row.items()})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            # the header of an empty export
+            yield buffer.getvalue()
+
+    def format_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return self.list_separator.join(str(item) for item in value)
+        return value
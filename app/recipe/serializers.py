@@ -1,20 +1,27 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from core.models import Tag,Ingredient,Recipe
 
 
 class TagSerializer(serializers.ModelSerializer):
     """ serializer class for tags"""
+    # only present when the queryset is annotated with with_recipe_count()
+    recipe_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Tag
-        fields = ('id','name')
+        fields = ('id','name','recipe_count')
         read_only_fields = ('id',)
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     """ serializer for Ingredient model"""
+    # only present when the queryset is annotated with with_recipe_count()
+    recipe_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Ingredient
-        fields = ('id','name')
+        fields = ('id','name','recipe_count')
         read_only_fields = ('id',)
 
 
@@ -32,15 +39,45 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class RecipeBulkSerializer(RecipeSerializer):
+    """ serializer for one item of a bulk request, related ids are checked together by the view"""
+    ingredient = serializers.ListField(child=serializers.IntegerField(),required=False)
+    tag = serializers.ListField(child=serializers.IntegerField(),required=False)
+
+
+def image_variant_urls(obj,request=None):
+    """ return the urls of the resized images of a recipe, by size and format"""
+    variants = {}
+    for size,formats in obj.image_variants.items():
+        variants[size] = {}
+        for image_format,name in formats.items():
+            url = default_storage.url(name)
+            variants[size][image_format] = request.build_absolute_uri(url) if request else url
+    return variants
+
+
 class RecipeDetailSerializer(RecipeSerializer):
-    """ serialize a recipe detail view"""
+    """ serialize a recipe detail view, with the progress of its image variants"""
     ingredient = IngredientSerializer(many=True,read_only=True)
     tag = TagSerializer(many=True,read_only=True)
+    image_variants = serializers.SerializerMethodField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('image','image_status','image_variants')
+        read_only_fields = ('id','image','image_status')
+
+    def get_image_variants(self,obj):
+        return image_variant_urls(obj,self.context.get('request'))
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
     """serializer for uploading images to recipe"""
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id','image')
-        read_only_fields = ('id',)
\ No newline at end of file
+        fields = ('id','image','image_status','image_variants')
+        read_only_fields = ('id','image_status')
+
+    def get_image_variants(self,obj):
+        return image_variant_urls(obj,self.context.get('request'))
\ No newline at end of file
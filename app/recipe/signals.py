@@ -0,0 +1,308 @@
+from collections import Counter, defaultdict
+
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe, RecipeStat
+from core import stats
+from core.search import index_on_commit, unindex_recipes
+from core.signals import bulk_saved, bulk_saving
+from recipe import pantry
+from recipe.cache import bump_version
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+def bump_on_change(sender, instance, **kwargs):
+    """ tag and ingredient lists change with their rows and with the recipes using them """
+    bump_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def bump_on_relation_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(instance.user_id)
+
+
+@receiver(bulk_saved)
+def bump_on_bulk_save(sender, instances, relations, **kwargs):
+    if sender in (Tag, Ingredient) or (sender is Recipe and relations):
+        for user_id in {instance.user_id for instance in instances}:
+            bump_version(user_id)
+
+
+def touch_recipes(recipes):
+    """ bump updated_at of recipes, a queryset or a list of ids, so their etag changes """
+    if not isinstance(recipes, QuerySet):
+        recipes = Recipe.objects.filter(pk__in=recipes)
+    recipes.update(updated_at=timezone.now())
+
+
+def recipes_using(instance):
+    field = 'tag' if isinstance(instance, Tag) else 'ingredient'
+    return Recipe.objects.filter(**{field: instance})
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def touch_on_relation_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_recipes([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(pk_set)
+    elif action == 'pre_clear':
+        # runs in the same transaction as the clear, afterwards the links are gone
+        touch_recipes(recipes_using(instance))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def touch_on_rename(sender, instance, created, **kwargs):
+    """ recipe details embed tag and ingredient names """
+    if not created:
+        touch_recipes(recipes_using(instance))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_on_attr_delete(sender, instance, **kwargs):
+    touch_recipes(recipes_using(instance))
+
+
+@receiver(bulk_saved, sender=Recipe)
+def touch_on_bulk_update(sender, instances, created, **kwargs):
+    """ bulk_update and replaced relations skip auto_now """
+    if not created:
+        touch_recipes([instance.pk for instance in instances])
+
+
+@receiver(post_save, sender=Recipe)
+def index_on_save(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields is None or 'title' in update_fields:
+        index_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_on_delete(sender, instance, **kwargs):
+    unindex_recipes([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def index_on_relation_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_on_commit([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        index_on_commit(pk_set)
+    elif action == 'pre_clear':
+        instance._search_recipe_ids = list(recipes_using(instance).values_list('pk', flat=True))
+    elif action == 'post_clear':
+        index_on_commit(getattr(instance, '_search_recipe_ids', []))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def index_on_rename(sender, instance, created, **kwargs):
+    if not created:
+        index_on_commit(recipes_using(instance).values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_on_attr_delete(sender, instance, **kwargs):
+    """ the links are deleted with the row, so remember which recipes to index afterwards """
+    instance._search_recipe_ids = list(recipes_using(instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def index_on_attr_delete(sender, instance, **kwargs):
+    index_on_commit(getattr(instance, '_search_recipe_ids', []))
+
+
+@receiver(bulk_saved)
+def index_on_bulk_save(sender, instances, created, update_fields, relations, **kwargs):
+    if sender is Recipe:
+        if created or relations or 'title' in update_fields:
+            index_on_commit([instance.pk for instance in instances])
+    elif sender in (Tag, Ingredient) and not created:
+        field = 'tag' if sender is Tag else 'ingredient'
+        index_on_commit(Recipe.objects.filter(**{f'{field}__in': instances}).values_list('pk', flat=True))
+
+
+# the pantry receivers run after bump_on_change and bump_on_relation_change,
+# the change they defer to the commit runs after the commit bump of the write
+
+
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def pantry_on_ingredient_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            instance._pantry_recipe_ids = list(recipes_using(instance).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    method = 'add_links' if action == 'post_add' else 'remove_links'
+
+    def change(index):
+        if not reverse:
+            if action == 'post_clear':
+                index.remove_recipe(instance.pk)
+            else:
+                getattr(index, method)(instance.pk, pk_set)
+        else:
+            recipe_ids = getattr(instance, '_pantry_recipe_ids', []) if action == 'post_clear' else pk_set
+            for recipe_id in recipe_ids:
+                getattr(index, method)(recipe_id, [instance.pk])
+
+    pantry.apply_change(instance.user_id, change)
+
+
+@receiver(post_delete, sender=Recipe)
+def pantry_on_recipe_delete(sender, instance, **kwargs):
+    pantry.apply_change(instance.user_id, lambda index: index.remove_recipe(instance.pk))
+
+
+@receiver(post_delete, sender=Ingredient)
+def pantry_on_ingredient_delete(sender, instance, **kwargs):
+    pantry.apply_change(instance.user_id, lambda index: index.remove_ingredient(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def pantry_on_unrelated_change(sender, instance, **kwargs):
+    """ these writes bump the version without touching the pantry index """
+    pantry.apply_change(instance.user_id, lambda index: None)
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+def pantry_on_tag_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        pantry.apply_change(instance.user_id, lambda index: None)
+
+
+@receiver(pre_save, sender=Recipe)
+def stats_remember_values(sender, instance, update_fields, **kwargs):
+    """ the counters of the old price and time are taken back after the save """
+    if instance.pk is None or (update_fields is not None and not {'price', 'time_minutes'} & set(update_fields)):
+        return
+    instance._stats_old = Recipe.objects.filter(pk=instance.pk).values_list('price', 'time_minutes').first()
+
+
+@receiver(post_save, sender=Recipe)
+def stats_on_save(sender, instance, created, **kwargs):
+    old = getattr(instance, '_stats_old', None)
+    instance._stats_old = None
+    if created:
+        stats.apply(instance.user_id, stats.recipe_deltas(instance.price, instance.time_minutes))
+    elif old is not None:
+        deltas = stats.recipe_deltas(instance.price, instance.time_minutes)
+        deltas.update(stats.recipe_deltas(*old, sign=-1))
+        stats.apply(instance.user_id, deltas)
+
+
+@receiver(pre_delete, sender=Recipe)
+def stats_remember_links(sender, instance, **kwargs):
+    """ the through rows go with the recipe without m2m_changed """
+    instance._stats_links = {
+        field: list(getattr(instance, field).values_list('pk', flat=True)) for field in ('tag', 'ingredient')
+    }
+
+
+@receiver(post_delete, sender=Recipe)
+def stats_on_delete(sender, instance, **kwargs):
+    deltas = stats.recipe_deltas(instance.price, instance.time_minutes, sign=-1)
+    for field, related_ids in getattr(instance, '_stats_links', {}).items():
+        deltas.update(stats.link_deltas(field, related_ids, sign=-1))
+    stats.apply(instance.user_id, deltas)
+
+
+@receiver(m2m_changed, sender=Recipe.tag.through)
+@receiver(m2m_changed, sender=Recipe.ingredient.through)
+def stats_on_relation_change(sender, instance, action, reverse, pk_set, **kwargs):
+    field = 'tag' if sender is Recipe.tag.through else 'ingredient'
+    if action == 'pre_clear':
+        if reverse:
+            instance._stats_cleared = {instance.pk: recipes_using(instance).count()}
+        else:
+            instance._stats_cleared = Counter(getattr(instance, field).values_list('pk', flat=True))
+        return
+    if action == 'pre_remove':
+        # pk_set also holds ids that were never linked, only the existing rows are taken back
+        if reverse:
+            links = sender.objects.filter(**{f'{field}_id': instance.pk}, recipe_id__in=pk_set)
+            instance._stats_removed = {instance.pk: links.count()}
+        else:
+            links = sender.objects.filter(recipe_id=instance.pk, **{f'{field}_id__in': pk_set})
+            instance._stats_removed = Counter(links.values_list(f'{field}_id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    sign = 1 if action == 'post_add' else -1
+    if action == 'post_clear':
+        counts = getattr(instance, '_stats_cleared', {})
+    elif action == 'post_remove':
+        counts = getattr(instance, '_stats_removed', {})
+    elif reverse:
+        counts = {instance.pk: len(pk_set)}
+    else:
+        counts = {pk: 1 for pk in pk_set}
+    kind = stats.Kind.TAG if field == 'tag' else stats.Kind.INGREDIENT
+    stats.apply(instance.user_id, Counter({(kind, pk): sign * count for pk, count in counts.items()}))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def stats_on_attr_delete(sender, instance, **kwargs):
+    kind = stats.Kind.TAG if sender is Tag else stats.Kind.INGREDIENT
+    RecipeStat.objects.filter(user_id=instance.user_id, kind=kind, key=instance.pk).delete()
+
+
+@receiver(bulk_saving, sender=Recipe)
+def stats_remember_bulk(sender, instances, update_fields, relations, **kwargs):
+    """ like stats_remember_values for a whole batch, with the links about to be replaced """
+    recipes = {instance.pk: instance for instance in instances}
+    if {'price', 'time_minutes'} & set(update_fields):
+        old = Recipe.objects.filter(pk__in=list(recipes)).values_list('pk', 'price', 'time_minutes')
+        old = {pk: (price, time_minutes) for pk, price, time_minutes in old}
+        for pk, instance in recipes.items():
+            instance._stats_old = old.get(pk)
+    if relations:
+        links = stats.recipe_links(recipes, relations)
+        for pk, instance in recipes.items():
+            instance._stats_links = links.get(pk, {})
+
+
+@receiver(bulk_saved, sender=Recipe)
+def stats_on_bulk_save(sender, instances, created, update_fields, relations, **kwargs):
+    deltas = defaultdict(Counter)
+    if created:
+        for user_id in {instance.user_id for instance in instances}:
+            deltas[user_id] = stats.created_deltas([i for i in instances if i.user_id == user_id])
+    else:
+        recipes = {instance.pk: instance for instance in instances}
+        links = stats.recipe_links(recipes, relations) if relations else {}
+        for pk, instance in recipes.items():
+            user_deltas = deltas[instance.user_id]
+            old = getattr(instance, '_stats_old', None)
+            instance._stats_old = None
+            if old is not None:
+                user_deltas.update(stats.recipe_deltas(instance.price, instance.time_minutes))
+                user_deltas.update(stats.recipe_deltas(*old, sign=-1))
+            if relations:
+                old_links = getattr(instance, '_stats_links', None) or {}
+                instance._stats_links = None
+                for field in relations:
+                    user_deltas.update(stats.link_deltas(field, links.get(pk, {}).get(field, [])))
+                    user_deltas.update(stats.link_deltas(field, old_links.get(field, []), sign=-1))
+    for user_id, user_deltas in deltas.items():
+        stats.apply(user_id, user_deltas)
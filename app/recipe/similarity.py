@@ -0,0 +1,225 @@
+import fcntl
+import json
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+import numpy as np
+import scipy.sparse as sp
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.cache import user_index_cache
+from core.models import Recipe
+from recipe.cache import get_version
+
+
+SIMILAR_LIMIT = 10
+SIMILAR_MAX_LIMIT = 50
+METRICS = ('jaccard', 'cosine')
+# recipes changed this long before the last build are read again, their
+# transaction may have committed after the build looked
+REFRESH_MARGIN = timedelta(minutes=5)
+ARRAYS = ('recipe_ids', 'data', 'indices', 'indptr')
+POINTER = 'current.json'
+LOCK = 'save.lock'
+# matrices kept open per process, one per user, fewer than the indexes as they are larger
+MATRIX_CACHE_SIZE = 100
+
+_matrices = user_index_cache(MATRIX_CACHE_SIZE)
+
+
+def similarity_root():
+    return getattr(settings, 'RECIPE_SIMILARITY_ROOT', os.path.join(settings.MEDIA_ROOT, 'similarity'))
+
+
+def _links(user_id, since=None):
+    """
+    return {recipe id: feature columns} read from the through tables, only
+    recipes updated since if given. tags and ingredients share the column
+    space, even columns are tags and odd ones ingredients
+    """
+    features = {}
+    for field, offset in (('tag', 0), ('ingredient', 1)):
+        links = Recipe._meta.get_field(field).remote_field.through.objects.filter(recipe__user_id=user_id)
+        if since is not None:
+            links = links.filter(recipe__updated_at__gte=since)
+        for recipe_id, related_id in links.values_list('recipe_id', f'{field}_id').iterator():
+            features.setdefault(recipe_id, []).append(related_id * 2 + offset)
+    return features
+
+
+def _rows_matrix(recipe_ids, features, ncols):
+    """ a binary csr matrix with one row per recipe id, columns sorted within each row """
+    indptr = np.zeros(len(recipe_ids) + 1, dtype=np.int64)
+    columns = []
+    for row, recipe_id in enumerate(recipe_ids):
+        row_columns = sorted(set(features.get(recipe_id, ())))
+        columns.extend(row_columns)
+        indptr[row + 1] = indptr[row] + len(row_columns)
+    indices = np.asarray(columns, dtype=np.int64)
+    return sp.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(recipe_ids), ncols))
+
+
+class SimilarityMatrix:
+    """
+    recipe x feature matrix of one user, one row per recipe ordered by id and a
+    1 where the recipe has the tag or ingredient of the column. saved as .npy
+    files and opened memory mapped, so every worker shares the same pages
+    """
+
+    def __init__(self, recipe_ids, matrix, version, built_at):
+        self.recipe_ids = recipe_ids
+        self.matrix = matrix
+        self.version = version
+        self.built_at = built_at
+
+    @classmethod
+    def open(cls, user_id):
+        """ the matrix last saved for a user, or None """
+        directory = os.path.join(similarity_root(), str(user_id))
+        try:
+            with open(os.path.join(directory, POINTER)) as f:
+                meta = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(directory, meta['directory'], f'{name}.npy'), mmap_mode='r')
+                for name in ARRAYS
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+        matrix = sp.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=(len(arrays['recipe_ids']), meta['columns']), copy=False
+        )
+        matrix.has_sorted_indices = True
+        return cls(arrays['recipe_ids'], matrix, meta['version'], parse_datetime(meta['built_at']))
+
+    @classmethod
+    def refresh(cls, user_id, version, stored=None):
+        """
+        build the matrix of a user, reusing the rows of stored for the recipes
+        that did not change since it was built
+        """
+        built_at = timezone.now()
+        recipe_ids = np.fromiter(
+            Recipe.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True).iterator(),
+            dtype=np.int64
+        )
+        since = None if stored is None else stored.built_at - REFRESH_MARGIN
+        features = _links(user_id, since)
+        if since is not None:
+            changed = Recipe.objects.filter(user_id=user_id, updated_at__gte=since).values_list('id', flat=True)
+            changed = np.fromiter(changed.iterator(), dtype=np.int64)
+        else:
+            changed = recipe_ids
+
+        ncols = max([stored.matrix.shape[1] if stored is not None else 0] + [
+            max(columns) + 1 for columns in features.values()
+        ])
+        new_ids = np.intersect1d(recipe_ids, changed)
+        parts, ids = [_rows_matrix(new_ids, features, ncols)], [new_ids]
+        if stored is not None:
+            keep = np.isin(stored.recipe_ids, recipe_ids) & ~np.isin(stored.recipe_ids, changed)
+            old = stored.matrix[np.flatnonzero(keep)]
+            old.resize((old.shape[0], ncols))
+            parts.append(old)
+            ids.append(np.asarray(stored.recipe_ids[keep]))
+
+        all_ids = np.concatenate(ids)
+        order = np.argsort(all_ids)
+        matrix = sp.vstack(parts, format='csr')[order]
+        matrix.sort_indices()
+        return cls(all_ids[order], matrix, version, built_at)
+
+    def save(self, user_id):
+        """
+        write the arrays to a new directory, then point current.json at it and
+        drop older ones. saves of a user take turns on a lock file, so one never
+        removes the directory another is writing, and a save of an older
+        version than the published one is dropped
+        """
+        directory = os.path.join(similarity_root(), str(user_id))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._publish(directory)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _publish(self, directory):
+        try:
+            with open(os.path.join(directory, POINTER)) as f:
+                current = json.load(f)
+        except (OSError, ValueError):
+            current = None
+        if current is not None and current.get('version', -1) > self.version:
+            return
+        name = f'v{self.version}-{uuid.uuid4().hex}'
+        os.makedirs(os.path.join(directory, name))
+        arrays = {
+            'recipe_ids': self.recipe_ids,
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+        }
+        for array_name, values in arrays.items():
+            np.save(os.path.join(directory, name, f'{array_name}.npy'), np.asarray(values))
+        meta = {
+            'directory': name,
+            'version': self.version,
+            'built_at': self.built_at.isoformat(),
+            'columns': self.matrix.shape[1],
+        }
+        pointer = os.path.join(directory, f'{POINTER}.{name}')
+        with open(pointer, 'w') as f:
+            json.dump(meta, f)
+        os.replace(pointer, os.path.join(directory, POINTER))
+        # workers still mapping an older version keep their pages until they reopen
+        for entry in os.listdir(directory):
+            if entry.startswith('v') and entry != name:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    def similar(self, recipe_id, metric='jaccard', limit=SIMILAR_LIMIT):
+        """ return (recipe id, score) of the recipes sharing most tags and ingredients with recipe_id """
+        row = np.searchsorted(self.recipe_ids, recipe_id)
+        if row >= len(self.recipe_ids) or self.recipe_ids[row] != recipe_id:
+            return []
+        target = self.matrix[row]
+        if not target.nnz:
+            return []
+        shared = np.asarray((self.matrix @ target.T).todense()).ravel().astype(np.float64)
+        sizes = np.diff(self.matrix.indptr).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric == 'cosine':
+                scores = shared / np.sqrt(sizes * target.nnz)
+            else:
+                scores = shared / (sizes + target.nnz - shared)
+        scores[row] = 0
+        candidates = np.flatnonzero(shared > 0)
+        candidates = candidates[candidates != row]
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        # best score first, newest recipe first on ties
+        order = np.lexsort((-self.recipe_ids[candidates], -scores[candidates]))
+        return [(int(self.recipe_ids[i]), float(scores[i])) for i in candidates[order]]
+
+
+def similarity_matrix(user_id):
+    """ return the user's matrix for the current version, refreshing and saving it when needed """
+    version, _ = get_version(user_id)
+    matrix = _matrices.get(user_id)
+    if matrix is not None and matrix.version == version:
+        return matrix
+    matrix = SimilarityMatrix.open(user_id)
+    if matrix is None or matrix.version != version:
+        matrix = SimilarityMatrix.refresh(user_id, version, matrix)
+        matrix.save(user_id)
+    _matrices.set(user_id, matrix)
+    return matrix
+
+
+def similar_recipes(user_id, recipe_id, metric='jaccard', limit=SIMILAR_LIMIT):
+    return similarity_matrix(user_id).similar(recipe_id, metric, min(limit, SIMILAR_MAX_LIMIT))
@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import Recipe
+from recipe.variants import render_variants
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # 'process' resizes in a process pool, 'thread' in the dispatching
+    # threads, 'sync' inline during the request (tests, development)
+    'BACKEND': 'process',
+    'MAX_WORKERS': 2,
+}
+
+_lock = threading.Lock()
+_executors = {}
+
+
+def worker_settings():
+    return {**DEFAULTS, **getattr(settings, 'RECIPE_IMAGE_WORKERS', {})}
+
+
+def _executor(kind):
+    """ return the shared pool of kind, created on first use """
+    with _lock:
+        if kind not in _executors:
+            max_workers = worker_settings()['MAX_WORKERS']
+            if kind == 'process':
+                # spawn, forking a threaded server process is not safe
+                _executors[kind] = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                _executors[kind] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recipe-image')
+        return _executors[kind]
+
+
+def variant_prefix(image_name):
+    """ variants live next to the original in a variants directory """
+    directory, filename = os.path.split(image_name)
+    return os.path.join(directory, 'variants', os.path.splitext(filename)[0])
+
+
+def schedule_variants(recipe):
+    """ mark the recipe image pending and render its variants in the background """
+    Recipe.objects.filter(pk=recipe.pk).update(
+        image_status=Recipe.ImageStatus.PENDING, image_variants={}, updated_at=timezone.now()
+    )
+    recipe.image_status = Recipe.ImageStatus.PENDING
+    recipe.image_variants = {}
+
+    backend = worker_settings()['BACKEND']
+    if backend == 'sync':
+        process_image(recipe.pk, recipe.image.name)
+        recipe.refresh_from_db(fields=['image_status', 'image_variants'])
+    else:
+        # the worker must see the committed image name
+        transaction.on_commit(
+            lambda: _executor('thread').submit(_process_in_pool, recipe.pk, recipe.image.name, backend == 'process')
+        )
+
+
+def process_image(recipe_id, image_name, in_process=False):
+    """
+    render the variants of image_name and store them on the recipe, unless
+    the recipe got another image in the meantime
+    """
+    current = Recipe.objects.filter(pk=recipe_id, image=image_name)
+
+    def set_status(image_status, **fields):
+        # the recipe detail shows the status, its etag comes from updated_at
+        current.update(image_status=image_status, updated_at=timezone.now(), **fields)
+
+    try:
+        # images are stored by content, another recipe may have rendered these already
+        rendered = Recipe.objects.filter(image=image_name, image_status=Recipe.ImageStatus.READY).exclude(
+            pk=recipe_id
+        ).values_list('image_variants', flat=True).first()
+        if rendered:
+            set_status(Recipe.ImageStatus.READY, image_variants=rendered)
+            return
+        set_status(Recipe.ImageStatus.PROCESSING)
+        args = (os.path.join(settings.MEDIA_ROOT, image_name), settings.MEDIA_ROOT, variant_prefix(image_name))
+        if in_process:
+            variants = _executor('process').submit(render_variants, *args).result()
+        else:
+            variants = render_variants(*args)
+        set_status(Recipe.ImageStatus.READY, image_variants=variants)
+    except Exception:
+        logger.exception('could not render variants of %s', image_name)
+        set_status(Recipe.ImageStatus.FAILED)
+
+
+def _process_in_pool(recipe_id, image_name, in_process):
+    try:
+        process_image(recipe_id, image_name, in_process)
+    finally:
+        close_old_connections()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import AsyncRequestFactory, SimpleTestCase, TransactionTestCase
+from django.urls import resolve
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from core.management.commands.loadtest import reload_urls
+from core.models import Recipe,Tag,Ingredient
+from recipe.async_views import async_view
+from recipe.cache import response_cache
+from recipe.views import TagViewSet,IngredientViewSet,RecipeViewSet
+from user.authentication import token_cache
+
+
+recipe_list = async_view(RecipeViewSet,{'get':'list','post':'create'})
+recipe_detail = async_view(RecipeViewSet,{'get':'retrieve','patch':'partial_update'})
+tag_list = async_view(TagViewSet,{'get':'list'})
+ingredient_list = async_view(IngredientViewSet,{'get':'list'})
+
+
+# reads run on executor threads with their own connections, so the test data has to be committed
+class AsyncRecipeViewTests(TransactionTestCase):
+    """ test the coroutine versions of the read endpoints """
+
+    def setUp(self):
+        response_cache().clear()
+        token_cache.clear()
+        self.user = get_user_model().objects.create_user('async@test.com','pass1234')
+        token = Token.objects.create(user=self.user)
+        self.factory = AsyncRequestFactory()
+        self.auth = {'authorization': f'Token {token.key}'}
+        self.tag = Tag.objects.create(user=self.user,name='vegan')
+        Ingredient.objects.create(user=self.user,name='tofu')
+        self.recipe = Recipe.objects.create(user=self.user,title='tofu bowl',time_minutes=10,price=5)
+        self.recipe.tag.add(self.tag)
+
+    def call(self,view,request,**kwargs):
+        return async_to_sync(view)(request,**kwargs)
+
+    def test_recipe_list(self):
+        """ test the async list returns the user's recipes with their tags"""
+        res = self.call(recipe_list,self.factory.get('/api/recipe/recipes/',**self.auth))
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        results = json.loads(res.content)['results']
+        self.assertEqual([recipe['title'] for recipe in results],['tofu bowl'])
+        self.assertEqual(results[0]['tag'],[self.tag.id])
+
+    def test_recipe_detail_conditional(self):
+        """ test the async detail sends an etag and answers 304 to it"""
+        res = self.call(recipe_detail,self.factory.get('/',**self.auth),pk=str(self.recipe.id))
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(json.loads(res.content)['tag'][0]['name'],'vegan')
+
+        request = self.factory.get('/',**self.auth,**{'if-none-match':res['ETag']})
+        res = self.call(recipe_detail,request,pk=str(self.recipe.id))
+        self.assertEqual(res.status_code,status.HTTP_304_NOT_MODIFIED)
+
+    def test_recipe_detail_write(self):
+        """ test writes still work through the shared thread"""
+        request = self.factory.patch('/',data={'title':'tempeh bowl'},content_type='application/json',**self.auth)
+        res = self.call(recipe_detail,request,pk=str(self.recipe.id))
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title,'tempeh bowl')
+
+    def test_tag_and_ingredient_lists(self):
+        res = self.call(tag_list,self.factory.get('/api/recipe/tag/',**self.auth))
+        self.assertEqual([tag['name'] for tag in json.loads(res.content)['results']],['vegan'])
+        res = self.call(ingredient_list,self.factory.get('/api/recipe/ingredient/',**self.auth))
+        self.assertEqual([item['name'] for item in json.loads(res.content)['results']],['tofu'])
+
+    def test_requires_authentication(self):
+        res = self.call(recipe_list,AsyncRequestFactory().get('/api/recipe/recipes/'))
+        self.assertEqual(res.status_code,status.HTTP_401_UNAUTHORIZED)
+
+
+class AsyncUrlTests(SimpleTestCase):
+    """ test the routes with the coroutine views mounted """
+
+    def setUp(self):
+        reload_urls(True)
+        self.addCleanup(reload_urls,False)
+
+    def test_detail_route_is_async(self):
+        match = resolve('/api/recipe/recipes/1/')
+        self.assertEqual(match.kwargs,{'pk':1})
+        self.assertTrue(asyncio.iscoroutinefunction(match.func))
+
+    def test_list_actions_reach_the_router(self):
+        """ test the async detail route does not swallow list level actions"""
+        for action in ('search','bulk','export','import','pantry','stats'):
+            match = resolve(f'/api/recipe/recipes/{action}/')
+            self.assertNotIn('pk',match.kwargs,action)
+            self.assertNotEqual(match.url_name,'recipe-detail',action)
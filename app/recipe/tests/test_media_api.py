@@ -0,0 +1,145 @@
+import os
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.storage import IMMUTABLE_CACHE_CONTROL
+from recipe.media import RangeNotSatisfiable, parse_range
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+def media_url(name):
+    return reverse('media',args=[name])
+
+
+def sample_recipe(user,**params):
+    defaults = {'title':'sample recipe','time_minutes':10,'price':5.00}
+    defaults.update(params)
+    return Recipe.objects.create(user=user,**defaults)
+
+
+class MediaApiTests(TestCase):
+    """ test serving recipe images through the media view """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('media@test.com','testpass')
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+        self.storage = Recipe._meta.get_field('image').storage
+        self.recipe.image = self.storage.save('photo.jpg',ContentFile(CONTENT))
+        self.recipe.save()
+        self.url = media_url(self.recipe.image.name)
+
+    def tearDown(self):
+        self.storage.delete(self.recipe.image.name)
+
+    def content(self,res):
+        return b''.join(res.streaming_content)
+
+    def test_owner_gets_file_with_immutable_headers(self):
+        """ test the owner gets the bytes, cacheable forever as the name is the hash"""
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(self.content(res),CONTENT)
+        self.assertEqual(res['Content-Type'],'image/jpeg')
+        self.assertEqual(res['Cache-Control'],IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(res['Accept-Ranges'],'bytes')
+        self.assertIn('ETag',res)
+
+    def test_other_user_gets_not_found(self):
+        """ test files of another user's recipes are not served"""
+        other = get_user_model().objects.create_user('other@test.com','testpass')
+        self.client.force_authenticate(other)
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code,status.HTTP_404_NOT_FOUND)
+
+    def test_login_required(self):
+        """ test anonymous requests are refused"""
+        res = APIClient().get(self.url)
+        self.assertEqual(res.status_code,status.HTTP_401_UNAUTHORIZED)
+
+    def test_variant_of_own_image(self):
+        """ test variants of the image are served to the owner"""
+        stem = self.recipe.image.name.rsplit('/',1)[-1].split('.')[0]
+        directory = self.recipe.image.name.rsplit('/',1)[0]
+        # variants are written by the resize worker, not through the hashing storage
+        name = f'{directory}/variants/{stem}-thumbnail.webp'
+        os.makedirs(os.path.dirname(self.storage.path(name)),exist_ok=True)
+        with open(self.storage.path(name),'wb') as f:
+            f.write(b'variant')
+        try:
+            res = self.client.get(media_url(name))
+            self.assertEqual(res.status_code,status.HTTP_200_OK)
+            self.assertEqual(self.content(res),b'variant')
+        finally:
+            self.storage.delete(name)
+
+    def test_range_request(self):
+        """ test a byte range is answered with 206 and only those bytes"""
+        res = self.client.get(self.url,HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code,status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(self.content(res),CONTENT[10:20])
+        self.assertEqual(res['Content-Range'],f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(res['Content-Length'],'10')
+
+    def test_unsatisfiable_range(self):
+        """ test a range past the end of the file is a 416"""
+        res = self.client.get(self.url,HTTP_RANGE=f'bytes={len(CONTENT)}-')
+
+        self.assertEqual(res.status_code,status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(res['Content-Range'],f'bytes */{len(CONTENT)}')
+
+    def test_stale_if_range_sends_whole_file(self):
+        """ test a range with an outdated If-Range gets the full file"""
+        res = self.client.get(self.url,HTTP_RANGE='bytes=0-9',HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(self.content(res),CONTENT)
+
+    def test_conditional_get(self):
+        """ test a matching If-None-Match is a 304"""
+        etag = self.client.get(self.url)['ETag']
+        res = self.client.get(self.url,HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code,status.HTTP_304_NOT_MODIFIED)
+
+    def test_accept_header_is_ignored(self):
+        """ test a browser image Accept header does not fail negotiation"""
+        res = self.client.get(self.url,HTTP_ACCEPT='image/avif,image/webp,*/*;q=0.8')
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+
+    @override_settings(MEDIA_SERVING={'BACKEND':'x-accel-redirect','ACCEL_REDIRECT_PREFIX':'/protected/'})
+    def test_x_accel_redirect(self):
+        """ test the file is handed to nginx instead of being read"""
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(res['X-Accel-Redirect'],f'/protected/{self.recipe.image.name}')
+        self.assertEqual(res.content,b'')
+        self.assertEqual(res['Cache-Control'],IMMUTABLE_CACHE_CONTROL)
+
+    @override_settings(MEDIA_SERVING={'BACKEND':'x-sendfile'})
+    def test_x_sendfile(self):
+        """ test the absolute path is handed to the server"""
+        res = self.client.get(self.url)
+        self.assertEqual(res['X-Sendfile'],self.recipe.image.path)
+
+    def test_parse_range(self):
+        """ test the supported forms of the Range header"""
+        self.assertEqual(parse_range('bytes=0-9',100),(0,9))
+        self.assertEqual(parse_range('bytes=90-',100),(90,99))
+        self.assertEqual(parse_range('bytes=-10',100),(90,99))
+        self.assertEqual(parse_range('bytes=50-500',100),(50,99))
+        self.assertIsNone(parse_range('bytes=0-1,5-6',100))
+        self.assertIsNone(parse_range('bytes=9-0',100))
+        self.assertIsNone(parse_range('items=0-9',100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=100-',100)
@@ -1,20 +1,43 @@
 # used to create a temporary file
 import tempfile
+import threading
+import hashlib
 import os
+from unittest.mock import patch
 from PIL import Image
-from django.test import TestCase
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.files.storage import default_storage
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Recipe,Ingredient,Tag
+from recipe.cache import bump_version, response_cache
+from recipe import similarity
+from core import stats
+from core.search import FTS_TABLE
 from recipe.serializers import RecipeSerializer,RecipeDetailSerializer
+from recipe.uploads import RecipeImageUploadHandler
+from recipe.tasks import process_image
 import json
+import numpy
+from datetime import timedelta
+from django.utils import timezone
 
 
 RECIPE_URL = reverse('recipe:recipe-list')
+RECIPE_BULK_URL = reverse('recipe:recipe-bulk')
+RECIPE_EXPORT_URL = reverse('recipe:recipe-export')
+RECIPE_IMPORT_URL = reverse('recipe:recipe-import-recipes')
+RECIPE_SEARCH_URL = reverse('recipe:recipe-search')
+RECIPE_PANTRY_URL = reverse('recipe:recipe-pantry')
+RECIPE_STATS_URL = reverse('recipe:recipe-stats')
 
 
 def image_upload_url(recipe_id):
@@ -48,6 +71,17 @@ def sample_recipe(user,**params):
     return Recipe.objects.create(user=user,**default)
 
 
+def sample_recipes_with_relations(user,count):
+    """create recipes that each have a tag and an ingredient"""
+    recipes = []
+    for i in range(count):
+        recipe = sample_recipe(user=user,title=f'recipe {i}')
+        recipe.tag.add(sample_tag(user=user,name=f'tag {i}'))
+        recipe.ingredient.add(sample_ingredient(user=user,name=f'ingredient {i}'))
+        recipes.append(recipe)
+    return recipes
+
+
 class PublicRecipeApiTest(TestCase):
     """ test unauthenticated recipe api test"""
 
@@ -74,14 +108,14 @@ class PrivateRecipeApiTest(TestCase):
         sample_recipe(user=self.user)
         res = self.client.get(RECIPE_URL)
 
-        recipes = Recipe.objects.all().order_by('id')
+        recipes = Recipe.objects.all().order_by('-id')
         serializer = RecipeSerializer(recipes,many=True)
 
         print(json.dumps(serializer.data, indent=1))
         print('ok')
         print(json.dumps(res.data, indent=1))
         self.assertTrue(res.status_code,status.HTTP_200_OK)
-        self.assertEqual(res.data,serializer.data)
+        self.assertEqual(res.data['results'],serializer.data)
 
     def test_recipe_limited_to_user(self):
         """ retrieve recipes limited to the authenticated user"""
@@ -93,8 +127,8 @@ class PrivateRecipeApiTest(TestCase):
         serializer = RecipeSerializer(recipe,many=True)
 
         self.assertEqual(res.status_code,status.HTTP_200_OK)
-        self.assertEqual(len(res.data),1)
-        self.assertEqual(res.data,serializer.data)
+        self.assertEqual(len(res.data['results']),1)
+        self.assertEqual(res.data['results'],serializer.data)
 
     def test_view_recipe_detail(self):
         """ test to view a recipe detail"""
@@ -199,6 +233,824 @@ class PrivateRecipeApiTest(TestCase):
         self.assertEqual(recipe.user,self.user)
 
 
+class RecipeQueryCountTests(TestCase):
+    """ test that recipe endpoints run a fixed number of queries """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('querycount@test.com','pass1234')
+        self.client.force_authenticate(self.user)
+
+    def assertEndpointQueries(self,num,url):
+        """ assert that a GET on url runs exactly num queries """
+        with self.assertNumQueries(num):
+            res = self.client.get(url)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return res
+
+    def test_list_query_count_is_constant(self):
+        """ test listing recipes does not run a query per recipe """
+        sample_recipes_with_relations(self.user,1)
+        self.assertEndpointQueries(3,RECIPE_URL)
+        sample_recipes_with_relations(self.user,20)
+        res = self.assertEndpointQueries(3,RECIPE_URL)
+        self.assertEqual(len(res.data['results']),21)
+
+    def test_detail_query_count(self):
+        """ test the detail view loads nested tags and ingredients in bulk """
+        recipe = sample_recipes_with_relations(self.user,1)[0]
+        recipe.tag.add(sample_tag(user=self.user,name='extra'))
+        # one indexed lookup of updated_at for the etag, then the recipe and its relations
+        res = self.assertEndpointQueries(4,detail_url(recipe.id))
+        self.assertEqual(len(res.data['tag']),2)
+
+    def test_detail_not_modified(self):
+        """ test a matching etag is answered with 304 after a single query """
+        recipe = sample_recipes_with_relations(self.user,1)[0]
+        res = self.client.get(detail_url(recipe.id))
+
+        with self.assertNumQueries(1):
+            res = self.client.get(detail_url(recipe.id),HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code,status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_etag_changes_with_relations(self):
+        """ test adding a tag or renaming an ingredient changes the detail etag """
+        recipe = sample_recipes_with_relations(self.user,1)[0]
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        recipe.tag.add(sample_tag(user=self.user,name='new tag'))
+        res = self.client.get(detail_url(recipe.id),HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'],etag)
+
+        etag = res['ETag']
+        ingredient = recipe.ingredient.get()
+        ingredient.name = 'renamed'
+        ingredient.save()
+        res = self.client.get(detail_url(recipe.id),HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(res.data['ingredient'][0]['name'],'renamed')
+
+
+class RecipePaginationTests(TestCase):
+    """ test keyset pagination of the recipe list """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('paginate@test.com','pass1234')
+        self.client.force_authenticate(self.user)
+
+    def test_pages_follow_cursor(self):
+        """ test walking the next links returns every recipe once, newest first """
+        recipes = [sample_recipe(user=self.user,title=f'recipe {i}') for i in range(5)]
+
+        res = self.client.get(RECIPE_URL,{'page_size':2})
+        ids = [item['id'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids += [item['id'] for item in res.data['results']]
+
+        self.assertEqual(ids,[recipe.id for recipe in reversed(recipes)])
+
+    def test_last_page_has_no_next(self):
+        """ test the next link is empty once all recipes are returned """
+        sample_recipe(user=self.user)
+        res = self.client.get(RECIPE_URL,{'page_size':2})
+
+        self.assertEqual(len(res.data['results']),1)
+        self.assertIsNone(res.data['next'])
+
+    def test_invalid_cursor(self):
+        """ test a malformed cursor returns 404 """
+        res = self.client.get(RECIPE_URL,{'cursor':'not-a-cursor'})
+        self.assertEqual(res.status_code,status.HTTP_404_NOT_FOUND)
+
+
+class RecipeBulkApiTests(TestCase):
+    """ test the bulk recipe endpoint """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('bulk@test.com','pass1234')
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create_recipes(self):
+        """ test creating several recipes with tags and ingredients in one call """
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        payload = [
+            {'title':'curry','time_minutes':30,'price':'5.00','tag':[tag.id],'ingredient':[ingredient.id]},
+            {'title':'toast','time_minutes':5,'price':'1.00'},
+        ]
+        res = self.client.post(RECIPE_BULK_URL,payload,format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(res.data['errors'],[])
+        curry = Recipe.objects.get(user=self.user,title='curry')
+        self.assertEqual(list(curry.tag.all()),[tag])
+        self.assertEqual(list(curry.ingredient.all()),[ingredient])
+        self.assertEqual([item['title'] for item in res.data['results']],['curry','toast'])
+
+    def test_bulk_create_reports_item_errors(self):
+        """ test invalid items are reported by index and valid ones are still created """
+        other = get_user_model().objects.create_user('other@test.com','pass1234')
+        foreign_tag = sample_tag(user=other)
+        payload = [
+            {'title':'curry','time_minutes':30,'price':'5.00'},
+            {'title':'no price','time_minutes':5},
+            {'title':'foreign tag','time_minutes':5,'price':'1.00','tag':[foreign_tag.id]},
+        ]
+        res = self.client.post(RECIPE_BULK_URL,payload,format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([error['index'] for error in res.data['errors']],[1,2])
+        self.assertIn('price',res.data['errors'][0]['errors'])
+        self.assertIn('tag',res.data['errors'][1]['errors'])
+        self.assertEqual(list(Recipe.objects.values_list('title',flat=True)),['curry'])
+
+    def test_bulk_create_requires_list(self):
+        """ test the bulk endpoint rejects a single object """
+        res = self.client.post(RECIPE_BULK_URL,{'title':'curry'},format='json')
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_recipes(self):
+        """ test updating fields and tags of several recipes in one call """
+        recipe1 = sample_recipe(user=self.user,title='curry')
+        recipe2 = sample_recipe(user=self.user,title='toast')
+        old_tag = sample_tag(user=self.user,name='old')
+        new_tag = sample_tag(user=self.user,name='new')
+        recipe1.tag.add(old_tag)
+        payload = [
+            {'id':recipe1.id,'tag':[new_tag.id]},
+            {'id':recipe2.id,'title':'french toast'},
+            {'id':0,'title':'missing'},
+        ]
+        res = self.client.patch(RECIPE_BULK_URL,payload,format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['errors'],[{'index':2,'errors':{'id':['Not found.']}}])
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe2.title,'french toast')
+        self.assertEqual(list(recipe1.tag.all()),[new_tag])
+
+    def test_bulk_update_repeated_id(self):
+        """ test a recipe listed twice is updated once and the repeat reported """
+        recipe = sample_recipe(user=self.user,title='curry')
+        tag = sample_tag(user=self.user)
+        payload = [{'id':recipe.id,'tag':[tag.id]},{'id':recipe.id,'tag':[tag.id],'title':'again'}]
+        res = self.client.patch(RECIPE_BULK_URL,payload,format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['errors'],[{'index':1,'errors':{'id':['Duplicate id in the batch.']}}])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title,'curry')
+        self.assertEqual(list(recipe.tag.all()),[tag])
+
+    def test_bulk_set_relations_same_recipe_twice(self):
+        """ test linking rows are not duplicated when a recipe is passed more than once """
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        Recipe.objects.bulk_set_relations('tag',[recipe,recipe],[[tag.id],[tag.id]])
+        self.assertEqual(list(recipe.tag.all()),[tag])
+
+    def test_bulk_delete_recipes(self):
+        """ test deleting several recipes, ids of other users are reported"""
+        other = get_user_model().objects.create_user('other@test.com','pass1234')
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        foreign = sample_recipe(user=other)
+
+        res = self.client.delete(RECIPE_BULK_URL,[recipe1.id,recipe2.id,foreign.id],format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['results'],[recipe1.id,recipe2.id])
+        self.assertEqual(list(Recipe.objects.all()),[foreign])
+
+
+class RecipeExportApiTests(TestCase):
+    """ test streaming the recipe catalog """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('export@test.com','pass1234')
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user,title='curry',price=7.50)
+        self.recipe.tag.add(sample_tag(user=self.user,name='dinner'))
+        self.recipe.ingredient.add(
+            sample_ingredient(user=self.user,name='rice'),
+            sample_ingredient(user=self.user,name='lentils'),
+        )
+        sample_recipe(user=get_user_model().objects.create_user('other@test.com','pass1234'))
+
+    def test_export_ndjson(self):
+        """ test exporting recipes as one json document per line """
+        res = self.client.get(RECIPE_EXPORT_URL,{'format':'ndjson'})
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines),1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['title'],'curry')
+        self.assertEqual(row['price'],'7.50')
+        self.assertEqual(row['tags'],['dinner'])
+        self.assertEqual(sorted(row['ingredients']),['lentils','rice'])
+
+    def test_export_csv(self):
+        """ test exporting recipes as csv with a header row """
+        res = self.client.get(RECIPE_EXPORT_URL,{'format':'csv'})
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertTrue(res['Content-Type'].startswith('text/csv'))
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0],'id,title,time_minutes,price,link,tags,ingredients')
+        self.assertEqual(len(lines),2)
+        self.assertIn('dinner',lines[1])
+
+    def test_export_empty_csv_has_header(self):
+        """ test a user without recipes still gets the header row """
+        self.client.force_authenticate(get_user_model().objects.create_user('empty@test.com','pass1234'))
+        res = self.client.get(RECIPE_EXPORT_URL,{'format':'csv'})
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines,['id,title,time_minutes,price,link,tags,ingredients'])
+
+    def test_export_reads_in_chunks(self):
+        """ test relations are prefetched once per chunk instead of once per recipe """
+        for i in range(4):
+            sample_recipe(user=self.user,title=f'recipe {i}')
+        with patch('recipe.export.EXPORT_CHUNK_SIZE',2), self.assertNumQueries(7):
+            res = self.client.get(RECIPE_EXPORT_URL,{'format':'ndjson'})
+            lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines),5)
+
+
+class RecipeImportApiTests(TestCase):
+    """ test uploading a recipe file to import """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('import@test.com','pass1234')
+        self.client.force_authenticate(self.user)
+
+    def test_import_exported_catalog(self):
+        """ test a csv export can be imported back """
+        recipe = sample_recipe(user=self.user,title='curry')
+        recipe.tag.add(sample_tag(user=self.user,name='dinner'))
+        res = self.client.get(RECIPE_EXPORT_URL,{'format':'csv'})
+        content = b''.join(res.streaming_content)
+
+        upload = SimpleUploadedFile('recipes.csv',content,content_type='text/csv')
+        res = self.client.post(RECIPE_IMPORT_URL,{'file':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_201_CREATED)
+        self.assertEqual(res.data['created'],1)
+        self.assertEqual(Recipe.objects.filter(user=self.user,title='curry').count(),2)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(),1)
+
+    def test_import_reports_errors(self):
+        """ test invalid lines are reported with their line number """
+        content = b'{"title": "curry", "time_minutes": 30, "price": "5.50"}\nnot json\n'
+        upload = SimpleUploadedFile('recipes.ndjson',content)
+        res = self.client.post(RECIPE_IMPORT_URL,{'file':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['errors'][0]['line'],2)
+
+    def test_import_reports_what_committed_before_bad_encoding(self):
+        """ test a file that stops being utf-8 reports the recipes already imported and where it stopped """
+        good = b'{"title": "curry", "time_minutes": 30, "price": "5.50"}\n'
+        # the bad byte lands in a later read than the first line
+        content = good + b' ' * 16384 + b'\n' + '{"title": "caf\u00e9"}\n'.encode('latin-1')
+        upload = SimpleUploadedFile('recipes.ndjson',content)
+        res = self.client.post(RECIPE_IMPORT_URL,{'file':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['created'],1)
+        self.assertEqual(res.data['errors'],[
+            {'line':2,'errors':{'file':['The file is not UTF-8 encoded, nothing from here on was imported.']}}
+        ])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(),1)
+
+    def test_import_requires_file(self):
+        """ test importing without a file fails """
+        res = self.client.post(RECIPE_IMPORT_URL,{},format='multipart')
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSearchApiTests(TestCase):
+    """ test full text search over recipes """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email="search@test.com",password="testpass")
+        self.client.force_authenticate(self.user)
+
+    def search(self,text,**params):
+        res = self.client.get(RECIPE_SEARCH_URL,{'q':text,**params})
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return [recipe['title'] for recipe in res.data['results']]
+
+    def test_search_title_tags_and_ingredients(self):
+        """ test words are matched in the title and in tag and ingredient names"""
+        with self.captureOnCommitCallbacks(execute=True):
+            curry = sample_recipe(user=self.user,title='Chicken curry')
+            sample_recipe(user=self.user,title='Vegetable soup').ingredient.add(
+                sample_ingredient(user=self.user,name='chicken stock')
+            )
+            sample_recipe(user=self.user,title='Apple pie')
+            curry.tag.add(sample_tag(user=self.user,name='spicy'))
+
+        self.assertEqual(self.search('chicken'),['Chicken curry','Vegetable soup'])
+        self.assertEqual(self.search('spicy'),['Chicken curry'])
+        self.assertEqual(self.search('curries'),['Chicken curry'])
+        self.assertEqual(self.search('spicy chicken'),['Chicken curry'])
+
+    def test_search_is_limited_to_user(self):
+        """ test recipes of other users are not found"""
+        other = get_user_model().objects.create_user(email="other@test.com",password="testpass")
+        with self.captureOnCommitCallbacks(execute=True):
+            sample_recipe(user=other,title='Chicken curry')
+        self.assertEqual(self.search('chicken'),[])
+
+    def test_index_follows_changes(self):
+        """ test renaming, unlinking and deleting tags and recipes updates the index"""
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = sample_recipe(user=self.user,title='Dal')
+            tag = sample_tag(user=self.user,name='lentils')
+            recipe.tag.add(tag)
+        self.assertEqual(self.search('lentils'),['Dal'])
+
+        tag.name = 'pulses'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        self.assertEqual(self.search('lentils'),[])
+        self.assertEqual(self.search('pulses'),['Dal'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.delete()
+        self.assertEqual(self.search('pulses'),[])
+
+        recipe.title = 'Tadka dal'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertEqual(self.search('tadka'),['Tadka dal'])
+        recipe.delete()
+        self.assertEqual(self.search('tadka'),[])
+
+    def test_bulk_created_recipes_are_indexed(self):
+        """ test recipes inserted in bulk can be searched"""
+        tag = sample_tag(user=self.user,name='breakfast')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(RECIPE_BULK_URL,[
+                {'title':'Pancakes','time_minutes':10,'price':'2.00','tag':[tag.id]},
+                {'title':'Waffles','time_minutes':10,'price':'2.00'},
+            ],format='json')
+        self.assertEqual(self.search('breakfast'),['Pancakes'])
+        self.assertEqual(self.search('waffles'),['Waffles'])
+
+    def test_create_is_indexed_once(self):
+        """ test creating a recipe with tags and ingredients indexes it in one statement at commit"""
+        tags = [sample_tag(user=self.user,name=f'tag {i}').id for i in range(3)]
+        ingredients = [sample_ingredient(user=self.user,name=f'ingredient {i}').id for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(RECIPE_URL,{
+                    'title':'Stew','time_minutes':60,'price':'8.00','tag':tags,'ingredient':ingredients,
+                })
+        self.assertEqual(res.status_code,status.HTTP_201_CREATED)
+        indexing = (f'INSERT INTO {FTS_TABLE}','UPDATE core_recipe SET search_vector')
+        self.assertEqual(len([query for query in queries if query['sql'].lstrip().startswith(indexing)]),1)
+        self.assertEqual(self.search('ingredient'),['Stew'])
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        """ test the ids queued by a rolled back transaction are not indexed by the next one"""
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    sample_recipe(user=self.user,title='Ghost')
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+            sample_recipe(user=self.user,title='Soup')
+        self.assertEqual(self.search('ghost'),[])
+        self.assertEqual(self.search('soup'),['Soup'])
+
+    def test_search_requires_query(self):
+        """ test a missing query or a bad limit is a 400"""
+        self.assertEqual(self.client.get(RECIPE_SEARCH_URL).status_code,status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(RECIPE_SEARCH_URL,{'q':'x','limit':1000})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+    def test_search_syntax_is_not_interpreted(self):
+        """ test query operators typed by users do not cause errors"""
+        with self.captureOnCommitCallbacks(execute=True):
+            sample_recipe(user=self.user,title='Fish and chips')
+        self.assertEqual(self.search('fish" (chips*'),['Fish and chips'])
+        self.assertEqual(self.search('***'),[])
+
+
+class RecipePantryApiTests(TestCase):
+    """ test ranking recipes by how much of them a pantry covers """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email="pantry@test.com",password="testpass")
+        self.client.force_authenticate(self.user)
+        # test databases can hand out the same user id again, start from a fresh version
+        response_cache().clear()
+        self.egg = sample_ingredient(user=self.user,name='egg')
+        self.flour = sample_ingredient(user=self.user,name='flour')
+        self.milk = sample_ingredient(user=self.user,name='milk')
+        self.pancakes = sample_recipe(user=self.user,title='pancakes')
+        self.pancakes.ingredient.add(self.egg,self.flour,self.milk)
+        self.omelette = sample_recipe(user=self.user,title='omelette')
+        self.omelette.ingredient.add(self.egg)
+        self.bread = sample_recipe(user=self.user,title='bread')
+        self.bread.ingredient.add(self.flour)
+
+    def pantry(self,*ingredients,**params):
+        res = self.client.get(RECIPE_PANTRY_URL,{'ingredient':','.join(str(i.id) for i in ingredients),**params})
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return [(item['recipe']['title'],item['coverage'],item['missing']) for item in res.data['results']]
+
+    def test_pantry_ranks_by_coverage(self):
+        """ test fully covered recipes come first and missing ingredients are listed"""
+        self.assertEqual(self.pantry(self.egg,self.milk),[
+            ('omelette',1.0,[]),
+            ('pancakes',0.6667,[self.flour.id]),
+        ])
+        self.assertEqual(len(self.pantry(self.egg,self.flour,self.milk,limit=1)),1)
+
+    def test_pantry_of_other_user_is_empty(self):
+        """ test recipes of other users are never matched"""
+        other = get_user_model().objects.create_user(email="other@test.com",password="testpass")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.pantry(self.egg),[])
+
+    def test_pantry_follows_changes_without_rebuild(self):
+        """ test relation changes and deletes made here update the index in place"""
+        self.pantry(self.egg)
+        with patch('recipe.pantry.PantryIndex.build') as build:
+            # each write commits on its own, the test transaction never does
+            with self.captureOnCommitCallbacks(execute=True):
+                self.bread.ingredient.add(self.egg)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.omelette.delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.pancakes.ingredient.remove(self.milk)
+            results = self.pantry(self.egg)
+            build.assert_not_called()
+        # ties go to the newest recipe
+        self.assertEqual(results,[('bread',0.5,[self.flour.id]),('pancakes',0.5,[self.flour.id])])
+
+        self.flour.delete()
+        self.assertEqual(self.pantry(self.egg),[('bread',1.0,[]),('pancakes',1.0,[])])
+
+    def test_pantry_rebuilt_after_foreign_change(self):
+        """ test a version bump the index did not see makes it rebuild"""
+        self.assertEqual(self.pantry(self.milk),[('pancakes',0.3333,[self.egg.id,self.flour.id])])
+        Recipe.ingredient.through.objects.filter(recipe=self.pancakes,ingredient=self.milk).delete()
+        bump_version(self.user.pk)
+        self.assertEqual(self.pantry(self.milk),[])
+
+    def test_pantry_ignores_rolled_back_write(self):
+        """ test links of a write that rolled back never reach the index"""
+        self.pantry(self.egg)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.bread.ingredient.add(self.egg)
+        Recipe.ingredient.through.objects.filter(recipe=self.bread,ingredient=self.egg).delete()
+        # the callbacks of a rolled back transaction are dropped
+        self.assertTrue(callbacks)
+        self.assertEqual([title for title,_,_ in self.pantry(self.egg)],['omelette','pancakes'])
+
+    def test_pantry_requires_ids(self):
+        """ test the ingredient ids must be integers"""
+        res = self.client.get(RECIPE_PANTRY_URL,{'ingredient':'egg'})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeStatsApiTests(TestCase):
+    """ test the statistics served from the rollup table """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email="stats@test.com",password="testpass")
+        self.client.force_authenticate(self.user)
+        self.curry = sample_tag(user=self.user,name='curry')
+        self.quick = sample_tag(user=self.user,name='quick')
+        self.rice = sample_ingredient(user=self.user,name='rice')
+
+    def stats(self,**params):
+        res = self.client.get(RECIPE_STATS_URL,params)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return res.data
+
+    def assertMatchesRebuild(self):
+        """ the incrementally maintained counters equal a rebuild from scratch """
+        data = self.stats()
+        stats.rebuild(self.user.pk)
+        self.assertEqual(self.stats(),data)
+        return data
+
+    def test_stats_of_new_user_are_empty(self):
+        """ test a user without recipes gets zero counts"""
+        data = self.stats()
+        self.assertEqual(data['recipe_count'],0)
+        self.assertIsNone(data['price']['average'])
+        self.assertEqual(data['price']['histogram'],[])
+        self.assertEqual(data['top_tags'],[])
+
+    def test_stats_follow_saves_and_relations(self):
+        """ test counts, averages, histograms and top lists follow every change"""
+        first = sample_recipe(user=self.user,price=4.20,time_minutes=10)
+        first.tag.add(self.curry,self.quick)
+        first.ingredient.add(self.rice)
+        second = sample_recipe(user=self.user,price=9.00,time_minutes=30)
+        second.tag.add(self.curry)
+        sample_recipe(user=self.user,price=9.10,time_minutes=30)
+
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['recipe_count'],3)
+        self.assertEqual(data['price']['average'],7.43)
+        self.assertEqual(data['price']['histogram'],[
+            {'from':'4.00','to':'4.50','count':1},{'from':'9.00','to':'9.50','count':2},
+        ])
+        self.assertEqual(data['time_minutes']['histogram'],[{'minutes':10,'count':1},{'minutes':30,'count':2}])
+        self.assertEqual(data['time_minutes']['p50'],30.25)
+        self.assertEqual(
+            [(tag['name'],tag['recipe_count']) for tag in data['top_tags']],[('curry',2),('quick',1)]
+        )
+        self.assertEqual(self.stats(top=1)['top_tags'],[{'id':self.curry.id,'name':'curry','recipe_count':2}])
+
+        second.price = 2.00
+        second.save()
+        first.tag.remove(self.curry)
+        self.curry.recipe_set.clear()
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['price']['average'],5.1)
+        self.assertEqual([tag['name'] for tag in data['top_tags']],['quick'])
+
+    def test_failed_stats_roll_back_the_write(self):
+        """ test a recipe saved through the api is not kept when its counters cannot be updated"""
+        recipe = sample_recipe(user=self.user,price=4.20,time_minutes=10)
+        with patch('core.stats.apply',side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.patch(detail_url(recipe.id),{'price':'9.00'})
+            with self.assertRaises(DatabaseError):
+                self.client.post(RECIPE_URL,{'title':'Stew','time_minutes':60,'price':'8.00'})
+        recipe.refresh_from_db()
+        self.assertEqual(str(recipe.price),'4.20')
+        self.assertFalse(Recipe.objects.filter(title='Stew').exists())
+        self.assertMatchesRebuild()
+
+    def test_stats_ignore_removing_unlinked(self):
+        """ test removing a tag a recipe does not have leaves its counter alone"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tag.add(self.curry)
+        other = sample_recipe(user=self.user)
+        other.tag.remove(self.curry)
+        self.curry.recipe_set.remove(other)
+
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['top_tags'],[{'id':self.curry.id,'name':'curry','recipe_count':1}])
+
+    def test_stats_follow_deletes(self):
+        """ test deleting recipes and tags takes their counters back"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tag.add(self.curry)
+        recipe.ingredient.add(self.rice)
+        other = sample_recipe(user=self.user)
+        other.tag.add(self.quick)
+        recipe.delete()
+        self.quick.delete()
+
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['recipe_count'],1)
+        self.assertEqual(data['top_tags'],[])
+        self.assertEqual(data['top_ingredients'],[])
+
+    def test_stats_follow_bulk_writes(self):
+        """ test bulk creates and bulk updates keep the counters right"""
+        payload = [
+            {'title':'curry','time_minutes':30,'price':'5.00','tag':[self.curry.id],'ingredient':[self.rice.id]},
+            {'title':'toast','time_minutes':5,'price':'1.00','tag':[self.curry.id]},
+        ]
+        res = self.client.post(RECIPE_BULK_URL,payload,format='json')
+        self.assertEqual(res.status_code,status.HTTP_201_CREATED)
+        toast = Recipe.objects.get(user=self.user,title='toast')
+        # the counters move by the difference, the user's recipes are not recounted
+        with patch('core.stats.rebuild') as rebuild:
+            res = self.client.patch(RECIPE_BULK_URL,[{'id':toast.id,'price':'3.00','tag':[]}],format='json')
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        rebuild.assert_not_called()
+
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['recipe_count'],2)
+        self.assertEqual(data['price']['average'],4.0)
+        self.assertEqual(data['top_tags'],[{'id':self.curry.id,'name':'curry','recipe_count':1}])
+
+        curry = Recipe.objects.get(user=self.user,title='curry')
+        payload = [{'id':curry.id,'tag':[self.quick.id],'time_minutes':20},{'id':toast.id,'tag':[self.quick.id]}]
+        res = self.client.patch(RECIPE_BULK_URL,payload,format='json')
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        data = self.assertMatchesRebuild()
+        self.assertEqual(data['top_tags'],[{'id':self.quick.id,'name':'quick','recipe_count':2}])
+
+    def test_stats_are_per_user(self):
+        """ test other users' recipes are not counted"""
+        other = get_user_model().objects.create_user(email="other@test.com",password="testpass")
+        sample_recipe(user=other)
+        self.assertEqual(self.stats()['recipe_count'],0)
+
+    def test_stats_rejects_bad_top(self):
+        res = self.client.get(RECIPE_STATS_URL,{'top':0})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar',args=[recipe_id])
+
+
+class RecipeSimilarApiTests(TestCase):
+    """ test similar recipes from the persisted tag/ingredient matrix """
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(RECIPE_SIMILARITY_ROOT=self.root.name)
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email="similar@test.com",password="testpass")
+        self.client.force_authenticate(self.user)
+        response_cache().clear()
+        self.egg = sample_ingredient(user=self.user,name='egg')
+        self.flour = sample_ingredient(user=self.user,name='flour')
+        self.milk = sample_ingredient(user=self.user,name='milk')
+        self.sweet = sample_tag(user=self.user,name='sweet')
+        self.pancakes = self.recipe('pancakes',[self.egg,self.flour,self.milk],[self.sweet])
+        self.crepes = self.recipe('crepes',[self.egg,self.flour,self.milk],[])
+        self.omelette = self.recipe('omelette',[self.egg],[])
+        self.salad = self.recipe('salad',[],[])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.root.cleanup()
+
+    def recipe(self,title,ingredients,tags):
+        recipe = sample_recipe(user=self.user,title=title)
+        recipe.ingredient.add(*ingredients)
+        recipe.tag.add(*tags)
+        return recipe
+
+    def similar(self,recipe,**params):
+        res = self.client.get(similar_url(recipe.id),params)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return [(item['recipe']['title'],item['score']) for item in res.data['results']]
+
+    def test_similar_by_jaccard_and_cosine(self):
+        """ test recipes sharing more features rank higher under both metrics"""
+        self.assertEqual(self.similar(self.pancakes),[('crepes',0.75),('omelette',0.25)])
+        self.assertEqual(self.similar(self.pancakes,metric='cosine'),[('crepes',0.866),('omelette',0.5)])
+        self.assertEqual(self.similar(self.pancakes,limit=1),[('crepes',0.75)])
+        self.assertEqual(self.similar(self.salad),[])
+
+    def test_matrix_is_persisted_memory_mapped(self):
+        """ test a new process opens the saved arrays instead of querying"""
+        self.similar(self.pancakes)
+        similarity._matrices.clear()
+        with patch('recipe.similarity.SimilarityMatrix.refresh') as refresh:
+            self.assertEqual(self.similar(self.crepes),[('pancakes',0.75),('omelette',0.3333)])
+            refresh.assert_not_called()
+        matrix = similarity._matrices.get(self.user.pk)
+        self.assertIsInstance(matrix.recipe_ids,numpy.memmap)
+        self.assertFalse(matrix.matrix.indices.flags.owndata)
+
+    def test_concurrent_saves_keep_one_matrix(self):
+        """ test saves of the same user do not remove each other's directories"""
+        matrix = similarity.SimilarityMatrix.refresh(self.user.pk,1)
+        errors = []
+
+        def save():
+            try:
+                for _ in range(10):
+                    matrix.save(self.user.pk)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=save) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors,[])
+        directory = os.path.join(self.root.name,str(self.user.pk))
+        self.assertEqual(len([entry for entry in os.listdir(directory) if entry.startswith('v')]),1)
+        self.assertEqual(similarity.SimilarityMatrix.open(self.user.pk).version,1)
+
+    def test_older_version_not_published(self):
+        """ test a slow save of an older version does not replace a newer one"""
+        similarity.SimilarityMatrix.refresh(self.user.pk,5).save(self.user.pk)
+        similarity.SimilarityMatrix.refresh(self.user.pk,4).save(self.user.pk)
+        self.assertEqual(similarity.SimilarityMatrix.open(self.user.pk).version,5)
+
+    def test_refresh_reads_only_changed_recipes(self):
+        """ test a change re-reads the links of the recipes updated since the last build"""
+        self.similar(self.pancakes)
+        Recipe.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(days=1))
+        matrix = similarity._matrices.get(self.user.pk)
+        matrix.built_at = timezone.now() - timedelta(hours=1)
+
+        self.salad.ingredient.add(self.egg,self.flour)
+        with patch('recipe.similarity._links',wraps=similarity._links) as links:
+            self.assertEqual(self.similar(self.salad),[
+                ('crepes',0.6667),('omelette',0.5),('pancakes',0.5)
+            ])
+        links.assert_called_once()
+        self.assertIsNotNone(links.call_args[0][1])
+
+        self.crepes.delete()
+        self.assertEqual(self.similar(self.salad),[('omelette',0.5),('pancakes',0.5)])
+
+    def test_similar_of_other_user_recipe(self):
+        """ test recipes of other users are not found"""
+        other = get_user_model().objects.create_user(email="other@test.com",password="testpass")
+        self.client.force_authenticate(other)
+        res = self.client.get(similar_url(self.pancakes.id))
+        self.assertEqual(res.status_code,status.HTTP_404_NOT_FOUND)
+
+    def test_similar_unknown_metric(self):
+        """ test only jaccard and cosine are accepted"""
+        res = self.client.get(similar_url(self.pancakes.id),{'metric':'euclid'})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RECIPE_IMAGE_WORKERS={'BACKEND':'sync'})
+class RecipeImageVariantTests(TestCase):
+    """ test resized variants of uploaded images """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(email="variants@test.com",password="testpass")
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(user=self.user)
+
+    def tearDown(self):
+        self.recipe.refresh_from_db()
+        for formats in self.recipe.image_variants.values():
+            for name in formats.values():
+                default_storage.delete(name)
+        self.recipe.image.delete()
+
+    def upload(self,img,**save_options):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img.save(ntf,format='JPEG',**save_options)
+            ntf.seek(0)
+            return self.client.patch(image_upload_url(self.recipe.id),{'image':ntf},format='multipart')
+
+    def test_upload_renders_variants(self):
+        """ test every size is rendered as webp and jpeg within its bounds """
+        res = self.upload(Image.new('RGB',(2000,1000)))
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status,Recipe.ImageStatus.READY)
+        self.assertEqual(set(self.recipe.image_variants),{'large','medium','thumbnail'})
+        with Image.open(default_storage.path(self.recipe.image_variants['thumbnail']['webp'])) as thumb:
+            self.assertEqual(thumb.format,'WEBP')
+            self.assertEqual(thumb.size,(240,120))
+        self.assertTrue(res.data['image_variants']['medium']['jpeg'].startswith('http'))
+
+    def test_detail_shows_image_progress(self):
+        """ test the recipe detail carries the image status and variants, and a status change its etag"""
+        self.upload(Image.new('RGB',(100,100)))
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(res.data['image_status'],Recipe.ImageStatus.READY)
+        self.assertTrue(res.data['image_variants']['thumbnail']['webp'].startswith('http'))
+
+        self.recipe.refresh_from_db()
+        with patch('recipe.tasks.render_variants',side_effect=OSError):
+            process_image(self.recipe.id,self.recipe.image.name)
+        res = self.client.get(detail_url(self.recipe.id),HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(res.data['image_status'],Recipe.ImageStatus.FAILED)
+
+    def test_variants_have_no_metadata(self):
+        """ test exif data of the upload is not copied to the variants """
+        exif = Image.Exif()
+        exif[0x010f] = 'test camera'
+        self.upload(Image.new('RGB',(100,100)),exif=exif)
+
+        self.recipe.refresh_from_db()
+        with Image.open(default_storage.path(self.recipe.image_variants['medium']['jpeg'])) as variant:
+            self.assertNotIn('exif',variant.info)
+
+    def test_failed_processing_sets_status(self):
+        """ test a worker error leaves the recipe in failed state """
+        with patch('recipe.tasks.render_variants',side_effect=OSError):
+            self.upload(Image.new('RGB',(10,10)))
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status,Recipe.ImageStatus.FAILED)
+
+
 class RecipeImageUploadTests(TestCase):
     """ test cases for uploading image"""
 
@@ -234,6 +1086,74 @@ class RecipeImageUploadTests(TestCase):
         res = self.client.post(url,{'image':'notimage'},format='multipart')
         self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
 
+    def uploaded_files(self):
+        directory = default_storage.path('uploads/recipe')
+        return set(os.listdir(directory)) if os.path.isdir(directory) else set()
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=1000)
+    def test_upload_image_too_large(self):
+        """ test an image over the size limit is rejected while it streams and nothing is kept"""
+        before = self.uploaded_files()
+        upload = SimpleUploadedFile('big.jpg',b'\xff\xd8\xff\xe0' + b'0' * 5000)
+        res = self.client.post(image_upload_url(self.recipe.id),{'image':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertIn('1000 bytes',res.data['image'][0])
+        self.assertEqual(self.uploaded_files(),before)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(RECIPE_IMAGE_MAX_UPLOAD_SIZE=1000)
+    def test_upload_image_content_length_too_large(self):
+        """ test a body far over the limit is refused before it is read"""
+        upload = SimpleUploadedFile('big.jpg',b'\xff\xd8\xff\xe0' + b'0' * 100000)
+        res = self.client.post(image_upload_url(self.recipe.id),{'image':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_upload_image_wrong_header(self):
+        """ test a file that does not start like an image is rejected and removed"""
+        before = self.uploaded_files()
+        upload = SimpleUploadedFile('fake.jpg',b'this is not an image at all')
+        res = self.client.post(image_upload_url(self.recipe.id),{'image':upload},format='multipart')
+
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.uploaded_files(),before)
+
+    def test_upload_handler_hashes_content(self):
+        """ test the handler writes the chunks to the recipe image path and hashes them"""
+        content = b'\x89PNG\r\n\x1a\n' + b'x' * 300
+        handler = RecipeImageUploadHandler(self.recipe,max_size=1000)
+        handler.chunk_size = 100
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('image','photo.png','image/png',len(content))
+        for start in range(0,len(content),100):
+            handler.receive_data_chunk(content[start:start + 100],start)
+        stored = handler.file_complete(len(content))
+
+        self.assertEqual(stored.format,'PNG')
+        self.assertEqual(stored.size,len(content))
+        self.assertEqual(stored.sha256,hashlib.sha256(content).hexdigest())
+        self.assertTrue(stored.name.startswith('uploads/recipe/'))
+        with default_storage.open(stored.name) as f:
+            self.assertEqual(f.read(),content)
+        default_storage.delete(stored.name)
+
+    def test_same_image_stored_once(self):
+        """ test uploading the same bytes to two recipes shares one file"""
+        other = sample_recipe(user=self.user,title='other')
+        content = b'\x89PNG\r\n\x1a\n' + b'y' * 100
+        for recipe in (self.recipe,other):
+            upload = SimpleUploadedFile('photo.png',content)
+            res = self.client.post(image_upload_url(recipe.id),{'image':upload},format='multipart')
+            self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+
+        self.assertEqual(self.recipe.image.name,other.image.name)
+        self.assertIn(hashlib.sha256(content).hexdigest(),self.recipe.image.name)
+        self.assertEqual(Recipe.objects.image_references()[self.recipe.image.name],2)
+
     def test_filter_recipe_by_tags(self):
         """test returning recipe's with specific tags"""
         recipe1 = sample_recipe(user=self.user,title='chicken curry')
@@ -248,9 +1168,9 @@ class RecipeImageUploadTests(TestCase):
         s1 = RecipeSerializer(recipe1)
         s2 = RecipeSerializer(recipe2)
         s3 = RecipeSerializer(recipe3)
-        self.assertIn(s1.data,res.data)
-        self.assertIn(s2.data,res.data)
-        self.assertNotIn(s3.data,res.data)
+        self.assertIn(s1.data,res.data['results'])
+        self.assertIn(s2.data,res.data['results'])
+        self.assertNotIn(s3.data,res.data['results'])
 
     def test_filter_recipe_by_ingredients(self):
         """test returning recipe's with specific ingredients"""
@@ -268,6 +1188,49 @@ class RecipeImageUploadTests(TestCase):
         serializer2 = RecipeSerializer(recipe2)
         serializer3 = RecipeSerializer(recipe3)
 
-        self.assertIn(serializer1.data,res.data)
-        self.assertIn(serializer2.data,res.data)
-        self.assertNotIn(serializer3.data,res.data)
\ No newline at end of file
+        self.assertIn(serializer1.data,res.data['results'])
+        self.assertIn(serializer2.data,res.data['results'])
+        self.assertNotIn(serializer3.data,res.data['results'])
+
+    def test_filter_recipe_no_duplicates(self):
+        """test a recipe matching several ids is returned once"""
+        recipe = sample_recipe(user=self.user,title='chicken curry')
+        tag1 = sample_tag(user=self.user,name='chicken')
+        tag2 = sample_tag(user=self.user,name='curry')
+        recipe.tag.add(tag1,tag2)
+
+        res = self.client.get(RECIPE_URL,{'tag':f'{tag1.id},{tag2.id}'})
+
+        self.assertEqual(len(res.data['results']),1)
+
+    def test_filter_recipe_match_all(self):
+        """test match=all only returns recipes that have every ingredient"""
+        recipe1 = sample_recipe(user=self.user,title='chicken curry')
+        recipe2 = sample_recipe(user=self.user,title='chicken soup')
+        ing1 = sample_ingredient(user=self.user,name='chicken')
+        ing2 = sample_ingredient(user=self.user,name='curry powder')
+        recipe1.ingredient.add(ing1,ing2)
+        recipe2.ingredient.add(ing1)
+
+        res = self.client.get(RECIPE_URL,{'ingredient':f'{ing1.id},{ing2.id}','match':'all'})
+
+        self.assertEqual(res.data['results'],[RecipeSerializer(recipe1).data])
+
+    def test_filter_recipe_match_all_tags_and_ingredients(self):
+        """test match=all applies to tags and ingredients together"""
+        recipe1 = sample_recipe(user=self.user,title='chicken curry')
+        recipe2 = sample_recipe(user=self.user,title='chicken salad')
+        tag = sample_tag(user=self.user,name='dinner')
+        ing = sample_ingredient(user=self.user,name='chicken')
+        recipe1.tag.add(tag)
+        recipe1.ingredient.add(ing)
+        recipe2.ingredient.add(ing)
+
+        res = self.client.get(RECIPE_URL,{'tag':f'{tag.id}','ingredient':f'{ing.id}','match':'all'})
+
+        self.assertEqual([item['id'] for item in res.data['results']],[recipe1.id])
+
+    def test_filter_recipe_invalid_match(self):
+        """test an unknown match value is rejected"""
+        res = self.client.get(RECIPE_URL,{'tag':'1','match':'some'})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
@@ -6,11 +6,14 @@ from rest_framework import status
 import json
 
 
+from recipe.cache import get_version, response_cache
 from recipe.serializers import TagSerializer
 from core.models import Tag,Recipe
 
 
 TAG_URL = reverse('recipe:tag-list')
+TAG_BULK_URL = reverse('recipe:tag-bulk')
+TAG_AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
 
 
 class PublicTagsApiTests(TestCase):
@@ -33,6 +36,8 @@ class PrivateTagsApiTests(TestCase):
         self.user = get_user_model().objects.create(email='testing@test.com',password='pass1234')
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        # test databases can hand out the same user id again, drop lists cached by earlier tests
+        response_cache().clear()
 
     def test_retrieve_tags(self):
         """ Test to check tag list is returned """
@@ -43,7 +48,7 @@ class PrivateTagsApiTests(TestCase):
         serializer = TagSerializer(tags, many=True)
         res = self.client.get(TAG_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_authenticated_user_tagslist(self):
         """ test tags returned are for authenticated user"""
@@ -57,8 +62,22 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAG_URL)
         self.assertEqual(res.status_code,status.HTTP_200_OK)
-        self.assertEqual(len(res.data),1)
-        self.assertEqual(res.data[0]['name'],tag.name)
+        self.assertEqual(len(res.data['results']),1)
+        self.assertEqual(res.data['results'][0]['name'],tag.name)
+
+    def test_tags_paginated_by_name(self):
+        """ test tags with the same name are split across pages without repeats """
+        for name in ['vegan','vegan','dessert','dessert','lunch']:
+            Tag.objects.create(user=self.user,name=name)
+
+        res = self.client.get(TAG_URL,{'page_size':2})
+        ids = [item['id'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids += [item['id'] for item in res.data['results']]
+
+        expected = Tag.objects.filter(user=self.user).order_by('-name','-id')
+        self.assertEqual(ids,[tag.id for tag in expected])
 
     def test_create_tag_successful(self):
         """ Test creating a new tag"""
@@ -86,8 +105,8 @@ class PrivateTagsApiTests(TestCase):
         s1 = TagSerializer(tag1)
         s2 = TagSerializer(tag2)
 
-        self.assertIn(s1.data,res.data)
-        self.assertNotIn(s2.data,res.data)
+        self.assertIn(s1.data,res.data['results'])
+        self.assertNotIn(s2.data,res.data['results'])
 
     def test_retrieve_tag_assigned_unique(self):
         """ test that filtering tags by assigned returns unique tags, django by default will return 2 copy of tags
@@ -111,4 +130,112 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAG_URL,{'assigned_only':1})
 
-        self.assertEqual(len(res.data),1)
+        self.assertEqual(len(res.data['results']),1)
+
+    def test_retrieve_tags_with_recipe_count(self):
+        """ test with_count adds the number of recipes using each tag """
+        tag1 = Tag.objects.create(user=self.user,name='breakfast')
+        tag2 = Tag.objects.create(user=self.user,name='lunch')
+        recipe1 = Recipe.objects.create(user=self.user,title='toast',time_minutes=5,price=5.00)
+        recipe2 = Recipe.objects.create(user=self.user,title='poha',time_minutes=15,price=25.00)
+        recipe1.tag.add(tag1)
+        recipe2.tag.add(tag1)
+
+        res = self.client.get(TAG_URL,{'with_count':1})
+
+        counts = {item['id']: item['recipe_count'] for item in res.data['results']}
+        self.assertEqual(counts,{tag1.id: 2,tag2.id: 0})
+
+    def test_retrieve_tags_without_recipe_count(self):
+        """ test recipe_count is left out unless asked for """
+        Tag.objects.create(user=self.user,name='breakfast')
+        res = self.client.get(TAG_URL)
+        self.assertNotIn('recipe_count',res.data['results'][0])
+
+    def test_bulk_create_tags(self):
+        """ test creating several tags at once, invalid ones are reported """
+        payload = [{'name':'vegan'},{'name':''},{'name':'dessert'}]
+        res = self.client.post(TAG_BULK_URL,payload,format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([item['name'] for item in res.data['results']],['vegan','dessert'])
+        self.assertEqual(res.data['errors'][0]['index'],1)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(),2)
+
+    def test_bulk_delete_tags(self):
+        """ test deleting several tags at once """
+        tag1 = Tag.objects.create(user=self.user,name='vegan')
+        tag2 = Tag.objects.create(user=self.user,name='dessert')
+
+        res = self.client.delete(TAG_BULK_URL,[tag1.id,tag2.id],format='json')
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertFalse(Tag.objects.filter(user=self.user).exists())
+
+    def test_list_served_from_cache(self):
+        """ test a repeated list call does not query tags again """
+        Tag.objects.create(user=self.user,name='vegan')
+        self.client.get(TAG_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(TAG_URL)
+        self.assertEqual(res.data['results'][0]['name'],'vegan')
+
+    def test_list_not_modified(self):
+        """ test sending back the etag returns 304 without a body """
+        Tag.objects.create(user=self.user,name='vegan')
+        res = self.client.get(TAG_URL)
+        self.assertIn('Last-Modified',res)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(TAG_URL,HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code,status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_cache_invalidated_by_writes(self):
+        """ test creating a tag, linking it to a recipe and bulk creating change the etag """
+        res = self.client.get(TAG_URL,{'assigned_only':1})
+        etag = res['ETag']
+
+        tag = Tag.objects.get(id=self.client.post(TAG_URL,{'name':'vegan'}).data['id'])
+        res = self.client.get(TAG_URL,{'assigned_only':1},HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual(res.data['results'],[])
+
+        recipe = Recipe.objects.create(user=self.user,title='toast',time_minutes=5,price=5.00)
+        recipe.tag.add(tag)
+        res = self.client.get(TAG_URL,{'assigned_only':1})
+        self.assertEqual(len(res.data['results']),1)
+
+        self.client.post(TAG_BULK_URL,[{'name':'dessert'}],format='json')
+        res = self.client.get(TAG_URL)
+        self.assertEqual(len(res.data['results']),2)
+
+    def test_version_bumped_again_on_commit(self):
+        """ test a list read before the write commits is not kept under the final version """
+        version, _ = get_version(self.user.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(user=self.user,name='vegan')
+            during, _ = get_version(self.user.pk)
+        self.assertNotEqual(during,version)
+        for callback in callbacks:
+            callback()
+        self.assertNotIn(get_version(self.user.pk)[0],(version,during))
+
+    def test_list_cache_per_user(self):
+        """ test cached lists are not shared between users """
+        Tag.objects.create(user=self.user,name='vegan')
+        self.client.get(TAG_URL)
+        other = get_user_model().objects.create_user('other@test.com','pass1234')
+        self.client.force_authenticate(other)
+        res = self.client.get(TAG_URL)
+        self.assertEqual(res.data['results'],[])
+
+    def test_autocomplete_tags_of_user(self):
+        """ test autocomplete only offers the user's own tags"""
+        Tag.objects.create(user=self.user,name='vegan')
+        other = get_user_model().objects.create_user('other@test.com','pass1234')
+        Tag.objects.create(user=other,name='vegetarian')
+
+        res = self.client.get(TAG_AUTOCOMPLETE_URL,{'prefix':'veg'})
+
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        self.assertEqual([tag['name'] for tag in res.data['results']],['vegan'])
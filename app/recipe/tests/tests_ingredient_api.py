@@ -6,9 +6,11 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Ingredient,Recipe
+from recipe.cache import response_cache
 from recipe.serializers import IngredientSerializer
 
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
+INGREDIENT_AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
 
 
 class PublicIngredientApiTests(TestCase):
@@ -27,6 +29,8 @@ class PrivateIngredientsApiTests(TestCase):
         self.client = APIClient()
         self.user = get_user_model().objects.create_user('testing@test.com','pass1234')
         self.client.force_authenticate(self.user)
+        # test databases can hand out the same user id again, drop lists cached by earlier tests
+        response_cache().clear()
 
     def test_retrieve_ingredients_list(self):
         """ test retrieve list of ingredients"""
@@ -37,8 +41,8 @@ class PrivateIngredientsApiTests(TestCase):
         serializer = IngredientSerializer(ingredient,many=True)
 
         self.assertEqual(res.status_code,status.HTTP_200_OK)
-        self.assertEqual(len(res.data),2)
-        self.assertEqual(res.data,serializer.data)
+        self.assertEqual(len(res.data['results']),2)
+        self.assertEqual(res.data['results'],serializer.data)
 
     def test_authenticated_user_ingredients(self):
         """ test that ingredients returned are only limited to user """
@@ -48,8 +52,8 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         self.assertEqual(res.status_code,status.HTTP_200_OK)
-        self.assertEqual(len(res.data),1)
-        self.assertEqual(res.data[0]['name'],ing.name)
+        self.assertEqual(len(res.data['results']),1)
+        self.assertEqual(res.data['results'][0]['name'],ing.name)
 
     def test_create_ingredient_successful(self):
         """ Test create a new ingredients"""
@@ -75,8 +79,8 @@ class PrivateIngredientsApiTests(TestCase):
         s1 = IngredientSerializer(ing1)
         s2 = IngredientSerializer(ing2)
 
-        self.assertIn(s2.data,res.data)
-        self.assertNotIn(s1.data,res.data)
+        self.assertIn(s2.data,res.data['results'])
+        self.assertNotIn(s1.data,res.data['results'])
 
 
     def test_retrieve_ingredient_assigned_unique(self):
@@ -91,4 +95,55 @@ class PrivateIngredientsApiTests(TestCase):
 
         res = self.client.get(INGREDIENTS_URL,{'assigned_only':1})
 
-        self.assertEqual(len(res.data),1)
\ No newline at end of file
+        self.assertEqual(len(res.data['results']),1)
+
+    def test_retrieve_assigned_ingredients_with_recipe_count(self):
+        """ test assigned_only and with_count can be combined """
+        ing1 = Ingredient.objects.create(user=self.user,name='onion')
+        Ingredient.objects.create(user=self.user,name='milk')
+        recipe = Recipe.objects.create(title='onion curry',time_minutes=10,price=3.00,user=self.user)
+        recipe.ingredient.add(ing1)
+
+        res = self.client.get(INGREDIENTS_URL,{'assigned_only':1,'with_count':1})
+
+        self.assertEqual(res.data['results'],[{'id': ing1.id,'name': 'onion','recipe_count': 1}])
+
+    def sample_usage(self,names_and_counts):
+        """ create ingredients used by the given number of recipes """
+        for name,count in names_and_counts:
+            ingredient = Ingredient.objects.create(user=self.user,name=name)
+            for i in range(count):
+                recipe = Recipe.objects.create(title=f'{name} {i}',time_minutes=5,price=1.00,user=self.user)
+                recipe.ingredient.add(ingredient)
+
+    def autocomplete(self,**params):
+        res = self.client.get(INGREDIENT_AUTOCOMPLETE_URL,params)
+        self.assertEqual(res.status_code,status.HTTP_200_OK)
+        return [(item['name'],item['recipe_count']) for item in res.data['results']]
+
+    def test_autocomplete_prefix_ranked_by_usage(self):
+        """ test prefix matches ignore case and the most used come first"""
+        self.sample_usage([('Tomato',1),('tofu',3),('Toast',0),('potato',5)])
+
+        self.assertEqual(self.autocomplete(prefix='to'),[('tofu',3),('Tomato',1),('Toast',0)])
+        self.assertEqual(self.autocomplete(prefix='TO',limit=1),[('tofu',3)])
+        self.assertEqual(self.autocomplete(prefix='x'),[])
+
+    def test_autocomplete_fuzzy(self):
+        """ test misspelled names still find close matches"""
+        self.sample_usage([('tomato',1),('potato',2),('milk',0)])
+        self.assertEqual(self.autocomplete(fuzzy='tomatoe')[0],('tomato',1))
+        self.assertNotIn('milk',[name for name,_ in self.autocomplete(fuzzy='tomatoe')])
+
+    def test_autocomplete_sees_new_ingredients(self):
+        """ test the cached names are rebuilt after a change"""
+        self.sample_usage([('garlic',0)])
+        self.assertEqual(self.autocomplete(prefix='gar'),[('garlic',0)])
+        self.client.post(INGREDIENTS_URL,{'name':'garam masala'})
+        self.assertEqual(self.autocomplete(prefix='gar'),[('garam masala',0),('garlic',0)])
+
+    def test_autocomplete_requires_one_term(self):
+        """ test prefix and fuzzy cannot be both given or both missing"""
+        self.assertEqual(self.client.get(INGREDIENT_AUTOCOMPLETE_URL).status_code,status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(INGREDIENT_AUTOCOMPLETE_URL,{'prefix':'a','fuzzy':'b'})
+        self.assertEqual(res.status_code,status.HTTP_400_BAD_REQUEST)
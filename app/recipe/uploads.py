@@ -0,0 +1,122 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers, StopUpload
+
+from core.models import Recipe, recipe_image_file_path
+
+
+DEFAULT_MAX_UPLOAD_SIZE = 20 * 2 ** 20
+# bytes allowed on top of the image for the multipart boundaries and headers
+MULTIPART_OVERHEAD = 64 * 2 ** 10
+HEADER_SIZE = 12
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def max_upload_size():
+    return getattr(settings, 'RECIPE_IMAGE_MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+
+def sniff_format(header):
+    """ return the image format named by the magic bytes at the start of a file, or None """
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class StoredImage:
+    """ an upload already written to its final storage name """
+
+    def __init__(self, name, size, sha256, image_format):
+        self.name = name
+        self.size = size
+        self.sha256 = sha256
+        self.format = image_format
+
+
+class RecipeImageUploadHandler(FileUploadHandler):
+    """
+    write the image field of a multipart body straight to media, chunk by chunk,
+    so a request holds one chunk in memory whatever the file size. the size
+    limit, the format check and the sha256 all happen as bytes arrive, and the
+    finished file is moved to its content addressed name
+    """
+    field_name = 'image'
+
+    def __init__(self, recipe, max_size=None, request=None):
+        super().__init__(request)
+        self.recipe = recipe
+        self.max_size = max_upload_size() if max_size is None else max_size
+        self.errors = []
+        self.stored = None
+        self.path = None
+        self.storage = Recipe._meta.get_field('image').storage
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name != self.field_name or self.stored is not None or self.path is not None:
+            raise SkipFile()
+        self.name = recipe_image_file_path(self.recipe, file_name)
+        self.path = self.storage.path(self.name)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'xb')
+        self.size = 0
+        self.header = b''
+        self.image_format = None
+        self.sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_size:
+            self.reject(f'Ensure the image is at most {self.max_size} bytes.')
+        if self.image_format is None:
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE:
+                self.check_header()
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.path is None or self.stored is not None:
+            return None
+        if self.image_format is None:
+            self.check_header()
+        self.file.close()
+        sha256 = self.sha256.hexdigest()
+        name = self.storage.adopt(self.name, sha256, FORMAT_EXTENSIONS[self.image_format])
+        self.stored = StoredImage(name, self.size, sha256, self.image_format)
+        return self.stored
+
+    def upload_interrupted(self):
+        if self.stored is None:
+            self.discard()
+
+    def check_header(self):
+        self.image_format = sniff_format(self.header)
+        if self.image_format is None:
+            self.reject('Upload a valid image. The file you uploaded was either not an image or a corrupted image.')
+
+    def reject(self, message):
+        """ drop what was written so far and stop reading the request body """
+        self.errors.append(message)
+        self.discard()
+        raise StopUpload(connection_reset=True)
+
+    def discard(self):
+        if self.path is None:
+            return
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.path = None
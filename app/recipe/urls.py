@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path,include
 from rest_framework.routers import DefaultRouter
+from .async_views import async_view
 from .views import TagViewSet,IngredientViewSet,RecipeViewSet
 router = DefaultRouter()
 
@@ -9,6 +11,20 @@ router.register('recipes',RecipeViewSet)
 
 app_name = 'recipe'
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.RECIPE_ASYNC_VIEWS:
+    # coroutine views for the read endpoints, matched before the router's. the
+    # detail takes integer ids only, so list actions like recipes/search/ reach the router
+    urlpatterns += [
+        path('tag/',async_view(TagViewSet,{'get':'list','post':'create'}),name='tag-list'),
+        path('ingredient/',async_view(IngredientViewSet,{'get':'list','post':'create'}),name='ingredient-list'),
+        path('recipes/',async_view(RecipeViewSet,{'get':'list','post':'create'}),name='recipe-list'),
+        path('recipes/<int:pk>/',async_view(RecipeViewSet,{
+            'get':'retrieve','put':'update','patch':'partial_update','delete':'destroy'
+        }),name='recipe-detail'),
+    ]
+
+urlpatterns += [
     path('',include(router.urls)),
-]
\ No newline at end of file
+]
@@ -0,0 +1,45 @@
+"""
+image resizing used by recipe.tasks, kept free of Django imports so it can
+run in a worker process that never sets Django up
+"""
+import os
+
+from PIL import Image, ImageOps
+
+
+# variant name -> longest side in pixels, largest first
+VARIANT_SIZES = (
+    ('large', 1600),
+    ('medium', 800),
+    ('thumbnail', 240),
+)
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def render_variants(source_path, media_root, prefix, sizes=VARIANT_SIZES):
+    """
+    decode source_path once and write every size and format under media_root
+    as '<prefix>-<size>.<ext>', return {size: {format: relative name}}
+
+    the variants are encoded from fresh pixel data, so EXIF, GPS and other
+    metadata of the upload is not copied over
+    """
+    variants = {}
+    with Image.open(source_path) as image:
+        # let the JPEG decoder scale down while decoding instead of afterwards
+        image.draft('RGB', (sizes[0][1], sizes[0][1]))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        os.makedirs(os.path.join(media_root, os.path.dirname(prefix)), exist_ok=True)
+        for size_name, size in sizes:
+            # each size is scaled from the previous one, never from the original again
+            image.thumbnail((size, size), Image.LANCZOS)
+            variants[size_name] = {}
+            for extension, pil_format, options in VARIANT_FORMATS:
+                name = f'{prefix}-{size_name}.{extension}'
+                image.save(os.path.join(media_root, name), pil_format, **options)
+                variants[size_name][extension] = name
+    return variants
@@ -1,37 +1,101 @@
 from rest_framework.decorators import action #is used to add custom actions to our viewsets
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 
 from rest_framework import viewsets,status
+from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.mixins import ListModelMixin, CreateModelMixin
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+from user.authentication import CachedTokenAuthentication
+import io
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .bulk import bulk_items, bulk_response, create_attrs, create_recipes, update_recipes, delete_objects
+from .autocomplete import AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT, autocomplete
+from .cache import VersionedListCacheMixin
+from .export import EXPORT_FIELDS, export_rows
+from .pagination import NameKeysetPagination, RecipeKeysetPagination
+from .pantry import PANTRY_LIMIT, PANTRY_MAX_LIMIT, match_pantry
+from .media import IgnoreClientContentNegotiation, media_path, serve_file, user_can_read
+from .renderers import NDJSONRenderer, CSVRenderer
+from .tasks import schedule_variants
+from .uploads import MULTIPART_OVERHEAD, RecipeImageUploadHandler, StoredImage
+from .similarity import METRICS, SIMILAR_LIMIT, SIMILAR_MAX_LIMIT, similar_recipes
 from .serializers import TagSerializer, IngredientSerializer, RecipeSerializer,RecipeDetailSerializer,RecipeImageSerializer
 # from core.models import Tag,Ingredient
 from core.models import Tag, Ingredient, Recipe
+from core.routers import ReplicaReadMixin
+from core.importer import READERS, RecipeImporter
+from core.search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, search_recipes
+from core.stats import TOP_LIMIT, TOP_MAX_LIMIT, user_stats
 
 
 # Create your views here.
 
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet, ListModelMixin, CreateModelMixin):
+def _int_param(request,name,default,maximum):
+    """ the integer query parameter name, between 1 and maximum, default when it is missing"""
+    try:
+        value = int(request.query_params.get(name,default))
+    except ValueError:
+        raise ValidationError({name: ['A valid integer is required.']})
+    if not 0 < value <= maximum:
+        raise ValidationError({name: [f'must be between 1 and {maximum}']})
+    return value
+
+
+class BaseRecipeAttrViewSet(
+    ReplicaReadMixin, VersionedListCacheMixin, viewsets.GenericViewSet, ListModelMixin, CreateModelMixin
+):
     """ Base viewset for Tag and ingrediens viewset"""
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
+    pagination_class = NameKeysetPagination
 
     def get_queryset(self):
         """ return queryset for current user only"""
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         assigned_only = bool(
             int( self.request.query_params.get('assigned_only',0))
         )
+        with_count = bool(
+            int(self.request.query_params.get('with_count',0))
+        )
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+            queryset = queryset.assigned()
+        if with_count:
+            queryset = queryset.with_recipe_count()
+        return queryset.order_by('-name')
 
     def perform_create(self, serializer):
         """create a new object with user object """
         serializer.save(user=self.request.user)
 
+    @action(methods=['POST','DELETE'],detail=False,url_path='bulk')
+    def bulk(self,request):
+        """ create a list of objects, or delete a list of ids, in one transaction"""
+        items = bulk_items(request.data)
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                results,errors = delete_objects(self.get_queryset(),items)
+                return bulk_response(results,errors)
+            results,errors = create_attrs(self.get_serializer_class(),request.user,items)
+        return bulk_response(results,errors,status.HTTP_201_CREATED)
+
+    @action(methods=['GET'],detail=False)
+    def autocomplete(self,request):
+        """ names starting with ?prefix= or close to ?fuzzy=, most used first"""
+        prefix = request.query_params.get('prefix')
+        fuzzy = request.query_params.get('fuzzy')
+        if (prefix is None) == (fuzzy is None):
+            raise ValidationError({'non_field_errors': ['Give exactly one of prefix and fuzzy.']})
+        limit = _int_param(request,'limit',AUTOCOMPLETE_LIMIT,AUTOCOMPLETE_MAX_LIMIT)
+        results = autocomplete(self.queryset.model,request.user.pk,prefix=prefix,fuzzy=fuzzy,limit=limit)
+        return Response({'results': results})
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     """ Viewset to manage tags"""
@@ -47,12 +111,13 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
 
 # all CRUD operations
 # all functions like get_queryset(), perform_create() are default actions provided by django
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """ manage recipes in database """
     serializer_class = RecipeSerializer
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     queryset = Recipe.objects.all()
+    pagination_class = RecipeKeysetPagination
 
     def _params_to_int(self,qs):
         """convert string list to int list"""
@@ -62,15 +127,45 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """ return recipe for authenticated user"""
         tags = self.request.query_params.get('tag')
         ingredients = self.request.query_params.get('ingredient')
+        match = self.request.query_params.get('match','any')
+        if match not in ('any','all'):
+            raise ValidationError({'match': "must be either 'any' or 'all'"})
+        match_all = match == 'all'
         queryset = self.queryset
         if tags:
             tag_ids = self._params_to_int(tags)
-            queryset = queryset.filter(tag__id__in=tag_ids)
+            queryset = queryset.filter_related('tag',tag_ids,match_all)
         if ingredients:
             ingredient_ids = self._params_to_int(ingredients)
-            queryset = queryset.filter(ingredient__id__in=ingredient_ids)
+            queryset = queryset.filter_related('ingredient',ingredient_ids,match_all)
+
+        queryset = queryset.filter(user=self.request.user)
+        if self.action == 'retrieve':
+            return queryset.with_related()
+        if self.action in ('upload_image','export','similar'):
+            return queryset
+        return queryset.with_related_ids()
 
-        return queryset.filter(user=self.request.user)
+    def retrieve(self, request, *args, **kwargs):
+        """ answer conditional requests from updated_at before loading the recipe and its relations"""
+        try:
+            updated_at = Recipe.objects.filter(user=request.user,pk=kwargs['pk']).values_list(
+                'updated_at',flat=True
+            ).first()
+        except (TypeError,ValueError):
+            updated_at = None
+        response = None
+        if updated_at is not None:
+            etag = quote_etag(f'{kwargs["pk"]}-{updated_at.timestamp()}')
+            last_modified = int(updated_at.timestamp())
+            response = get_conditional_response(request,etag=etag,last_modified=last_modified)
+        if response is None:
+            response = super().retrieve(request,*args,**kwargs)
+        if updated_at is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = 'private, no-cache'
+        return response
 
     def get_serializer_class(self):
         """ return a serializer class for a particular action , default class is serializer_class"""
@@ -81,20 +176,166 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.serializer_class
 
     def perform_create(self, serializer):
-        """ create a new recipe object"""
-        serializer.save(user=self.request.user)
+        """ create a new recipe object, with its relations and stat counters in the same transaction"""
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        """ the recipe row, its relations and the stat counters the signals move commit together"""
+        with transaction.atomic():
+            serializer.save()
+
+    @action(methods=['GET'],detail=False)
+    def search(self,request):
+        """ full text search over title, tag and ingredient names, best match first"""
+        text = request.query_params.get('q','').strip()
+        if not text:
+            raise ValidationError({'q': ['This query parameter is required.']})
+        limit = _int_param(request,'limit',SEARCH_LIMIT,SEARCH_MAX_LIMIT)
+
+        ids = search_recipes(request.user,text,limit)
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([recipes[pk] for pk in ids if pk in recipes],many=True)
+        return Response({'results': serializer.data})
+
+    @action(methods=['GET'],detail=False)
+    def pantry(self,request):
+        """ rank recipes by the share of their ingredients found in ?ingredient=, with what is missing"""
+        try:
+            ingredient_ids = self._params_to_int(request.query_params.get('ingredient',''))
+        except ValueError:
+            raise ValidationError({'ingredient': ['Give a comma separated list of ingredient ids.']})
+        limit = _int_param(request,'limit',PANTRY_LIMIT,PANTRY_MAX_LIMIT)
+
+        matches = match_pantry(request.user.pk,ingredient_ids,limit)
+        recipes = Recipe.objects.filter(user=request.user).with_related_ids().in_bulk(
+            [recipe_id for recipe_id,_,_ in matches]
+        )
+        results = [
+            {
+                'recipe': RecipeSerializer(recipes[recipe_id]).data,
+                'coverage': round(coverage,4),
+                'missing': missing,
+            }
+            for recipe_id,coverage,missing in matches if recipe_id in recipes
+        ]
+        return Response({'results': results})
+
+    @action(methods=['GET'],detail=False)
+    def stats(self,request):
+        """ recipe count, price and time distributions and most used tags and ingredients, ?top= to size the lists"""
+        top = _int_param(request,'top',TOP_LIMIT,TOP_MAX_LIMIT)
+        return Response(user_stats(request.user.pk,top))
+
+    @action(methods=['GET'],detail=True)
+    def similar(self,request,pk=None):
+        """ recipes sharing the most tags and ingredients with this one, ?metric=jaccard or cosine"""
+        recipe = self.get_object()
+        metric = request.query_params.get('metric','jaccard')
+        if metric not in METRICS:
+            raise ValidationError({'metric': [f'must be one of {", ".join(METRICS)}']})
+        limit = _int_param(request,'limit',SIMILAR_LIMIT,SIMILAR_MAX_LIMIT)
+
+        matches = similar_recipes(request.user.pk,recipe.pk,metric,limit)
+        recipes = Recipe.objects.filter(user=request.user).with_related_ids().in_bulk(
+            [recipe_id for recipe_id,_ in matches]
+        )
+        results = [
+            {'recipe': RecipeSerializer(recipes[recipe_id]).data,'score': round(score,4)}
+            for recipe_id,score in matches if recipe_id in recipes
+        ]
+        return Response({'results': results})
+
+    @action(methods=['POST','PATCH','DELETE'],detail=False,url_path='bulk')
+    def bulk(self,request):
+        """ create, update or delete a list of recipes in one transaction"""
+        items = bulk_items(request.data)
+        with transaction.atomic():
+            if request.method == 'DELETE':
+                results,errors = delete_objects(Recipe.objects.filter(user=request.user),items)
+                return bulk_response(results,errors)
+            if request.method == 'PATCH':
+                results,errors = update_recipes(request.user,items)
+                return bulk_response(results,errors)
+            results,errors = create_recipes(request.user,items)
+        return bulk_response(results,errors,status.HTTP_201_CREATED)
+
+    @action(methods=['GET'],detail=False,renderer_classes=(NDJSONRenderer,CSVRenderer))
+    def export(self,request):
+        """ stream every recipe of the user as ndjson or csv, pick one with ?format="""
+        renderer = request.accepted_renderer
+        rows = export_rows(self.get_queryset())
+        if isinstance(renderer,CSVRenderer):
+            content = renderer.stream(rows,fields=EXPORT_FIELDS)
+        else:
+            content = renderer.stream(rows)
+        response = StreamingHttpResponse(content,content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="recipes.{renderer.format}"'
+        return response
+
+    @action(methods=['POST'],detail=False,url_path='import',parser_classes=(MultiPartParser,))
+    def import_recipes(self,request):
+        """ import recipes from an uploaded ndjson or csv file"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        file_format = request.data.get('file_format') or (
+            'csv' if upload.name.lower().endswith('.csv') else 'ndjson'
+        )
+        if file_format not in READERS:
+            raise ValidationError({'file_format': [f'must be one of {", ".join(sorted(READERS))}']})
+
+        importer = RecipeImporter(request.user)
+        importer.run(READERS[file_format](io.TextIOWrapper(upload.file,encoding='utf-8',newline='')))
+        if not importer.error_count:
+            response_status = status.HTTP_201_CREATED
+        elif importer.created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': importer.created,
+            'error_count': importer.error_count,
+            'errors': importer.errors,
+        },status=response_status)
 
     @action(methods=['POST','PATCH'],detail=True,url_path='upload-image')
     def upload_image(self,request,pk=None):
-        """ upload an image to recipe"""
+        """ stream an image to the recipe, the body is written to media as it arrives instead of being buffered"""
         recipe = self.get_object()
-        serializer = self.get_serializer(
-            recipe,data=request.data
-        )
-       # serializer = RecipeImageSerializer(recipe,data=request.data)
+        handler = RecipeImageUploadHandler(recipe,request=request)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > handler.max_size + MULTIPART_OVERHEAD:
+            return Response(
+                {'image': [f'Ensure the image is at most {handler.max_size} bytes.']},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        # must be in place before request.data parses the body
+        request.upload_handlers = [handler]
+        upload = request.FILES.get('image')
+        if not isinstance(upload,StoredImage):
+            errors = handler.errors or ['No file was submitted.']
+            return Response({'image': errors},status=status.HTTP_400_BAD_REQUEST)
 
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data,status=status.HTTP_200_OK)
+        recipe.image.name = upload.name
+        recipe.save(update_fields=['image','updated_at'])
+        schedule_variants(recipe)
+        serializer = self.get_serializer(recipe)
+        return Response(serializer.data,status=status.HTTP_200_OK)
+
+
+class MediaView(APIView):
+    """ serve the images of the recipes of the user, or hand them to the front proxy"""
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (CachedTokenAuthentication,)
+    content_negotiation_class = IgnoreClientContentNegotiation
 
-        return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    def get(self,request,name):
+        found = media_path(name) if user_can_read(request.user,name) else None
+        if found is None:
+            raise NotFound()
+        path,stat = found
+        return serve_file(request,name,path,stat)
@@ -0,0 +1,112 @@
+import copy
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+
+from core.cache import LRUCache
+
+
+DEFAULTS = {
+    # entries kept in each process, least recently used are dropped first
+    'LOCAL_MAX_SIZE': 10000,
+    # seconds a token is trusted by a process without asking the database,
+    # this bounds how long a token deleted from another process keeps working
+    'LOCAL_TTL': 30,
+    # alias from CACHES shared by every process, None to disable
+    'SHARED_CACHE_ALIAS': None,
+    'SHARED_TTL': 300,
+}
+# what the shared cache keeps of a user, never the password hash, the other
+# columns are loaded from the database if a view asks for them
+SHARED_USER_FIELDS = ('id', 'email', 'name', 'is_active', 'is_staff', 'is_superuser')
+
+
+def cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+class TokenCache:
+    """ token key -> token with its user, in a local LRU in front of an optional shared cache """
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            options = cache_settings()
+            self._local = LRUCache(options['LOCAL_MAX_SIZE'], options['LOCAL_TTL'])
+        return self._local
+
+    def shared(self):
+        alias = cache_settings()['SHARED_CACHE_ALIAS']
+        return caches[alias] if alias else None
+
+    def shared_key(self, key):
+        return f'auth-token:{key}'
+
+    def get(self, key):
+        token = self.local.get(key)
+        if token is None and self.shared() is not None:
+            data = self.shared().get(self.shared_key(key))
+            if data is not None:
+                token = self.load(data)
+                self.local.set(key, token)
+        return token
+
+    def set(self, key, token):
+        self.local.set(key, token)
+        if self.shared() is not None:
+            self.shared().set(self.shared_key(key), self.dump(token), cache_settings()['SHARED_TTL'])
+
+    def dump(self, token):
+        """ the plain values of a token and its user kept in the shared cache """
+        return {
+            'key': token.key,
+            'created': token.created,
+            'user': {field: getattr(token.user, field) for field in SHARED_USER_FIELDS},
+        }
+
+    def load(self, data):
+        from rest_framework.authtoken.models import Token
+        # the fields left out are deferred, so saving the user only writes the loaded ones
+        model = get_user_model()
+        # from_db takes the values in the order of the model's columns
+        fields = [field.attname for field in model._meta.concrete_fields if field.attname in data['user']]
+        user = model.from_db(DEFAULT_DB_ALIAS, fields, [data['user'][field] for field in fields])
+        token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id', 'created'], [data['key'], user.pk, data['created']])
+        token.user = user
+        return token
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared() is not None:
+            self.shared().delete(self.shared_key(key))
+
+    def clear(self):
+        """ drop the local entries and forget the settings they were built with """
+        self._local = None
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    token authentication that remembers token -> user, so a request with a
+    known token does not query the database before reaching the view
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        # hand every request its own copies so views can change them freely
+        token = copy.copy(token)
+        user = copy.copy(token.user)
+        token.user = user
+        return (user, token)
@@ -0,0 +1,179 @@
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, BasePasswordHasher, mask_hash, must_update_salt
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+DEFAULTS = {
+    # scrypt cost, memory used is 128 * N * R bytes, 16 MiB with these values
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+    # argon2 cost, memory in KiB
+    'ARGON2_TIME_COST': 2,
+    'ARGON2_MEMORY_COST': 64 * 1024,
+    'ARGON2_PARALLELISM': 2,
+    # hashes computed at the same time by a process, None for one per core
+    'MAX_WORKERS': None,
+    # hashes allowed to wait for a worker, more are refused with 503
+    'MAX_QUEUED': 32,
+    # seconds a hash waits for a queue slot before it is refused
+    'QUEUE_TIMEOUT': 2,
+}
+
+
+def hashing_settings():
+    return {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING', {})}
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins at once, try again shortly.'
+    default_code = 'hashing_busy'
+
+
+class HashingPool:
+    """
+    a few threads computing password hashes, hashlib.scrypt and argon2 release
+    the gil so they run in parallel while the request threads wait. requests
+    beyond the workers and the queue are refused instead of piling up
+    """
+
+    def __init__(self, max_workers, max_queued, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hashing')
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self.timeout = timeout
+
+    def run(self, function, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hashing_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            options = hashing_settings()
+            _pool = HashingPool(
+                options['MAX_WORKERS'] or os.cpu_count() or 1, options['MAX_QUEUED'], options['QUEUE_TIMEOUT']
+            )
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_hashing_pool(setting, **kwargs):
+    global _pool
+    if setting != 'PASSWORD_HASHING':
+        return
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    """
+    scrypt from hashlib, stored as scrypt$n$salt$r$p$hash like the hasher of
+    later django versions so the hashes survive an upgrade
+    """
+    algorithm = 'scrypt'
+
+    def params(self):
+        options = hashing_settings()
+        return options['SCRYPT_N'], options['SCRYPT_R'], options['SCRYPT_P']
+
+    def _derive(self, password, salt, n, r, p):
+        derived = hashlib.scrypt(
+            password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=64
+        )
+        return base64.b64encode(derived).decode('ascii')
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        default_n, default_r, default_p = self.params()
+        n, r, p = n or default_n, r or default_r, p or default_p
+        hash_ = hashing_pool().run(self._derive, password, salt, n, r, p)
+        return f'{self.algorithm}${n}${salt}${r}${p}${hash_}'
+
+    def decode(self, encoded):
+        algorithm, n, salt, r, p, hash_ = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'hash': hash_,
+            'salt': salt,
+            'work_factor': int(n),
+            'block_size': int(r),
+            'parallelism': int(p),
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(
+            password, decoded['salt'], decoded['work_factor'], decoded['block_size'], decoded['parallelism']
+        )
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): mask_hash(decoded['salt']),
+            _('hash'): mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        params = decoded['work_factor'], decoded['block_size'], decoded['parallelism']
+        return params != self.params() or must_update_salt(decoded['salt'], self.salt_entropy)
+
+    def harden_runtime(self, password, encoded):
+        # the cost is part of the hash, nothing to make up for
+        pass
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """ django's argon2 hasher with its costs read from PASSWORD_HASHING and run in the hashing pool """
+
+    @property
+    def time_cost(self):
+        return hashing_settings()['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return hashing_settings()['ARGON2_MEMORY_COST']
+
+    @property
+    def parallelism(self):
+        return hashing_settings()['ARGON2_PARALLELISM']
+
+    def encode(self, password, salt):
+        return hashing_pool().run(super().encode, password, salt)
+
+    def verify(self, password, encoded):
+        return hashing_pool().run(super().verify, password, encoded)
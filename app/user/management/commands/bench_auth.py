@@ -0,0 +1,46 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from user.authentication import CachedTokenAuthentication, token_cache
+
+
+class Command(BaseCommand):
+    """Django command comparing per request cost of token and cached token authentication"""
+    help = 'Benchmark TokenAuthentication against CachedTokenAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        # work on a throwaway user and roll everything back afterwards
+        with transaction.atomic():
+            user = get_user_model().objects.create_user('bench-auth@example.com', None)
+            token = Token.objects.create(user=user)
+            request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+            token_cache.clear()
+            for backend in (TokenAuthentication(), CachedTokenAuthentication()):
+                elapsed, queries = self.run(backend, request, count)
+                self.stdout.write(
+                    f'{type(backend).__name__:<28} {elapsed / count * 1e6:8.1f} us/request '
+                    f'{queries / count:6.3f} queries/request'
+                )
+            transaction.set_rollback(True)
+        token_cache.clear()
+
+    def run(self, backend, request, count):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(count):
+                backend.authenticate(Request(request))
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries)
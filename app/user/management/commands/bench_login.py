@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import get_hasher, get_hashers
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+PASSWORD = 'bench-login-password'
+
+
+class Command(BaseCommand):
+    """Django command measuring logins per second per core of each configured password hasher"""
+    help = 'Benchmark password verification of every hasher in PASSWORD_HASHERS and the login path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50)
+        parser.add_argument(
+            '--threads', type=int, default=4, help='concurrent logins when measuring throughput through the pool'
+        )
+
+    def handle(self, *args, **options):
+        count = options['logins']
+        for hasher in get_hashers():
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as error:
+                # optional library missing, e.g. argon2-cffi
+                self.stdout.write(f'{hasher.algorithm:<16} skipped: {error}')
+                continue
+            elapsed = self.run(lambda: hasher.verify(PASSWORD, encoded), count, threads=1)
+            self.report(hasher.algorithm, elapsed, count)
+
+        # the whole path of CreateTokenView, on a throwaway user rolled back afterwards
+        preferred = get_hasher()
+        with transaction.atomic():
+            user = get_user_model().objects.create_user('bench-login@example.com', PASSWORD)
+            elapsed = self.run(lambda: authenticate(email=user.email, password=PASSWORD), count, threads=1)
+            self.report(f'login ({preferred.algorithm})', elapsed, count)
+            encoded = user.password
+            transaction.set_rollback(True)
+
+        # request threads sharing the process, the hashing pool bounds how many hash at once
+        threads = options['threads']
+        elapsed = self.run(lambda: preferred.verify(PASSWORD, encoded), count, threads=threads)
+        self.stdout.write(f'{f"{threads} threads":<16} {count / elapsed:8.1f} logins/sec in this process')
+
+    def run(self, function, count, threads):
+        start = time.perf_counter()
+        if threads == 1:
+            for _ in range(count):
+                function()
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(lambda _: function(), range(count)))
+        return time.perf_counter() - start
+
+    def report(self, name, elapsed, count):
+        # one thread keeps one core busy, so this is logins per second per core
+        self.stdout.write(
+            f'{name:<16} {elapsed / count * 1e3:8.2f} ms/login {count / elapsed:8.1f} logins/sec/core'
+        )
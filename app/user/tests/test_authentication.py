@@ -0,0 +1,111 @@
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from user.authentication import token_cache
+
+
+ME_URL = reverse('user:me')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test authenticating with a cached token"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = get_user_model().objects.create_user('cached@test.com', 'pass1234', name='cached')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_known_token_skips_database(self):
+        """Test a second request with the same token runs no authentication query"""
+        self.client.get(ME_URL)
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_invalid_token_rejected(self):
+        """Test an unknown token is still rejected"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token not-a-token')
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_rejected(self):
+        """Test a deleted token stops working although it was cached"""
+        self.client.get(ME_URL)
+        self.token.delete()
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_update_refreshes_cache(self):
+        """Test updating the user through the me endpoint is seen by the next request"""
+        self.client.get(ME_URL)
+        self.client.patch(ME_URL, {'name': 'renamed'})
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.data['name'], 'renamed')
+
+    def test_user_update_saves_current_row(self):
+        """Test updating through the me endpoint does not write back the cached copy of the user"""
+        self.client.get(ME_URL)
+        # changed by another process, this one's cached user still has the old hash
+        self.user.set_password('changed1234')
+        get_user_model().objects.filter(pk=self.user.pk).update(password=self.user.password)
+        res = self.client.patch(ME_URL, {'name': 'renamed'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'renamed')
+        self.assertTrue(self.user.check_password('changed1234'))
+
+    def test_deactivated_user_rejected(self):
+        """Test deactivating a user revokes the cached token"""
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_AUTH_CACHE={'LOCAL_TTL': 10})
+    def test_entry_expires(self):
+        """Test a cached token is looked up again once its ttl is over"""
+        token_cache.clear()
+        self.client.get(ME_URL)
+        with patch('core.cache.time.monotonic', return_value=10 ** 9):
+            with self.assertNumQueries(1):
+                self.client.get(ME_URL)
+
+    @override_settings(
+        CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth-test'}},
+        TOKEN_AUTH_CACHE={'SHARED_CACHE_ALIAS': 'shared'},
+    )
+    def test_shared_tier(self):
+        """Test a token cached by another process is read from the shared cache"""
+        self.client.get(ME_URL)
+        token_cache.local.clear()
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(
+        CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth-test'}},
+        TOKEN_AUTH_CACHE={'SHARED_CACHE_ALIAS': 'shared'},
+    )
+    def test_shared_tier_keeps_no_password(self):
+        """Test the shared cache holds the user fields authentication needs, not the password hash"""
+        self.client.get(ME_URL)
+        data = caches['shared'].get(f'auth-token:{self.token.key}')
+        self.assertNotIn(self.user.password, repr(data))
+
+        token_cache.local.clear()
+        res = self.client.patch(ME_URL, {'name': 'renamed'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'renamed')
+        self.assertTrue(self.user.check_password('pass1234'))
@@ -0,0 +1,96 @@
+import threading
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from user.hashers import HashingBusy, HashingPool, ScryptPasswordHasher, TunableArgon2PasswordHasher
+
+
+TOKEN_URL = reverse('user:token')
+CREATE_USER_URL = reverse('user:create')
+# cheap costs keep the tests fast
+FAST_HASHING = {
+    'SCRYPT_N': 2 ** 10, 'SCRYPT_R': 8, 'SCRYPT_P': 1,
+    'ARGON2_TIME_COST': 1, 'ARGON2_MEMORY_COST': 1024, 'ARGON2_PARALLELISM': 1,
+}
+HASHERS = [
+    'user.hashers.ScryptPasswordHasher',
+    'user.hashers.TunableArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+]
+
+
+@override_settings(PASSWORD_HASHERS=HASHERS, PASSWORD_HASHING=FAST_HASHING)
+class PasswordHasherTests(TestCase):
+    """Test the tunable password hashers"""
+
+    def test_scrypt_round_trip(self):
+        """Test a scrypt hash verifies its password only and stores its costs"""
+        encoded = make_password('pass1234')
+        self.assertTrue(encoded.startswith('scrypt$1024$'))
+        self.assertTrue(check_password('pass1234', encoded))
+        self.assertFalse(check_password('wrong', encoded))
+        self.assertFalse(ScryptPasswordHasher().must_update(encoded))
+
+    def test_scrypt_must_update_when_costs_change(self):
+        """Test raising the work factor marks older hashes for a rehash"""
+        encoded = make_password('pass1234')
+        with override_settings(PASSWORD_HASHING={**FAST_HASHING, 'SCRYPT_N': 2 ** 11}):
+            self.assertTrue(ScryptPasswordHasher().must_update(encoded))
+            self.assertTrue(check_password('pass1234', encoded))
+
+    def test_argon2_costs_from_settings(self):
+        """Test the argon2 costs come from PASSWORD_HASHING"""
+        hasher = TunableArgon2PasswordHasher()
+        encoded = make_password('pass1234', hasher='argon2')
+        self.assertIn('m=1024,t=1,p=1', encoded)
+        self.assertTrue(check_password('pass1234', encoded))
+        with override_settings(PASSWORD_HASHING={**FAST_HASHING, 'ARGON2_TIME_COST': 2}):
+            self.assertTrue(hasher.must_update(encoded))
+
+    def test_login_rehashes_outdated_password(self):
+        """Test logging in with a pbkdf2 password stores it again with the preferred hasher"""
+        user = get_user_model().objects.create_user('rehash@test.com')
+        user.password = make_password('pass1234', hasher='pbkdf2_sha256')
+        user.save()
+
+        res = APIClient().post(TOKEN_URL, {'email': 'rehash@test.com', 'password': 'pass1234'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'scrypt')
+        self.assertTrue(user.check_password('pass1234'))
+
+    def test_busy_pool_refuses_signup(self):
+        """Test signups get a 503 instead of waiting when every hashing slot is taken"""
+        pool = HashingPool(max_workers=1, max_queued=0, timeout=0)
+        self.addCleanup(pool.shutdown)
+        pool.slots.acquire()
+        payload = {'email': 'busy@test.com', 'password': 'pass1234', 'name': 'busy'}
+        with patch('user.hashers.hashing_pool', return_value=pool):
+            res = APIClient().post(CREATE_USER_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(get_user_model().objects.filter(email='busy@test.com').exists())
+
+
+class HashingPoolTests(TestCase):
+    """Test the bounded pool running password hashes"""
+
+    def test_runs_on_pool_thread(self):
+        pool = HashingPool(max_workers=2, max_queued=0, timeout=1)
+        self.addCleanup(pool.shutdown)
+        self.assertTrue(pool.run(lambda: threading.current_thread().name).startswith('password-hashing'))
+
+    def test_refuses_beyond_queue(self):
+        """Test a hash is refused once workers and queue slots are all taken"""
+        pool = HashingPool(max_workers=1, max_queued=1, timeout=0)
+        self.addCleanup(pool.shutdown)
+        pool.slots.acquire()
+        self.assertEqual(pool.run(lambda: 'queued'), 'queued')
+        pool.slots.acquire()
+        with self.assertRaises(HashingBusy):
+            pool.run(lambda: 'refused')